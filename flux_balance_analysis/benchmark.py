@@ -0,0 +1,391 @@
+"""Offline benchmark of the knockout calculations on a generated model.
+
+A model with the given number of genes is generated, written to SBML in a
+temporary directory and taken through the same steps as the real runs:
+loading, finding the exchange reactions, setting minimal media, the single
+and double knockouts, collating the results and the blocked reaction
+scan. For each phase the best time over the repeats, the number of LPs
+solved, counted with the instrumentation (instrumentation.py), the peak
+resident memory of the process so far and how much the phase raised that
+peak are written to a json file. The peak is a process-wide high-water
+mark, so a phase that uses less memory than an earlier one shows no
+increase.
+
+Given the json file of an earlier run as a baseline, phases that got
+slower by more than the tolerance are reported as regressions and the
+script fails, so a change to the knockout code can be checked before it
+is merged:
+
+    python benchmark.py 200 baseline.json              on the old code
+    python benchmark.py 200 new.json baseline.json     on the new code
+
+Usage:
+    python benchmark.py [number of genes] [output json] [baseline json]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import resource
+import tempfile
+import numpy as np
+import cobra
+from cobra.solvers import get_solver_name
+import instrumentation
+from fba_utils import *
+from model_cache import load_model_and_exchanges
+from knockout_engine import KnockoutEngine
+from model_arrays import ModelArrays, ArrayKnockoutEngine
+from gene_rules import GeneReactionIndex
+from double_knockout_planner import DoubleKnockoutPlanner
+from single_knockouts import single_knockout_loss_costs, single_knockout_modified_loss_cost
+from double_knockouts import double_function_knockouts, double_knockouts_of_gene
+from flux_variability import find_blocked_reactions
+from result_store import (ResultStore, create_knockout_arrays,
+                          DOUBLE_KNOCKOUT_MEDIA, media_name, write_fragment,
+                          single_knockout_columns, double_knockout_columns)
+from collate_cluster_output import merge_cluster_output, write_double_knockout_csv
+
+
+CARBON_SOURCES = ['D-glucose', 'carbon source 1', 'carbon source 2']
+NITROGEN_SOURCES = ['ammonium', 'nitrogen source 1', 'nitrogen source 2']
+
+
+def synthetic_model(nGenes=200, seed=0):
+    """A random FBA model with about nGenes genes.
+
+    Every carbon and nitrogen source is taken up and fed into a carbon and
+    a nitrogen pathway, each a chain of metabolite pools joined by one to
+    three parallel reactions with different capacities. Biomass needs the
+    end of both chains. Rules are single genes, isoenzymes or complexes,
+    some genes are in more than one reaction and some reactions lead to
+    dead ends, so all the kinds of knockouts and blocked reactions occur.
+    Glucose and ammonium are the default media, as in yeast 7.6.
+
+    Args:
+        nGenes (int): number of genes to generate.
+        seed (int): seed of the random choices.
+
+    Returns:
+        cobra.model: FBA model.
+
+    """
+    random = np.random.RandomState(seed)
+    model = cobra.Model('synthetic_' + str(nGenes))
+    metabolites = {}
+    genes = []
+    reactions = []
+    rules = []
+
+    def metabolite(name):
+        if name not in metabolites:
+            metabolites[name] = cobra.Metabolite('m' + str(len(metabolites)),
+                                                 name=name, compartment='c')
+        return metabolites[name]
+
+    def add_reaction(name, stoichiometry, lowerBound, upperBound, rule=''):
+        r = cobra.Reaction('r' + str(len(reactions)))
+        r.name = name
+        r.add_metabolites({metabolite(m): c for m, c in stoichiometry.items()})
+        r.lower_bound = lowerBound
+        r.upper_bound = upperBound
+        reactions.append(r)
+        rules.append(rule)
+
+    def new_gene():
+        # some genes are reused, i.e. multifunctional
+        if len(genes) > 0 and random.rand() < 0.1:
+            return genes[random.randint(len(genes))]
+        genes.append('YG' + str(len(genes)).zfill(5))
+        return genes[-1]
+
+    def random_rule():
+        kind = random.rand()
+        if kind < 0.6:
+            return new_gene()
+        operator = ' or ' if kind < 0.8 else ' and '
+        return operator.join(sorted(set([new_gene(), new_gene()])))
+
+    for nutrient in CARBON_SOURCES + NITROGEN_SOURCES:
+        default = -10. if nutrient in ('D-glucose', 'ammonium') else 0.
+        add_reaction(nutrient + ' exchange', {nutrient: -1.}, default, 1000.)
+    for nutrient in CARBON_SOURCES:
+        add_reaction(nutrient + ' uptake', {nutrient: -1., 'carbon 0': 1.}, 0., 1000.,
+                     random_rule())
+    for nutrient in NITROGEN_SOURCES:
+        add_reaction(nutrient + ' uptake', {nutrient: -1., 'nitrogen 0': 1.}, 0., 1000.,
+                     random_rule())
+    nLayers = 0
+    while len(genes) < nGenes:
+        for pathway in ('carbon', 'nitrogen'):
+            source = pathway + ' ' + str(nLayers)
+            target = pathway + ' ' + str(nLayers + 1)
+            for k in range(random.randint(1, 4)):
+                add_reaction(source + ' to ' + target + ' ' + str(k),
+                             {source: -1., target: 1.}, 0., random.uniform(2., 20.),
+                             random_rule())
+            if random.rand() < 0.2:
+                add_reaction(source + ' to dead end', {source: -1., source + ' dead end': 1.},
+                             0., 1000., random_rule())
+        nLayers += 1
+    add_reaction('biomass', {'carbon ' + str(nLayers): -1., 'nitrogen ' + str(nLayers): -1.},
+                 0., 1000.)
+    model.add_reactions(reactions)
+    for r, rule in zip(reactions, rules):
+        r.gene_reaction_rule = rule
+    reactions[-1].objective_coefficient = 1.
+    return model
+
+
+def media_of_benchmark():
+    """Every pair of the carbon and nitrogen sources of synthetic_model."""
+    return [(c, n) for c in CARBON_SOURCES for n in NITROGEN_SOURCES]
+
+
+def process_peak_rss_mb():
+    """High-water mark of the resident memory of this process so far."""
+    # kilobytes on linux, bytes on mac
+    scale = 1. if sys.platform == 'darwin' else 1024.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / (1 << 20)
+
+
+class Phases(object):
+    """Times, LP counts and memory of the phases of a benchmark run.
+
+    Args:
+        repeats (int): times each phase is run, the best time is kept.
+
+    """
+
+    def __init__(self, repeats=1):
+        self.repeats = repeats
+        self.results = {}
+        self.order = []
+
+    def run(self, name, function):
+        """Run and time a phase, counting its LPs with the instrumentation.
+
+        Args:
+            name (str): name of the phase.
+            function (function): runs the phase, called without arguments.
+
+        Returns:
+            the return value of the last call of function.
+
+        """
+        recorder = instrumentation.enable()
+        peakBefore = process_peak_rss_mb()
+        seconds = []
+        for _ in range(self.repeats):
+            before = recorder.lpSolves
+            start = time.time()
+            value = function()
+            seconds.append(time.time() - start)
+            nSolves = recorder.lpSolves - before
+        best = min(seconds)
+        peakAfter = process_peak_rss_mb()
+        self.results[name] = {'seconds': best,
+                              'lps': nSolves,
+                              'lps_per_second': nSolves / best if best > 0. else None,
+                              'process_peak_rss_mb': peakAfter,
+                              'peak_rss_increase_mb': peakAfter - peakBefore}
+        self.order.append(name)
+        return value
+
+    def __str__(self):
+        lines = ['%-36s %10s %8s %10s %10s %10s' % ('phase', 'seconds', 'LPs', 'LPs/s',
+                                                    'peak MB', '+peak MB')]
+        for name in self.order:
+            p = self.results[name]
+            lines.append('%-36s %10.3f %8d %10s %10.1f %10.1f' % (
+                name, p['seconds'], p['lps'],
+                '%.1f' % p['lps_per_second'] if p['lps_per_second'] is not None else '-',
+                p['process_peak_rss_mb'], p['peak_rss_increase_mb']))
+        return '\n'.join(lines)
+
+
+def run_benchmark(nGenes=200, repeats=1, maxPairs=2000, seed=0):
+    """Time the knockout calculations on a synthetic model.
+
+    Args:
+        nGenes (int): size of the synthetic model.
+        repeats (int): times each phase is run.
+        maxPairs (int): number of double knockout pairs.
+        seed (int): seed of the synthetic model.
+
+    Returns:
+        dict: model size, machine and per-phase results, as written to json.
+
+    """
+    workDir = tempfile.mkdtemp()
+    try:
+        modelPath = os.path.join(workDir, 'synthetic.xml')
+        cobra.io.write_sbml_model(synthetic_model(nGenes, seed), modelPath)
+        phases = Phases(repeats)
+
+        def load_from_sbml():
+            shutil.rmtree(os.path.join(workDir, 'cache'), ignore_errors=True)
+            return load_model_and_exchanges(modelPath)
+
+        phases.run('model_load_sbml', load_from_sbml)
+        model, exchangeReactions = phases.run('model_load_cached',
+                                              lambda: load_model_and_exchanges(modelPath))
+        phases.run('get_exchange_reactions', lambda: get_exchange_reactions(model))
+        media = media_of_benchmark()
+        phases.run('minimal_media', lambda: [minimal_media(model, c, n) for c, n in media])
+
+        model, exchangeReactions = load_model_and_exchanges(modelPath)
+        geneRules = GeneReactionIndex(model)
+        engine = KnockoutEngine(model, cache=False)
+        mediumConfig = MediumConfiguration(model, exchangeReactions)
+
+        def single_knockouts():
+            columns = []
+            for c, n in media:
+                mediumConfig.set_minimal_media(c, n, engine=engine)
+                wtGrowth = engine.optimize()
+                grew, glc, flc = single_knockout_loss_costs(model, engine=engine,
+                                                            geneRules=geneRules)
+                if grew:
+                    columns.append(single_knockout_columns(c, n, wtGrowth, glc, flc))
+            return columns
+
+        singleColumns = phases.run('single_knockout_loss_costs', single_knockouts)
+        mediumConfig.set_minimal_media(media[0][0], media[0][1], engine=engine)
+        phases.run('single_knockout_modified_loss_cost',
+                   lambda: single_knockout_modified_loss_cost(model, engine=engine,
+                                                              geneRules=geneRules))
+
+        model = load_sd_minus_his(modelPath)
+        engine = KnockoutEngine(model, cache=False)
+        genes = geneRules.genes
+        rows = []
+        nPairs = 0
+        for i in range(len(genes) - 1):
+            others = genes[i + 1:i + 1 + maxPairs - nPairs]
+            if len(others) == 0:
+                break
+            rows.append((genes[i], others))
+            nPairs += len(others)
+
+        def double_knockouts():
+            planner = DoubleKnockoutPlanner(geneRules, engine)
+            return [double_function_knockouts(model, gene, others, planner=planner)
+                    for gene, others in rows]
+
+        phases.run('double_function_knockouts', double_knockouts)
+        arrays = ModelArrays.from_model(model)
+        try:
+            arrayEngine = ArrayKnockoutEngine(arrays, cache=False)
+        except UserWarning as error:
+            # no HiGHS or GLPK, and a model too large for the dense simplex
+            print error
+            arrayEngine = None
+
+        def double_knockouts_linprog():
+            planner = DoubleKnockoutPlanner(geneRules, arrayEngine)
+            return [double_knockouts_of_gene(None, gene, others, planner=planner)
+                    for gene, others in rows]
+
+        if arrayEngine is not None:
+            doubleGrowth = phases.run('double_knockouts_linprog', double_knockouts_linprog)
+        else:
+            planner = DoubleKnockoutPlanner(geneRules, engine)
+            doubleGrowth = [double_knockouts_of_gene(model, gene, others, planner=planner)
+                            for gene, others in rows]
+        doubleColumns = [double_knockout_columns(glc, flc) for glc, flc in doubleGrowth]
+
+        clusterDir = os.path.join(workDir, 'cluster_output')
+        for k, columns in enumerate(singleColumns):
+            write_fragment(os.path.join(clusterDir, 'single_knockouts_' + str(k) + '.npz'),
+                           **columns)
+        for k, columns in enumerate(doubleColumns):
+            write_fragment(os.path.join(clusterDir, 'double_knockouts_' + str(k) + '.npz'),
+                           **columns)
+
+        def collate():
+            storeDir = os.path.join(workDir, 'results')
+            shutil.rmtree(storeDir, ignore_errors=True)
+            store = ResultStore.create(storeDir, {
+                'genes': genes,
+                'media': [media_name(c, n) for c, n in media],
+                'double_media': DOUBLE_KNOCKOUT_MEDIA})
+            create_knockout_arrays(store)
+            merge_cluster_output(store, clusterDir)
+            write_double_knockout_csv(os.path.join(workDir, 'double_function_loss_growth.csv'),
+                                      genes, store.array('double_function_loss_growth')[0])
+
+        phases.run('collation', collate)
+        model = load_model_and_exchanges(modelPath)[0]
+        phases.run('blocked_reaction_scan', lambda: find_blocked_reactions(model))
+        print phases
+        return {'model': {'genes': len(model.genes),
+                          'reactions': len(model.reactions),
+                          'metabolites': len(model.metabolites),
+                          'double_knockout_pairs': nPairs,
+                          'seed': seed},
+                'machine': {'host': platform.node(),
+                            'python': platform.python_version(),
+                            'cobra': cobra.__version__,
+                            'solver': get_solver_name()},
+                'repeats': repeats,
+                'phases': phases.results,
+                'instrumentation': instrumentation.summary()}
+    finally:
+        instrumentation.disable()
+        shutil.rmtree(workDir)
+
+
+def compare_to_baseline(results, baseline, tolerance=0.2, minSeconds=0.05):
+    """Phases that are slower than in a baseline run.
+
+    Args:
+        results (dict): output of run_benchmark.
+        baseline (dict): output of run_benchmark on the code to compare to.
+        tolerance (float): allowed fractional increase in time.
+        minSeconds (float): smaller increases are ignored as noise.
+
+    Returns:
+        list(str): a message per phase that got slower.
+
+    """
+    if results['model'] != baseline['model']:
+        raise UserWarning('ERROR: baseline was run on a different model')
+    regressions = []
+    for name in sorted(results['phases']):
+        if name not in baseline['phases']:
+            continue
+        new = results['phases'][name]['seconds']
+        old = baseline['phases'][name]['seconds']
+        if new > old * (1. + tolerance) and new - old > minSeconds:
+            regressions.append('%s: %.3f s, baseline %.3f s' % (name, new, old))
+    return regressions
+
+
+def main():
+    if len(sys.argv) > 4:
+        raise UserWarning('Usage: python benchmark.py [number of genes] '
+                          '[output json] [baseline json]')
+    nGenes = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    outPath = sys.argv[2] if len(sys.argv) > 2 else 'benchmark.json'
+    results = run_benchmark(nGenes)
+    with open(outPath, 'w') as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+    if len(sys.argv) > 3:
+        with open(sys.argv[3], 'r') as f:
+            baseline = json.load(f)
+        for name in sorted(results['phases']):
+            if name in baseline['phases']:
+                print '%-36s %6.2fx baseline time' % (
+                    name, results['phases'][name]['seconds'] /
+                    max(baseline['phases'][name]['seconds'], 1.e-9))
+        regressions = compare_to_baseline(results, baseline)
+        if len(regressions) > 0:
+            raise UserWarning('ERROR: slower than baseline\n' + '\n'.join(regressions))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,142 @@
-"""Script to read in all the costs and write to csv."""
+"""Script to merge the cluster output into the result store and write csv/tsv files.
 
+Usage:
+    python collate_cluster_output.py merge   merge the output so far, e.g.
+                                             while jobs are still running
+    python collate_cluster_output.py         merge and, once every job has
+                                             finished, write csv/tsv files
+
+Jobs run with the FBA_PROFILE environment variable set leave a json
+summary next to their output (see instrumentation.py). Both commands add
+these up into profile_report.json in the model directory. Both also
+print how many knockouts ended in a failed LP, from the status arrays of
+the store.
+"""
+
+import sys
 import os
-import cPickle as pickle
-from collections import defaultdict
-import cobra
+import json
+from glob import glob
+import numpy as np
+import pandas as pd
+import instrumentation
 from fba_utils import *
+from gene_rules import GeneReactionIndex
+from model_cache import load_model
+from result_store import knockout_store, STATUS_ARRAYS, STATUS_CODES
+
+
+def merge_cluster_output(store, clusterDir):
+    """Merge new fragment files written by the cluster jobs into the store.
+
+    Merged files are recorded, with their size and modification time, in a
+    checkpoint file in the store, so that repeated calls while jobs are
+    still running only merge what has landed since. A fragment that is
+    rewritten, e.g. by a rerun job, is merged again. One fragment is in
+    memory at a time.
+
+    Args:
+        store (ResultStore): knockout results of the model.
+        clusterDir (str): directory the cluster jobs write to.
+
+    Returns:
+        int: number of fragment files merged.
+
+    """
+    checkpointPath = os.path.join(store.path, 'merged_fragments.tsv')
+    merged = set()
+    if os.path.exists(checkpointPath):
+        with open(checkpointPath, 'r') as f:
+            merged = set([tuple(l.rstrip('\n').split('\t')) for l in f])
+    paths = sorted(glob(os.path.join(clusterDir, 'single_knockouts_*.npz')) +
+                   glob(os.path.join(clusterDir, 'double_knockouts_*.npz')))
+    # fragments still being written by a job, see write_fragment
+    paths = [p for p in paths if not p.endswith('.tmp.npz')]
+    nMerged = 0
+    with open(checkpointPath, 'a') as checkpoint:
+        for path in paths:
+            stat = os.stat(path)
+            entry = (os.path.basename(path), repr(stat.st_mtime), str(stat.st_size))
+            if entry in merged:
+                continue
+            store.merge_fragment(path)
+            checkpoint.write('\t'.join(entry) + '\n')
+            checkpoint.flush()
+            nMerged += 1
+    return nMerged
+
+
+def print_progress(store):
+    """Print how much of the single and double knockouts are in the store."""
+    wtGrowth = store.array('wildtype_growth')
+    print (~np.isnan(wtGrowth)).sum(), '/', len(wtGrowth), 'media done'
+    dblGrowth = store.array('double_function_loss_growth')[0]
+    nDone = 0
+    nPairs = 0
+    # one row at a time, to keep memory flat for large models
+    for i in range(dblGrowth.shape[0] - 1):
+        nDone += (~np.isnan(dblGrowth[i, i + 1:])).sum()
+        nPairs += dblGrowth.shape[0] - i - 1
+    print nDone, '/', nPairs, 'double knockouts done'
+
+
+def print_failed_knockouts(store):
+    """Print the number of results whose LP failed, per status array.
+
+    Returns:
+        int: number of failed results in the store.
+
+    """
+    nFailed = 0
+    for name in STATUS_ARRAYS:
+        status = store.array(name)
+        n = 0
+        # one row at a time, as in print_progress
+        for row in status.reshape(-1, status.shape[-1]):
+            n += (row == STATUS_CODES['failed']).sum()
+        if name.startswith('double_'):
+            # pairs are stored both ways round
+            n //= 2
+        if n > 0:
+            print n, 'failed LPs in', name
+        nFailed += n
+    return nFailed
+
+
+def write_profile_report(modelDir, clusterDir):
+    """Add up the summaries of the jobs that were profiled, if any.
+
+    Returns:
+        dict: the report, None if no job wrote a summary.
+
+    """
+    paths = sorted(glob(os.path.join(clusterDir, '*.profile.json')))
+    if len(paths) == 0:
+        return None
+    report = instrumentation.aggregate_summaries(paths)
+    if instrumentation.enabled():
+        report['collator'] = instrumentation.summary()
+    with open(os.path.join(modelDir, 'profile_report.json'), 'w') as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+    print instrumentation.format_report(report)
+    return report
+
+
+def update_store(modelPath):
+    """Merge the cluster output that has landed so far and print progress.
+
+    Can be run any number of times while the cluster jobs are running.
+    """
+    modelName = modelPath.split('/')[-1][:-4]
+    modelDir = '../models/' + modelName
+    model = load_model(modelPath)
+    store = knockout_store(modelDir, GeneReactionIndex(model).genes)
+    with instrumentation.phase('merge_fragments'):
+        print merge_cluster_output(store, os.path.join(modelDir, 'cluster_output')),
+    print 'new output files merged'
+    print_progress(store)
+    print_failed_knockouts(store)
+    write_profile_report(modelDir, os.path.join(modelDir, 'cluster_output'))
 
 
 def collate_cluster_output(modelPath):
@@ -16,114 +148,87 @@ def collate_cluster_output(modelPath):
     noGrowthOutPath = os.path.join(modelDir, 'minimal_media_no_growth.tsv')
     dblGenePath = os.path.join(modelDir, 'double_gene_loss_growth.csv')
     dblFunctionPath = os.path.join(modelDir, 'double_function_loss_growth.csv')
-    model = cobra.io.read_sbml_model(modelPath)
-    modelGeneNames = set([g.id for g in model.genes])
-    with open('../data/processed/carbon_sources.txt', 'r') as f:
-        carbonSourceNames = [l.strip() for l in f.readlines()]
-    with open('../data/processed/nitrogen_sources.txt', 'r') as f:
-        nitrogenSourceNames = [l.strip() for l in f.readlines()]
-    mediaWithGrowth = []
-    mediaNoGrowth = []
-    glc = defaultdict(list)
-    flc = defaultdict(list)
-    dblGLC = {}
-    dblFLC = {}
-    for c in carbonSourceNames:
-        for n in nitrogenSourceNames:
-            fnGLC = ('gene_loss_cost_' + c + '_AND_' + n + '.pkl').replace(' ', '_')
-            glcInPath = os.path.join(clusterDir, fnGLC)
-            if not os.path.exists(glcInPath):
-                model = minimal_media(model, c, n)
-                if model.optimize().f > 0.01:
-                    raise UserWarning('growth on media but no file found\n' +
-                                       c + ' AND ' + n)
-                mediaNoGrowth.append((c, n))
-                continue
-            with open(glcInPath, 'r') as f:
-                mediaWithGrowth.append((c, n))
-                glcOneMedia = pickle.load(f)
-                if set(glcOneMedia.keys()) != modelGeneNames:
-                    raise UserWarning('Unknown or missing genes in:'+glcInPath)
-                for geneName, cost in glcOneMedia.items():
-                    glc[geneName].append(cost)
-            fnFLC = ('function_loss_cost_' + c + '_AND_' + n + '.pkl').replace(' ', '_')
-            flcInPath = os.path.join(clusterDir, fnFLC)
-            with open(flcInPath, 'r') as f:
-                flcOneMedia = pickle.load(f)
-                if set(flcOneMedia.keys()) != modelGeneNames:
-                    raise UserWarning('Unknown or missing genes in:'+flcInPath)
-                for geneName, cost in flcOneMedia.items():
-                    flc[geneName].append(cost)
-    print len(mediaNoGrowth), '/', len(carbonSourceNames) * len(nitrogenSourceNames),
+    model = load_model(modelPath)
+    genes = GeneReactionIndex(model).genes
+    store = knockout_store(modelDir, genes)
+    with instrumentation.phase('merge_fragments'):
+        merge_cluster_output(store, clusterDir)
+    write_profile_report(modelDir, clusterDir)
+    print_failed_knockouts(store)
+    media = store.labels('media')
+    wtGrowth = np.array(store.array('wildtype_growth'))
+    for i in np.flatnonzero(np.isnan(wtGrowth)):
+        c, n = media[i].split(' AND ')
+        model = minimal_media(model, c, n)
+        if model.optimize().f > 0.01:
+            raise UserWarning('growth on media but no file found\n' +
+                               c + ' AND ' + n)
+        wtGrowth[i] = 0.
+    grew = wtGrowth >= 0.01
+    mediaWithGrowth = [m for m, g in zip(media, grew) if g]
+    glc = store.array('gene_loss_cost')[:, grew]
+    flc = store.array('function_loss_cost')[:, grew]
+    if np.isnan(glc).any() or np.isnan(flc).any():
+        raise UserWarning('Missing gene costs in media with growth')
+    print len(media) - len(mediaWithGrowth), '/', len(media),
     print 'Environments with no wildtype growth'
-    ########### Load double function knockouts #######################
-    for i in range(len(model.genes) - 1):
-        filePath = os.path.join(clusterDir,
-                                'growth_double_function_knockouts_'+str(i)+'.pkl')
-        if not os.path.exists(filePath):
-            raise UserWarning(filePath + ' does not exist')
-        with open(filePath, 'r') as f:
-                    dblFunctionKO = pickle.load(f)
-                    if len(dblFunctionKO) != (len(model.genes) - i) - 1:
-                        raise UserWarning('Unexpected number of double knockouts'
-                                          ' in file: ' + filePath + 'found ' +
-                                           str(len(dblFunctionKO)) + ' expected: '
-                                           + str((len(model.genes) - i) - 1))
-                    if any([k in dblFLC for k in dblFunctionKO]):
-                        raise UserWarning('Duplicate entries in results')
-                    dblFLC.update(dblFunctionKO)
-    ########### Load double gene knockouts #######################
-    for i in range(len(model.genes) - 1):
-        filePath = os.path.join(clusterDir,
-                                'growth_double_gene_knockouts_'+str(i)+'.pkl')
-        if not os.path.exists(filePath):
-            raise UserWarning(filePath + ' does not exist')
-        with open(filePath, 'r') as f:
-            result = pickle.load(f)
-            for i in range(result['data'].shape[0]):
-                geneA = result['x'][i]
-                for j in range(result['data'].shape[1]):
-                    geneB = result['y'][j]
-                    dblGLC[(geneA, geneB)] = result['data'][i, j]
+    for name in ['double_gene_loss_growth', 'double_function_loss_growth']:
+        dblGrowth = store.array(name)[0]
+        for i in range(len(genes) - 1):
+            if np.isnan(dblGrowth[i, i + 1:]).any():
+                raise UserWarning('Missing ' + name + ' of ' + genes[i] +
+                                  ', run with merge to see progress')
     ################### write out data ###############################
     if not os.path.exists(noGrowthOutPath):
         with open(noGrowthOutPath, 'w') as f:
-            for c, n in mediaNoGrowth:
-                f.write(c + '\t' + n + '\n')
+            for m, g in zip(media, grew):
+                if not g:
+                    f.write(m.replace(' AND ', '\t') + '\n')
     else:
         print noGrowthOutPath, 'already exists'
-    if not os.path.exists(flcOutPath):
-        with open(flcOutPath, 'w') as f:
-            f.write('ORF ID\t' + '\t'.join([' AND '.join(cn)
-                                          for cn in mediaWithGrowth]) + '\n')
-            for geneName, costs in flc.items():
-                f.write(geneName + '\t' + '\t'.join([str(c) for c in costs])+'\n')
-    else:
-        print flcOutPath, 'already exists'
-    if not os.path.exists(glcOutPath):
-        with open(glcOutPath, 'w') as f:
-            f.write('ORF ID\t' + '\t'.join([' AND '.join(cn)
-                                          for cn in mediaWithGrowth]) + '\n')
-            for geneName, costs in glc.items():
-                f.write(geneName + '\t' + '\t'.join([str(c) for c in costs])+'\n')
-    else:
-        print glcOutPath, 'already exists'
-    if not os.path.exists(dblGenePath):
-        with open(dblGenePath, 'w') as f:
-            for (geneA, geneB), growth in dblGLC.items():
-                f.write(geneA + ',' + geneB + ',' + str(growth) + '\n')
-    else:
-        print dblGenePath, 'already exists'
-    if not os.path.exists(dblFunctionPath):
-        with open(dblFunctionPath, 'w') as f:
-            for (geneA, geneB), growth in dblFLC.items():
-                f.write(geneA + ',' + geneB + ',' + str(growth) + '\n')
-    else:
-        print dblFunctionPath, 'already exists'
+    for outPath, costs in [(flcOutPath, flc), (glcOutPath, glc)]:
+        if not os.path.exists(outPath):
+            pd.DataFrame(costs, index=genes, columns=mediaWithGrowth).to_csv(
+                outPath, sep='\t', index_label='ORF ID', float_format='%.12g')
+        else:
+            print outPath, 'already exists'
+    for outPath, name in [(dblGenePath, 'double_gene_loss_growth'),
+                          (dblFunctionPath, 'double_function_loss_growth')]:
+        if not os.path.exists(outPath):
+            write_double_knockout_csv(outPath, genes, store.array(name)[0])
+        else:
+            print outPath, 'already exists'
+
+
+def write_double_knockout_csv(outPath, genes, growth, rowsPerChunk=64):
+    """Write geneA,geneB,growth lines for each pair, a block of rows at a time.
+
+    Args:
+        outPath (str): csv file.
+        genes (list(str)): ORF IDs.
+        growth (array(float)): genes x genes double knockout growth.
+        rowsPerChunk (int): genes whose pairs are written together.
+
+    """
+    genes = np.array(genes)
+    with open(outPath, 'w') as f:
+        for first in range(0, len(genes) - 1, rowsPerChunk):
+            chunk = range(first, min(first + rowsPerChunk, len(genes) - 1))
+            rows = np.concatenate([np.repeat(i, len(genes) - i - 1) for i in chunk])
+            cols = np.concatenate([np.arange(i + 1, len(genes)) for i in chunk])
+            pd.DataFrame({'geneA': genes[rows], 'geneB': genes[cols],
+                          'growth': growth[rows, cols]},
+                         columns=['geneA', 'geneB', 'growth']).to_csv(
+                f, header=False, index=False, float_format='%.12g')
 
 
 def main():
-    collate_cluster_output('../data/external/yeast_7.6/yeast_7.6.xml')
+    modelPath = '../data/external/yeast_7.6/yeast_7.6.xml'
+    instrumentation.enable_from_environment()
+    if len(sys.argv) > 1 and sys.argv[1] == 'merge':
+        update_store(modelPath)
+    else:
+        collate_cluster_output(modelPath)
 
 
 if __name__ == '__main__':
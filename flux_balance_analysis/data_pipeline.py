@@ -0,0 +1,293 @@
+"""Download and processing of the input data, driven by a manifest.
+
+The manifest is a json file with two lists:
+
+    downloads: {"name", "url", "sha256", "archive", "output"}
+        archive is "gzip", "zip" or null. sha256 is the hash of the
+        downloaded file. If null, the hash of the first download is kept
+        in the state file and later downloads have to match it.
+    steps: {"name", "function", "inputs", "outputs"}
+        function is called with the input paths followed by the output
+        paths.
+
+Downloads run in parallel threads and resume from partial files with HTTP
+range requests. A resumed download that fails its hash check is fetched
+again from the start. Archives are decompressed in-process, streaming from the
+downloaded file. The hashes of the downloads and of the inputs of every
+step are kept in a state file, so a download or step is only redone when
+its output is missing or its inputs changed. Any url urllib2 can open
+works, so a manifest pointing at a file:// mirror runs offline.
+"""
+
+import os
+import json
+import gzip
+import shutil
+import hashlib
+import urllib2
+import zipfile
+from multiprocessing.pool import ThreadPool
+
+
+BLOCK_SIZE = 1 << 20
+
+
+def read_manifest(path):
+    """Downloads and steps of a manifest file.
+
+    Paths in the manifest are relative to the directory of the manifest.
+
+    Returns:
+        list(dict): downloads.
+        list(dict): processing steps.
+
+    """
+    with open(path, 'r') as f:
+        manifest = json.load(f)
+    baseDir = os.path.dirname(os.path.abspath(path))
+    downloads = []
+    for d in manifest['downloads']:
+        d = dict(d)
+        d['output'] = os.path.normpath(os.path.join(baseDir, d['output']))
+        downloads.append(d)
+    steps = []
+    for s in manifest['steps']:
+        s = dict(s)
+        s['inputs'] = [os.path.normpath(os.path.join(baseDir, p)) for p in s['inputs']]
+        s['outputs'] = [os.path.normpath(os.path.join(baseDir, p)) for p in s['outputs']]
+        steps.append(s)
+    return downloads, steps
+
+
+def file_sha256(path):
+    """SHA-256 of a file, or of all the files under a directory."""
+    sha = hashlib.sha256()
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for fileName in sorted(files):
+                filePath = os.path.join(root, fileName)
+                sha.update(os.path.relpath(filePath, path))
+                sha.update(file_sha256(filePath))
+        return sha.hexdigest()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def fetch(url, path):
+    """Download a url, resuming from a partial file left by an earlier try.
+
+    The data goes to path + '.part' and is renamed to path when complete.
+
+    Returns:
+        str: path of the downloaded file.
+
+    """
+    partPath = path + '.part'
+    offset = os.path.getsize(partPath) if os.path.exists(partPath) else 0
+    request = urllib2.Request(url)
+    if offset > 0:
+        request.add_header('Range', 'bytes=' + str(offset) + '-')
+    try:
+        response = urllib2.urlopen(request)
+    except urllib2.HTTPError as e:
+        # the partial file already holds the whole download
+        if e.code != 416:
+            raise
+        os.rename(partPath, path)
+        return path
+    # servers that ignore the range, and file:// urls, send the whole file
+    mode = 'ab' if response.getcode() == 206 else 'wb'
+    try:
+        with open(partPath, mode) as f:
+            shutil.copyfileobj(response, f, BLOCK_SIZE)
+    finally:
+        response.close()
+    os.rename(partPath, path)
+    return path
+
+
+def extract(archivePath, archive, output):
+    """Decompress a downloaded file into output, streaming from disk.
+
+    Args:
+        archivePath (str): downloaded file.
+        archive (str): 'gzip' or 'zip'.
+        output (str): decompressed file for gzip, directory to extract
+                      into for zip.
+
+    """
+    if archive == 'gzip':
+        tmpPath = output + '.tmp'
+        with open(tmpPath, 'wb') as fOut:
+            fIn = gzip.open(archivePath, 'rb')
+            try:
+                shutil.copyfileobj(fIn, fOut, BLOCK_SIZE)
+            finally:
+                fIn.close()
+        os.rename(tmpPath, output)
+    elif archive == 'zip':
+        zipFile = zipfile.ZipFile(archivePath)
+        try:
+            zipFile.extractall(os.path.dirname(output))
+        finally:
+            zipFile.close()
+        if not os.path.exists(output):
+            raise UserWarning('ERROR: ' + archivePath + ' did not contain ' + output)
+    else:
+        raise UserWarning('ERROR: unknown archive type ' + str(archive))
+
+
+def download(entry):
+    """Fetch, check and unpack one download of the manifest.
+
+    Returns:
+        str: name of the download.
+        str: SHA-256 of the downloaded file.
+
+    """
+    output = entry['output']
+    outDir = os.path.dirname(output)
+    if not os.path.exists(outDir):
+        try:
+            os.makedirs(outDir)
+        except OSError:
+            if not os.path.isdir(outDir):
+                raise
+    archive = entry.get('archive')
+    if archive is None:
+        fetchPath = output
+    else:
+        fetchPath = os.path.join(outDir, entry['url'].split('/')[-1])
+    resumed = os.path.exists(fetchPath + '.part')
+    fetch(entry['url'], fetchPath)
+    sha256 = file_sha256(fetchPath)
+    expected = entry.get('sha256')
+    if expected is not None and sha256 != expected and resumed:
+        # the partial file may be from an earlier version of the file
+        os.remove(fetchPath)
+        fetch(entry['url'], fetchPath)
+        sha256 = file_sha256(fetchPath)
+    if expected is not None and sha256 != expected:
+        os.remove(fetchPath)
+        raise UserWarning('ERROR: ' + entry['url'] + ' has SHA-256 ' + sha256 +
+                          ', expected ' + expected)
+    if archive is not None:
+        extract(fetchPath, archive, output)
+        os.remove(fetchPath)
+    print 'downloaded', entry['name']
+    return entry['name'], sha256
+
+
+class PipelineState(object):
+    """Hashes of finished downloads and steps, kept in a json file.
+
+    File hashes are remembered with the size and modification time of the
+    file, so unchanged inputs are not hashed again on every run.
+
+    Args:
+        path (str): state file.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                state = json.load(f)
+        else:
+            state = {}
+        self.downloads = state.get('downloads', {})
+        self.steps = state.get('steps', {})
+        self.files = state.get('files', {})
+
+    def save(self):
+        tmpPath = self.path + '.tmp'
+        with open(tmpPath, 'w') as f:
+            json.dump({'downloads': self.downloads, 'steps': self.steps,
+                       'files': self.files}, f, indent=1, sort_keys=True)
+        os.rename(tmpPath, self.path)
+
+    def sha256(self, path):
+        """Hash of a file or directory, None if it does not exist."""
+        if not os.path.exists(path):
+            return None
+        if os.path.isdir(path):
+            return file_sha256(path)
+        stat = os.stat(path)
+        key = [stat.st_size, repr(stat.st_mtime)]
+        if path not in self.files or self.files[path][:2] != key:
+            self.files[path] = key + [file_sha256(path)]
+        return self.files[path][2]
+
+    def expected_sha256(self, entry):
+        """Hash from the manifest, or else the one of the first download."""
+        if entry.get('sha256') is not None:
+            return entry['sha256']
+        return self.downloads.get(entry['name'])
+
+    def download_is_stale(self, entry):
+        if not os.path.exists(entry['output']):
+            return True
+        # data downloaded before the state file existed is kept
+        recorded = self.downloads.get(entry['name'])
+        return (entry.get('sha256') is not None and recorded is not None and
+                recorded != entry['sha256'])
+
+    def step_is_stale(self, step):
+        if not all(os.path.exists(p) for p in step['outputs']):
+            return True
+        return self.steps.get(step['name']) != self.input_hashes(step)
+
+    def input_hashes(self, step):
+        return {p: self.sha256(p) for p in step['inputs']}
+
+
+def run_pipeline(manifestPath, statePath, functions, nThreads=4):
+    """Bring the downloads and processed outputs of a manifest up to date.
+
+    Args:
+        manifestPath (str): manifest json file.
+        statePath (str): file to keep the hashes of finished work in.
+        functions (dict(str: function)): processing function per name used
+                                         in the steps of the manifest.
+        nThreads (int): number of parallel downloads.
+
+    """
+    downloads, steps = read_manifest(manifestPath)
+    state = PipelineState(statePath)
+    stale = [d for d in downloads if state.download_is_stale(d)]
+    for d in downloads:
+        if d not in stale:
+            print d['name'], 'up to date. Skipping.'
+    stale = [dict(d, sha256=state.expected_sha256(d)) for d in stale]
+    if len(stale) > 0:
+        pool = ThreadPool(min(nThreads, len(stale)))
+        try:
+            for name, sha256 in pool.imap_unordered(download, stale):
+                state.downloads[name] = sha256
+                state.save()
+        finally:
+            pool.close()
+            pool.join()
+    for step in steps:
+        missing = [p for p in step['inputs'] if not os.path.exists(p)]
+        if len(missing) > 0:
+            if all(os.path.exists(p) for p in step['outputs']):
+                print step['name'], 'inputs not found, keeping existing outputs.'
+                continue
+            raise UserWarning('ERROR: missing inputs for ' + step['name'] +
+                              ': ' + ', '.join(missing))
+        if not state.step_is_stale(step):
+            print step['name'], 'up to date. Skipping.'
+            continue
+        for outPath in step['outputs']:
+            outDir = os.path.dirname(outPath)
+            if not os.path.exists(outDir):
+                os.makedirs(outDir)
+        print 'running', step['name']
+        functions[step['function']](*(step['inputs'] + step['outputs']))
+        state.steps[step['name']] = state.input_hashes(step)
+        state.save()
@@ -0,0 +1,239 @@
+"""Solve each distinct double knockout only once.
+
+Many gene pairs delete the same set of reactions: genes that are in
+exactly the same reactions, e.g. two isoenzymes of a one-reaction rule,
+give identical rows, and if one gene's reactions contain the other's the
+pair is the single knockout of the first. So the pairs are planned by the
+set of reactions they delete, each distinct set is solved once, and the
+growth is broadcast back to the pairs. Pairs with a lethal single
+knockout are lethal and need no LP at all, since deleting more reactions
+can not increase growth. Their status is the worse of the statuses of
+the two single knockouts.
+
+Growth values are cached for the bounds the engine had when the planner
+was built, so a planner must not be reused after changing the media.
+"""
+
+import numpy as np
+import instrumentation
+from knockout_pruning import KnockoutPruner
+from result_store import STATUS_CODES
+
+
+class DoubleKnockoutPlanner(object):
+    """Plans and solves double knockouts by their deleted reaction sets.
+
+    Args:
+        geneRules (GeneReactionIndex): gene to reaction lookups for the model.
+        engine (KnockoutEngine): solver instance for the model.
+        pruner (KnockoutPruner): skips reaction sets that can not change
+                                 growth. Built from the engine if not given.
+        lethalGrowth (float): single knockouts with growth at or below
+                              this are lethal.
+
+    """
+
+    def __init__(self, geneRules, engine, pruner=None, lethalGrowth=1.e-9):
+        self.geneRules = geneRules
+        self.engine = engine
+        self.pruner = pruner if pruner is not None else KnockoutPruner.from_engine(engine)
+        self.lethalGrowth = lethalGrowth
+        # growth and status code per frozenset of deleted reaction positions
+        self.growth = {}
+        self.statusCodes = {}
+        self.singleReactions = {'gene': {}, 'function': {}}
+        self.nPairs = 0
+        self.nLethal = 0
+        self.nDistinct = 0
+
+    def single_reactions(self, gene, costType):
+        """Reactions deleted by knocking out one gene.
+
+        Args:
+            gene (str): ORF ID.
+            costType (str): 'gene' for reactions whose rule evaluates to
+                            false, 'function' for every reaction the gene is in.
+
+        Returns:
+            frozenset(int): reaction positions.
+
+        """
+        singles = self.singleReactions[costType]
+        if gene not in singles:
+            if costType == 'gene':
+                singles[gene] = frozenset(self.geneRules.gene_loss_reactions([gene]))
+            elif costType == 'function':
+                singles[gene] = frozenset(self.geneRules.reactions_of(gene))
+            else:
+                raise UserWarning('ERROR: unknown cost type ' + costType)
+        return singles[gene]
+
+    def pair_reactions(self, geneA, geneB, costType):
+        """Reactions deleted by knocking out two genes."""
+        if costType == 'function':
+            return self.single_reactions(geneA, costType) | self.single_reactions(geneB, costType)
+        return frozenset(self.geneRules.gene_loss_reactions([geneA, geneB]))
+
+    def equivalence_classes(self, genes, costType):
+        """Genes grouped by the set of reactions their knockout deletes.
+
+        Returns:
+            dict(frozenset(int): list(str)): genes per reaction set.
+
+        """
+        classes = {}
+        for gene in genes:
+            classes.setdefault(self.single_reactions(gene, costType), []).append(gene)
+        return classes
+
+    def knockout(self, reactions):
+        """Growth after deleting a set of reactions, solved at most once.
+
+        Args:
+            reactions (frozenset(int)): reaction positions.
+
+        Returns:
+            float: growth, 0 where the LP is infeasible.
+
+        """
+        if reactions not in self.growth:
+            growth, status = self.pruner.knockout_with_status(self.engine, reactions)
+            self.growth[reactions] = growth if growth is not None else 0.
+            self.statusCodes[reactions] = status
+        return self.growth[reactions]
+
+    def is_lethal(self, gene, costType):
+        return self.knockout(self.single_reactions(gene, costType)) <= self.lethalGrowth
+
+    def plan(self, pairs, costType):
+        """Distinct reaction sets of a list of gene pairs.
+
+        The single knockouts of the genes are solved here, to find the
+        lethal ones.
+
+        Args:
+            pairs (list(tuple(str, str))): gene pairs.
+            costType (str): 'gene' or 'function'.
+
+        Returns:
+            list(frozenset(int)): distinct reaction sets to solve.
+            array(int): position of the reaction set of each pair in the
+                        list, -1 for pairs with a lethal gene.
+
+        """
+        lethal = {}
+        for pair in pairs:
+            for gene in pair:
+                if gene not in lethal:
+                    lethal[gene] = self.is_lethal(gene, costType)
+        reactionSets = []
+        setIndex = {}
+        # for function-loss, pairs of genes from the same two classes
+        # delete the same reactions
+        classPairs = {}
+        pairIndex = np.empty(len(pairs), dtype=int)
+        for k, (geneA, geneB) in enumerate(pairs):
+            if lethal[geneA] or lethal[geneB]:
+                pairIndex[k] = -1
+                continue
+            if costType == 'function':
+                classKey = frozenset([self.single_reactions(geneA, costType),
+                                      self.single_reactions(geneB, costType)])
+                if classKey not in classPairs:
+                    classPairs[classKey] = self.pair_reactions(geneA, geneB, costType)
+                reactions = classPairs[classKey]
+            else:
+                reactions = self.pair_reactions(geneA, geneB, costType)
+            if reactions not in setIndex:
+                setIndex[reactions] = len(reactionSets)
+                reactionSets.append(reactions)
+            pairIndex[k] = setIndex[reactions]
+        return reactionSets, pairIndex
+
+    def solve(self, pairs, costType):
+        """Growth of each double knockout.
+
+        Args:
+            pairs (list(tuple(str, str))): gene pairs.
+            costType (str): 'gene' or 'function'.
+
+        Returns:
+            array(float): growth per pair, 0 for lethal or infeasible pairs.
+
+        """
+        return self.solve_with_status(pairs, costType)[0]
+
+    def solve_with_status(self, pairs, costType):
+        """Same as solve, with the status of each growth value.
+
+        Returns:
+            array(float): growth per pair, 0 for lethal or infeasible pairs.
+            array(int8): status code per pair, see result_store.STATUS_CODES.
+
+        """
+        reactionSets, pairIndex = self.plan(pairs, costType)
+        newSets = [s for s in reactionSets if s not in self.growth]
+        # lethal pairs have index -1, the 0 at the end
+        growth = np.array([self.knockout(s) for s in reactionSets] + [0.])
+        self._count(len(pairs), int((pairIndex < 0).sum()), len(newSets))
+        return growth[pairIndex], self._pair_status(pairs, costType, reactionSets, pairIndex)
+
+    def solve_both(self, pairs):
+        """Gene-loss and function-loss growth of each double knockout.
+
+        The reaction sets of both cost types are planned together, so a
+        pair whose gene-loss and function-loss sets coincide needs one LP.
+
+        Args:
+            pairs (list(tuple(str, str))): gene pairs.
+
+        Returns:
+            array(float): gene-loss growth per pair.
+            array(float): function-loss growth per pair.
+
+        """
+        geneGrowth, functionGrowth = self.solve_both_with_status(pairs)[:2]
+        return geneGrowth, functionGrowth
+
+    def solve_both_with_status(self, pairs):
+        """Same as solve_both, with the status of each growth value.
+
+        Returns:
+            array(float): gene-loss growth per pair.
+            array(float): function-loss growth per pair.
+            array(int8): gene-loss status code per pair.
+            array(int8): function-loss status code per pair.
+
+        """
+        geneSets, geneIndex = self.plan(pairs, 'gene')
+        functionSets, functionIndex = self.plan(pairs, 'function')
+        newSets = set(s for s in geneSets + functionSets if s not in self.growth)
+        geneGrowth = np.array([self.knockout(s) for s in geneSets] + [0.])
+        functionGrowth = np.array([self.knockout(s) for s in functionSets] + [0.])
+        self._count(2 * len(pairs), int((geneIndex < 0).sum() + (functionIndex < 0).sum()),
+                    len(newSets))
+        return (geneGrowth[geneIndex], functionGrowth[functionIndex],
+                self._pair_status(pairs, 'gene', geneSets, geneIndex),
+                self._pair_status(pairs, 'function', functionSets, functionIndex))
+
+    def _pair_status(self, pairs, costType, reactionSets, pairIndex):
+        """Status code per pair, from the reaction sets of plan."""
+        status = np.array([self.statusCodes[s] for s in reactionSets] +
+                          [STATUS_CODES['optimal']], dtype=np.int8)[pairIndex]
+        for k in np.flatnonzero(pairIndex < 0):
+            status[k] = max(self.statusCodes[self.single_reactions(gene, costType)]
+                            for gene in pairs[k])
+        return status
+
+    def _count(self, nPairs, nLethal, nDistinct):
+        self.nPairs += nPairs
+        self.nLethal += nLethal
+        self.nDistinct += nDistinct
+        instrumentation.count('double_knockouts', nPairs)
+        instrumentation.count('double_knockouts_with_lethal_gene', nLethal)
+        instrumentation.count('double_knockout_reaction_sets_solved', nDistinct)
+
+    def __str__(self):
+        return (str(self.nPairs) + ' double knockouts: ' + str(self.nLethal) +
+                ' with a lethal gene, ' + str(self.nDistinct) +
+                ' distinct reaction sets\n' + str(self.pruner))
@@ -0,0 +1,134 @@
+"""Split the double knockouts into cluster jobs of equal cost.
+
+The gene pairs (i, j) with i < j, in the order of the sorted gene names, are
+walked row by row and cut into shards of the same estimated cost. A shard is
+a list of blocks (i, start, stop): gene i against genes start to stop - 1.
+
+The shards are written to a json manifest, which the cluster jobs and the
+collation script read instead of assuming one job per gene.
+"""
+
+import os
+import json
+import time
+import numpy as np
+
+
+MANIFEST_NAME = 'double_knockout_shards.json'
+
+
+def partition_pairs(nGenes, nShards, geneCosts=None):
+    """Cut the upper-triangular pairs into shards of equal cost.
+
+    Args:
+        nGenes (int): number of genes.
+        nShards (int): number of shards.
+        geneCosts (array(float)): optional measured LP time per gene. The
+                                  cost of a pair is the mean of the costs of
+                                  its two genes. Every pair costs the same
+                                  if not given.
+
+    Returns:
+        list(list(tuple(int, int, int))): blocks (i, start, stop) per shard.
+
+    """
+    rows, cols = np.triu_indices(nGenes, k=1)
+    if geneCosts is None:
+        pairCosts = np.ones(rows.shape)
+    else:
+        geneCosts = np.asarray(geneCosts, dtype=float)
+        pairCosts = (geneCosts[rows] + geneCosts[cols]) / 2.
+    cumulative = np.cumsum(pairCosts)
+    targets = cumulative[-1] * np.arange(1, nShards) / float(nShards)
+    cuts = np.concatenate([[0], np.searchsorted(cumulative, targets, side='right'),
+                           [len(rows)]])
+    shards = []
+    for first, last in zip(cuts[:-1], cuts[1:]):
+        blocks = []
+        position = first
+        while position < last:
+            i = rows[position]
+            # pairs of row i run until the first pair of row i + 1
+            rowEnd = min(last, position + (nGenes - 1 - cols[position]) + 1)
+            blocks.append((int(i), int(cols[position]), int(cols[rowEnd - 1]) + 1))
+            position = rowEnd
+        shards.append(blocks)
+    return shards
+
+
+def measure_gene_lp_times(engine, geneRules, repeats=1):
+    """Time to solve the function-loss knockout of each gene.
+
+    Args:
+        engine (KnockoutEngine): solver instance for the model, built with
+                                 cache=False so every repeat is solved.
+        geneRules (GeneReactionIndex): gene to reaction lookups for the model.
+        repeats (int): number of solves to average over.
+
+    Returns:
+        array(float): seconds per LP, in the order of geneRules.genes.
+
+    """
+    engine.optimize()
+    times = np.zeros(len(geneRules.genes))
+    for i, gene in enumerate(geneRules.genes):
+        start = time.time()
+        for _ in range(repeats):
+            engine.knockout(geneRules.reactions_of(gene))
+        times[i] = (time.time() - start) / repeats
+    return times
+
+
+def write_manifest(outDir, genes, shards):
+    """Write the shards of a double knockout run.
+
+    Args:
+        outDir (str): cluster output directory.
+        genes (list(str)): sorted ORF IDs the block indices refer to.
+        shards (list): output of partition_pairs.
+
+    Returns:
+        str: path of the manifest.
+
+    """
+    if not os.path.exists(outDir):
+        os.makedirs(outDir)
+    path = os.path.join(outDir, MANIFEST_NAME)
+    with open(path, 'w') as f:
+        json.dump({'genes': list(genes), 'shards': shards}, f)
+    return path
+
+
+def read_manifest(outDir):
+    """Genes and shards of a double knockout run.
+
+    Returns:
+        list(str): ORF IDs.
+        list(list(tuple(int, int, int))): blocks per shard.
+
+    """
+    with open(os.path.join(outDir, MANIFEST_NAME), 'r') as f:
+        manifest = json.load(f)
+    genes = [str(g) for g in manifest['genes']]
+    shards = [[tuple(b) for b in blocks] for blocks in manifest['shards']]
+    return genes, shards
+
+
+def shard_pairs(genes, blocks):
+    """The gene pairs of one shard."""
+    return [(genes[i], genes[j]) for i, start, stop in blocks
+            for j in range(start, stop)]
+
+
+def shard_path(outDir, shard):
+    """Fragment file of one shard.
+
+    Args:
+        outDir (str): cluster output directory.
+        shard (int): position of the shard in the manifest.
+
+    Returns:
+        str: path of the npz file.
+
+    """
+    return os.path.join(outDir, 'double_knockouts_shard_' + str(shard) + '.npz')
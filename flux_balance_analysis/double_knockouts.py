@@ -2,14 +2,20 @@
 
 import sys
 import os
-import cPickle as pickle
 import numpy as np
 import cobra
-from cobra.flux_analysis import double_gene_deletion
+import instrumentation
 from fba_utils import *
+from knockout_engine import KnockoutEngine
+from gene_rules import GeneReactionIndex
+from double_knockout_planner import DoubleKnockoutPlanner
+from double_knockout_shards import read_manifest, shard_path
+from knockout_cache import KnockoutJournal, journal_path, journal_sync_interval
+from result_store import write_fragment, double_knockout_columns
 
 
-def double_function_knockouts(model, gene, otherGenes):
+def double_function_knockouts(model, gene, otherGenes, engine=None, geneRules=None,
+                              pruner=None, planner=None):
     """
 
     Args:
@@ -17,24 +23,80 @@ def double_function_knockouts(model, gene, otherGenes):
         gene (str): orf ID of gene to knockout.
         otherGenes list(str): list of other ORFs to knockout
                               together with gene.
+        engine (KnockoutEngine): solver instance for the model. Built from
+                                 the model if not given.
+        geneRules (GeneReactionIndex): gene to reaction lookups for the
+                                       model. Built from the model if not given.
+        pruner (KnockoutPruner): skips pairs that only delete reactions with
+                                 no wild-type flux. Built from the engine
+                                 if not given.
+        planner (DoubleKnockoutPlanner): solves each distinct set of deleted
+                                         reactions once. Built if not given.
 
     Returns:
         dict: growth values of double knockouts.
 
     """
-    growthValues = {}
-    for geneB in otherGenes:
-        growthValues[(gene, geneB)] = double_function_deletion(model, gene, geneB)
-    return growthValues
+    if planner is None:
+        planner = _planner(model, engine, geneRules, pruner)
+    pairs = [(gene, geneB) for geneB in otherGenes]
+    return dict(zip(pairs, planner.solve(pairs, 'function')))
 
 
-def double_function_deletion(model, geneA, geneB):
+def _planner(model, engine, geneRules, pruner):
+    if engine is None:
+        engine = KnockoutEngine(model)
+    if geneRules is None:
+        geneRules = GeneReactionIndex(model)
+    return DoubleKnockoutPlanner(geneRules, engine, pruner)
+
+
+def double_knockouts_of_gene(model, gene, otherGenes, engine=None, geneRules=None,
+                             planner=None, withStatus=False):
+    """Double gene-loss and function-loss growth of one gene with others.
+
+    Both are computed in one pass, and a pair whose gene-loss and
+    function-loss knockouts delete the same reactions is solved once.
+
+    Args:
+        model (cobra.model): FBA model.
+        gene (str): orf ID of gene to knockout.
+        otherGenes list(str): list of other ORFs to knockout
+                              together with gene.
+        engine (KnockoutEngine): solver instance for the model. Built from
+                                 the model if not given.
+        geneRules (GeneReactionIndex): gene to reaction lookups for the
+                                       model. Built from the model if not given.
+        planner (DoubleKnockoutPlanner): solves each distinct set of deleted
+                                         reactions once. Built if not given.
+        withStatus (bool): also return the status code of each growth
+                           value, see result_store.STATUS_CODES.
+
+    Returns:
+        dict((str, str): float): gene-loss growth per gene pair.
+        dict((str, str): float): function-loss growth per gene pair.
+        dict((str, str): int): with withStatus, gene-loss status per gene pair.
+        dict((str, str): int): with withStatus, function-loss status per gene pair.
+
+    """
+    if planner is None:
+        planner = _planner(model, engine, geneRules, None)
+    pairs = [(gene, geneB) for geneB in otherGenes]
+    return tuple(dict(zip(pairs, values))
+                 for values in planner.solve_both_with_status(pairs)[:4 if withStatus else 2])
+
+
+def double_function_deletion(model, geneA, geneB, engine=None, geneRules=None):
     """Knock out all reactions associated with two genes.
 
     Args:
         model (cobra.model): FBA model.
         geneA (str): ORF ID.
         geneB (str): ORF ID.
+        engine (KnockoutEngine): solver instance for the model. Built from
+                                 the model if not given.
+        geneRules (GeneReactionIndex): gene to reaction lookups for the
+                                       model. Built from the model if not given.
 
     Returns:
         float: growth value after double knockout.
@@ -42,48 +104,120 @@ def double_function_deletion(model, geneA, geneB):
     """
     if geneA == geneB:
         raise UserWarning('Genes must not be the same.')
-    modelGenes = set([gene.id for gene in model.genes])
-    if geneA not in modelGenes:
+    if geneRules is None:
+        geneRules = GeneReactionIndex(model)
+    if geneA not in geneRules.geneIndex:
         raise UserWarning('ERROR: '+geneA+' not in model')
-    if geneB not in modelGenes:
+    if geneB not in geneRules.geneIndex:
         raise UserWarning('ERROR: '+geneB+' not in model')
-    toKO = [r for r in model.reactions if geneA in r.gene_reaction_rule
-                                          or geneB in r.gene_reaction_rule]
-    oldBounds = [(r.lower_bound, r.upper_bound) for r in toKO]
-    for r in toKO:
-        r.lower_bound = 0.
-        r.upper_bound = 0.
-    growth = model.optimize().f
-    # restore model to original state
-    for r, bounds in zip(toKO, oldBounds):
-        r.lower_bound = bounds[0]
-        r.upper_bound = bounds[1]
-    return growth
+    if engine is None:
+        engine = KnockoutEngine(model)
+    return engine.knockout(geneRules.function_loss_reactions([geneA, geneB]))
+
+
+def double_knockouts_of_shard(model, genes, blocks, engine=None, geneRules=None,
+                              withStatus=False):
+    """Double gene-loss and function-loss growth for the pairs of a shard.
+
+    Args:
+        model (cobra.model): FBA model.
+        genes (list(str)): ORF IDs the block indices refer to.
+        blocks (list(tuple(int, int, int))): gene i against genes start to
+                                             stop - 1, per block.
+        engine (KnockoutEngine): solver instance for the model. Built from
+                                 the model if not given.
+        geneRules (GeneReactionIndex): gene to reaction lookups for the
+                                       model. Built from the model if not given.
+        withStatus (bool): also return the status codes, as
+                           double_knockouts_of_gene.
+
+    Returns:
+        dict((str, str): float): gene-loss growth per gene pair.
+        dict((str, str): float): function-loss growth per gene pair.
+        dict((str, str): int): with withStatus, gene-loss status per gene pair.
+        dict((str, str): int): with withStatus, function-loss status per gene pair.
+
+    """
+    planner = _planner(model, engine, geneRules, None)
+    results = tuple({} for _i in range(4 if withStatus else 2))
+    for i, start, stop in blocks:
+        for result, values in zip(results, double_knockouts_of_gene(
+                model, genes[i], genes[start:stop], planner=planner, withStatus=withStatus)):
+            result.update(values)
+    return results
+
+
+def double_knockouts_path(outDir, index):
+    """Fragment file of the double knockouts of one gene.
+
+    Args:
+        outDir (str): cluster output directory.
+        index (int): position of the gene in the sorted gene names.
+
+    Returns:
+        str: path of the npz file.
+
+    """
+    return os.path.join(outDir, 'double_knockouts_' + str(index) + '.npz')
+
+
+def main_shard():
+    """Run one shard of the manifest written by the cluster sender."""
+    if len(sys.argv) != 4:
+        raise UserWarning('Wrong number of arguments')
+    shard = int(sys.argv[2])
+    modelPath = sys.argv[3]
+    instrumentation.enable_from_environment()
+    with instrumentation.phase('load_model'):
+        model = load_sd_minus_his(modelPath)
+    modelName = modelPath.split('/')[-1][:-4]
+    outDir = '../models/' + modelName + '/cluster_output'
+    genes, shards = read_manifest(outDir)
+    outPath = shard_path(outDir, shard)
+    journal = KnockoutJournal(journal_path(outPath), syncInterval=journal_sync_interval())
+    with instrumentation.phase('double_knockouts'):
+        glcGrowthVals, flcGrowthVals, glcStatus, flcStatus = double_knockouts_of_shard(
+            model, genes, shards[shard], engine=KnockoutEngine(model, cache=journal),
+            withStatus=True)
+    with instrumentation.phase('write_output'):
+        write_fragment(outPath, **double_knockout_columns(glcGrowthVals, flcGrowthVals,
+                                                          glcStatus=glcStatus,
+                                                          flcStatus=flcStatus))
+    journal.remove()
+    print journal
+    instrumentation.write_summary(instrumentation.summary_path(outPath),
+                                  job='double_knockouts shard ' + str(shard))
 
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'shard':
+        main_shard()
+        return
     if len(sys.argv) != 3:
         raise UserWarning('Wrong number of arguments')
     index = int(sys.argv[1])
     modelPath = sys.argv[2]
-    model = load_sd_minus_his(modelPath)
+    instrumentation.enable_from_environment()
+    with instrumentation.phase('load_model'):
+        model = load_sd_minus_his(modelPath)
     modelName = modelPath.split('/')[-1][:-4]
-    orderedGeneNames = sorted([g.id for g in model.genes])
-    glcGrowthVals = double_gene_deletion(model, gene_list1=[orderedGeneNames[index]],
-                                         gene_list2=orderedGeneNames[index+1:])
-    flcGrowthVals = double_function_knockouts(model, orderedGeneNames[index],
-                                              orderedGeneNames[index+1:])
+    geneRules = GeneReactionIndex(model)
+    orderedGeneNames = geneRules.genes
     outDir = '../models/' + modelName + '/cluster_output'
-    if not os.path.exists(outDir):
-        os.makedirs(outDir)
-    glcOutPath = os.path.join(outDir, 'growth_double_gene_knockouts_' +
-                                       str(index)+'.pkl')
-    flcOutPath = os.path.join(outDir, 'growth_double_function_knockouts_' +
-                                      str(index)+'.pkl')
-    with open(glcOutPath, 'w') as f:
-        pickle.dump(glcGrowthVals, f)
-    with open(flcOutPath, 'w') as f:
-        pickle.dump(flcGrowthVals, f)
+    outPath = double_knockouts_path(outDir, index)
+    journal = KnockoutJournal(journal_path(outPath), syncInterval=journal_sync_interval())
+    with instrumentation.phase('double_knockouts'):
+        glcGrowthVals, flcGrowthVals, glcStatus, flcStatus = double_knockouts_of_gene(
+            model, orderedGeneNames[index], orderedGeneNames[index+1:],
+            engine=KnockoutEngine(model, cache=journal), geneRules=geneRules, withStatus=True)
+    with instrumentation.phase('write_output'):
+        write_fragment(outPath, **double_knockout_columns(glcGrowthVals, flcGrowthVals,
+                                                          glcStatus=glcStatus,
+                                                          flcStatus=flcStatus))
+    journal.remove()
+    print journal
+    instrumentation.write_summary(instrumentation.summary_path(outPath),
+                                  job='double_knockouts ' + str(index))
 
 
 if __name__ == '__main__':
@@ -1,19 +1,155 @@
 import numpy as np
 
 
-class enzyme:
+class EnzymeTable(object):
+    """Properties and costs of all the genes of a model, as arrays.
+
+    One row per gene, in the order of genes. The cost matrices are
+    genes x media, so every query is answered for all genes at once.
+
+    Args:
+        genes (list(str)): ORF IDs.
+        reactionRules (list(list(str))): rules of the reactions of each gene.
+        isoenzyme (array(bool)): gene has an 'or' in one of its rules.
+        multifunctional (array(bool)): gene is in more than one reaction.
+        simpleSingleFunction (array(bool)): gene is alone in its one reaction.
+
+    """
 
     tolerance = 4.e-5
 
-    def __init__(self, name):
-        self.name = name
-        # reaction rules in flux balance model that contain this enzyme
-        self.reactionRules = []
+    def __init__(self, genes, reactionRules, isoenzyme, multifunctional,
+                 simpleSingleFunction):
+        self.genes = list(genes)
+        self.geneIndex = {g: i for i, g in enumerate(self.genes)}
+        self.reactionRules = reactionRules
+        self.isoenzyme = np.asarray(isoenzyme, dtype=bool)
+        self.multifunctional = np.asarray(multifunctional, dtype=bool)
+        self.simpleSingleFunction = np.asarray(simpleSingleFunction, dtype=bool)
+        self.blocked = np.zeros(len(self.genes), dtype=bool)
         # rank in evolutionary rate
-        self.dndsRank = 0
-        self.functionLossCosts = []
-        self.geneLossCosts = []
-        self.blocked = False
+        self.dndsRank = np.zeros(len(self.genes), dtype=int)
+        self.geneLossCosts = np.zeros((len(self.genes), 0))
+        self.functionLossCosts = np.zeros((len(self.genes), 0))
+
+    @classmethod
+    def from_index(cls, geneRules):
+        """Table of the genes of a model.
+
+        Args:
+            geneRules (GeneReactionIndex): gene to reaction lookups for the model.
+
+        """
+        isoenzyme, multifunctional, simpleSingleFunction = enzyme_classes(geneRules)
+        return cls(geneRules.genes, [geneRules.rules_of(g) for g in geneRules.genes],
+                   isoenzyme, multifunctional, simpleSingleFunction)
+
+    def set_costs(self, geneLossCosts, functionLossCosts):
+        """Set the cost matrices, genes x media in the order of genes."""
+        geneLossCosts = np.asarray(geneLossCosts, dtype=float)
+        functionLossCosts = np.asarray(functionLossCosts, dtype=float)
+        if geneLossCosts.shape != functionLossCosts.shape or \
+           geneLossCosts.shape[0] != len(self.genes):
+            raise UserWarning('ERROR: cost matrices should be genes x media')
+        self.geneLossCosts = geneLossCosts
+        self.functionLossCosts = functionLossCosts
+
+    def number_reactions(self):
+        """Number of reactions of each gene."""
+        return np.array([len(rules) for rules in self.reactionRules])
+
+    def old_and_new_costs_identical(self):
+        """Are function-loss cost and gene-loss cost equal in every media."""
+        return np.all(np.abs(self.functionLossCosts - self.geneLossCosts) <= self.tolerance,
+                      axis=1)
+
+    def num_environments_disagree(self):
+        """Number of media with different function-loss and gene-loss costs."""
+        return (np.abs(self.geneLossCosts - self.functionLossCosts) > self.tolerance).sum(axis=1)
+
+    def hybrid_cost_1(self):
+        """Function loss for multifunctional, gene loss for single-function.
+
+        Pink distribtution in Fig S2.
+        """
+        return np.where(self.multifunctional[:, np.newaxis],
+                        self.functionLossCosts, self.geneLossCosts)
+
+    def hybrid_cost_2(self):
+        """Function loss for isoenzymes, gene loss for non-isoenzymes.
+
+        Purple distribution in Fig 2.
+        """
+        return np.where(self.isoenzyme[:, np.newaxis],
+                        self.functionLossCosts, self.geneLossCosts)
+
+    def enzymes(self):
+        """An enzyme view of each gene.
+
+        Returns:
+            dict(str: enzyme): enzyme per ORF ID.
+
+        """
+        return {g: enzyme(self, i) for i, g in enumerate(self.genes)}
+
+    def __len__(self):
+        return len(self.genes)
+
+    def __getitem__(self, orfID):
+        return enzyme(self, self.geneIndex[orfID])
+
+
+class enzyme(object):
+    """One row of an EnzymeTable."""
+
+    __slots__ = ('table', 'index')
+
+    tolerance = EnzymeTable.tolerance
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    @property
+    def name(self):
+        return self.table.genes[self.index]
+
+    @property
+    def reactionRules(self):
+        """Reaction rules in flux balance model that contain this enzyme."""
+        return self.table.reactionRules[self.index]
+
+    @property
+    def dndsRank(self):
+        return self.table.dndsRank[self.index]
+
+    @dndsRank.setter
+    def dndsRank(self, value):
+        self.table.dndsRank[self.index] = value
+
+    @property
+    def blocked(self):
+        return self.table.blocked[self.index]
+
+    @blocked.setter
+    def blocked(self, value):
+        self.table.blocked[self.index] = value
+
+    @property
+    def geneLossCosts(self):
+        return self.table.geneLossCosts[self.index]
+
+    @geneLossCosts.setter
+    def geneLossCosts(self, values):
+        self.table.geneLossCosts[self.index] = values
+
+    @property
+    def functionLossCosts(self):
+        return self.table.functionLossCosts[self.index]
+
+    @functionLossCosts.setter
+    def functionLossCosts(self, values):
+        self.table.functionLossCosts[self.index] = values
 
     def number_reactions(self):
         if len(self.reactionRules) == 0:
@@ -25,27 +161,21 @@ class enzyme:
         Isoenzyme defined as any gene conected to a reaction with
         a rule that contains an 'or'.
         """
-        if len(self.reactionRules) == 0:
-            raise UserWarning('ERROR no reaction rules associated with enzyme')
-        for rule in self.reactionRules:
-            if 'or' in rule:
-                return True
-        return False
+        self.number_reactions()
+        return bool(self.table.isoenzyme[self.index])
 
     def is_multifunctional(self):
         """Is an enzyme involved in more than one interaction."""
-        if len(self.reactionRules) == 0:
-            raise UserWarning('ERROR no reaction rules associated with enzyme')
-        return len(self.reactionRules) > 1
+        self.number_reactions()
+        return bool(self.table.multifunctional[self.index])
 
     def is_simple_single_function(self):
         """
         Is an enzyme involved in only one reaction and that reaction
         only involves that one enzyme.
         """
-        if len(self.reactionRules) == 0:
-            raise UserWarning('ERROR no reaction rules associated with enzyme')
-        return len(self.reactionRules) == 1 and self.reactionRules[0] == self.name
+        self.number_reactions()
+        return bool(self.table.simpleSingleFunction[self.index])
 
     def old_and_new_costs_identical(self):
         """Are function-loss cost and gene-loss cost equal?
@@ -85,3 +215,24 @@ class enzyme:
                 str(self.number_reactions()) +
                 ' reactions\nRules of those reactions:\n' +
                 str(self.reactionRules))
+
+
+def enzyme_classes(geneRules):
+    """Isoenzyme, multifunctional and simple single-function flags of all genes.
+
+    Same definitions as the enzyme methods, computed from the gene x
+    reaction incidence matrix.
+
+    Args:
+        geneRules (GeneReactionIndex): gene to reaction lookups for the model.
+
+    Returns:
+        array(bool): is isoenzyme, in the order of geneRules.genes.
+        array(bool): is multifunctional.
+        array(bool): is simple single-function.
+
+    """
+    nReactions = geneRules.reaction_counts()
+    isoenzyme = geneRules.incidence.dot(geneRules.reactions_with('or')) > 0
+    singleGeneRules = geneRules.incidence.dot(geneRules.single_gene_reactions())
+    return isoenzyme, nReactions > 1, (nReactions == 1) & (singleGeneRules == 1)
@@ -1,5 +1,9 @@
+import hashlib
 import numpy as np
 import cobra
+import instrumentation
+from gene_rules import parse_rule, rule_genes
+from model_cache import load_model_and_exchanges
 
 
 def genes_in_rule(rule):
@@ -12,7 +16,7 @@ def genes_in_rule(rule):
         list(str): the genes.
 
     """
-    genes = set(rule.replace('and', '').replace('or', '').replace('(', '').replace(')', '').split())
+    genes = rule_genes(parse_rule(rule))
     if len(genes) == 0:
         raise UserWarning('ERROR: no genes found in reaction rule.')
     return genes
@@ -22,14 +26,18 @@ def get_reaction_from_name(reactions, name):
     """Return reaction with name.
 
     Args:
-        reactions (list(reactions)): the reactions.
+        reactions (list(reactions)): the reactions, or the output of
+                                     reactions_by_name for them.
         name (str): name of the desired reaction.
 
     Returns:
         reaction: the corresponding reaction.
 
     """
-    matches = [r for r in reactions if r.name == name]
+    if isinstance(reactions, dict):
+        matches = reactions.get(name, [])
+    else:
+        matches = [r for r in reactions if r.name == name]
     if len(matches) > 1:
         raise UserWarning('ERROR: duplicate reactions in model.')
     elif len(matches) == 0:
@@ -38,9 +46,29 @@ def get_reaction_from_name(reactions, name):
         return matches[0]
 
 
+def reactions_by_name(reactions):
+    """Lookup of reactions by name.
+
+    Args:
+        reactions (list(reactions)): the reactions.
+
+    Returns:
+        dict(str: list(reactions)): reactions with each name.
+
+    """
+    byName = {}
+    for r in reactions:
+        byName.setdefault(r.name, []).append(r)
+    return byName
+
+
 def get_exchange_reactions(model):
     """The input reactions of a model.
 
+    Reactions with a single metabolite, i.e. a single non-zero entry in their
+    column of the stoichiometric matrix. Read from the reactions' own
+    metabolite coefficients, without building the matrix.
+
     Args:
         model (cobra.model): FBA model.
 
@@ -48,9 +76,9 @@ def get_exchange_reactions(model):
         list(cobra.reaction): exchange reactions.
 
     """
-    S = model.to_array_based_model().S
-    indices = list(np.array(range(len(model.reactions)))[((S != 0.).sum(axis=0) == 1).A1])
-    return [model.reactions[i] for i in indices]
+    with instrumentation.phase('exchange_detection'):
+        return [r for r in model.reactions
+                if sum([1 for c in r.metabolites.values() if c != 0.]) == 1]
 
 
 def find_media_reactions(sourceNames, exchangeReactions):
@@ -64,9 +92,10 @@ def find_media_reactions(sourceNames, exchangeReactions):
         list(reactions): the corresponding reactions.
 
     """
+    byName = reactions_by_name(exchangeReactions)
     reactions = []
     for nutrient in sourceNames:
-        matches = [r for r in exchangeReactions if r.name == nutrient+' exchange']
+        matches = byName.get(nutrient + ' exchange', [])
         if len(matches) > 1:
             raise UserWarning('ERROR: duplicate reactions in model.')
         elif len(matches) == 0:
@@ -91,26 +120,138 @@ def minimal_media_model(modelPath, carbonSource, nitrogenSource):
         cobra.model: FBA model.
 
     """
-    model = cobra.io.read_sbml_model(modelPath)
-    exchangeReactions = get_exchange_reactions(model)
-    model.reactions.get_by_id([r.id for r in exchangeReactions
-                              if r.name == 'D-glucose exchange'][0]).lower_bound = 0.
-    model.reactions.get_by_id([r.id for r in exchangeReactions
-                              if r.name == 'ammonium exchange'][0]).lower_bound = 0.
+    model, exchangeReactions = load_model_and_exchanges(modelPath)
+    return set_minimal_media(model, carbonSource, nitrogenSource, exchangeReactions)
+
+
+def set_minimal_media(model, carbonSource, nitrogenSource, exchangeReactions=None):
+    """Change the nutrients of a model with default bounds to a minimal media.
+
+    Args:
+        model (cobra.model): FBA model with the bounds it was loaded with.
+        carbonSource (str): name of metabolite.
+        nitrogenSource (str): name of metabolite.
+        exchangeReactions (list(reactions)): exchange reactions of the model.
+                                             Found from the model if not given.
+
+    Returns:
+        cobra.model: FBA model.
+
+    """
+    if exchangeReactions is None:
+        exchangeReactions = get_exchange_reactions(model)
+    byName = reactions_by_name(exchangeReactions)
+    for name, lowerBound in minimal_media_uptakes(carbonSource, nitrogenSource):
+        get_reaction_from_name(byName, name).lower_bound = lowerBound
+    return model
+
+
+def minimal_media_uptakes(carbonSource, nitrogenSource):
+    """Exchange reaction lower bounds that turn the default media of the
+       model into a minimal media.
+
+    Args:
+        carbonSource (str): name of metabolite.
+        nitrogenSource (str): name of metabolite.
+
+    Returns:
+        list(tuple(str, float)): exchange reaction name and lower bound, in
+                                 the order they have to be applied.
+
+    """
+    uptakes = [('D-glucose exchange', 0.), ('ammonium exchange', 0.)]
     if carbonSource == nitrogenSource:
-        get_reaction_from_name(exchangeReactions,
-                               carbonSource + ' exchange').lower_bound = -20.
+        uptakes.append((carbonSource + ' exchange', -20.))
     else:
-        get_reaction_from_name(exchangeReactions,
-                               carbonSource + ' exchange').lower_bound = -10.
-        get_reaction_from_name(exchangeReactions,
-                               nitrogenSource + ' exchange').lower_bound = -10.
-    return model
+        uptakes.append((carbonSource + ' exchange', -10.))
+        uptakes.append((nitrogenSource + ' exchange', -10.))
+    return uptakes
+
+
+class MediumConfiguration(object):
+    """Exchange reactions of a model, to switch between media quickly.
+
+    The exchange reactions are found once, and kept in arrays with their
+    position in the model and their bounds in the default media of the
+    model. Switching media then compares the bound arrays and only touches
+    the reactions whose bounds differ.
+
+    Args:
+        model (cobra.model): FBA model, with its default bounds.
+        exchangeReactions (list(reactions)): exchange reactions of the model.
+                                             Found from the model if not given.
+
+    """
+
+    def __init__(self, model, exchangeReactions=None):
+        if exchangeReactions is None:
+            exchangeReactions = get_exchange_reactions(model)
+        self.model = model
+        self.exchangeReactions = list(exchangeReactions)
+        position = {r.id: i for i, r in enumerate(model.reactions)}
+        self.reactionIndices = np.array([position[r.id] for r in self.exchangeReactions],
+                                        dtype=int)
+        self.exchangeIndex = {}
+        for i, r in enumerate(self.exchangeReactions):
+            if r.name in self.exchangeIndex:
+                raise UserWarning('ERROR: duplicate reactions in model.')
+            self.exchangeIndex[r.name] = i
+        self.defaultLowerBounds = np.array([r.lower_bound for r in self.exchangeReactions])
+        self.upperBounds = np.array([r.upper_bound for r in self.exchangeReactions])
+        self.lowerBounds = self.defaultLowerBounds.copy()
+
+    def reaction(self, name):
+        """Exchange reaction with name."""
+        if name not in self.exchangeIndex:
+            raise UserWarning('WARNING: could not find reaction: ' + name)
+        return self.exchangeReactions[self.exchangeIndex[name]]
+
+    def minimal_media_bounds(self, carbonSource, nitrogenSource):
+        """Lower bounds of the exchange reactions in a minimal media.
+
+        Same media as set_minimal_media.
+
+        Returns:
+            array(float): lower bound per exchange reaction.
+
+        """
+        lowerBounds = self.defaultLowerBounds.copy()
+        for name, lowerBound in minimal_media_uptakes(carbonSource, nitrogenSource):
+            if name not in self.exchangeIndex:
+                raise UserWarning('WARNING: could not find reaction: ' + name)
+            lowerBounds[self.exchangeIndex[name]] = lowerBound
+        return lowerBounds
+
+    def apply(self, lowerBounds, engine=None):
+        """Set the lower bounds of the exchange reactions.
+
+        Args:
+            lowerBounds (array(float)): lower bound per exchange reaction.
+            engine (KnockoutEngine): solver instance of the model to update
+                                     as well.
+
+        """
+        lowerBounds = np.asarray(lowerBounds, dtype=float)
+        for i in np.flatnonzero(lowerBounds != self.lowerBounds):
+            self.exchangeReactions[i].lower_bound = lowerBounds[i]
+        self.lowerBounds = lowerBounds.copy()
+        if engine is not None:
+            engine.set_bounds(self.reactionIndices, lowerBounds, self.upperBounds)
+
+    def set_minimal_media(self, carbonSource, nitrogenSource, engine=None):
+        """Switch the model, and optionally its engine, to a minimal media."""
+        self.apply(self.minimal_media_bounds(carbonSource, nitrogenSource), engine)
 
 
 def minimal_media(model, carbonSource, nitrogenSource):
     """Set FBA model to minimal media environment.
 
+    Every exchange reaction is closed for uptake except those of the carbon
+    and nitrogen sources. The exchange reactions are found on the first
+    call for a model and kept with it, so later calls only change the
+    bounds that differ; the exchange bounds of the model should then only
+    be changed through this function.
+
     Args:
         model (cobra.model): FBA model.
         carbonSource (str): name of metabolite.
@@ -119,20 +260,16 @@ def minimal_media(model, carbonSource, nitrogenSource):
     Returns:
         cobra.model: FBA model with minimal media envirnoment settings.
     """
-    standardNutrients = ['H+', 'iron(2+)', 'oxygen', 'phosphate', 'potassium',
-                         'sodium', 'sulphate', 'water']
-    stndrdRxns = set([i + ' exchange' for i in standardNutrients])
-    exchangeReactions = get_exchange_reactions(model)
-    for r in exchangeReactions:
-        if r.name in stndrdRxns:
-            r.lower_bound = -1000
-        if r.name == carbonSource + ' exchange' or r.name == nitrogenSource + ' exchange':
-            if carbonSource == nitrogenSource:
-                r.lower_bound = -20.
-            else:
-                r.lower_bound = -10.
-        else:
-            r.lower_bound = 0.
+    mediumConfig = getattr(model, '_mediumConfiguration', None)
+    if mediumConfig is None or mediumConfig.model is not model:
+        mediumConfig = MediumConfiguration(model)
+        model._mediumConfiguration = mediumConfig
+    lowerBounds = np.zeros(len(mediumConfig.exchangeReactions))
+    for source in (carbonSource, nitrogenSource):
+        if source + ' exchange' in mediumConfig.exchangeIndex:
+            lowerBounds[mediumConfig.exchangeIndex[source + ' exchange']] = (
+                -20. if carbonSource == nitrogenSource else -10.)
+    mediumConfig.apply(lowerBounds)
     return model
 
 
@@ -147,7 +284,7 @@ def load_sd_minus_his(modelPath):
         cobra.model: FBA model.
 
     """
-    model = cobra.io.read_sbml_model(modelPath)
+    model, exchangeReactions = load_model_and_exchanges(modelPath)
     # Note: different models have different names for their reactions
     sdMinusHis = set([i+' exchange' for i in ['biotin', 'choline',
                                               'myo-inositol', 'uracil',
@@ -161,7 +298,6 @@ def load_sd_minus_his(modelPath):
                                               'L-serine', 'L-threonine',
                                               'L-tryptophan', 'L-tyrosine',
                                               'L-valine']])
-    exchangeReactions = get_exchange_reactions(model)
     for r in exchangeReactions:
         if r.name in sdMinusHis:
             r.lower_bound = -10.
@@ -193,11 +329,24 @@ def load_media(modelPath, mediaName):
     if mediaName not in nutrients:
         raise UserWarning(mediaName + ' not available. Choose ' +
                           ' or '.join(nutrients.keys()))
-    model = cobra.io.read_sbml_model(modelPath)
+    model, exchangeReactions = load_model_and_exchanges(modelPath)
     # Note: different models have different names for their reactions
     nutrientRxns = set([i+' exchange' for i in nutrients[mediaName]])
-    exchangeReactions = get_exchange_reactions(model)
     for r in exchangeReactions:
         if r.name in nutrientRxns:
             r.lower_bound = -10.
     return model
+
+
+def model_hash(model):
+    """Hash of the reactions and stoichiometry of an FBA model.
+
+    Bounds and objective are not included, they are part of the state of
+    a KnockoutEngine.
+    """
+    sha1 = hashlib.sha1()
+    for r in model.reactions:
+        sha1.update(r.id)
+        for m, coefficient in sorted((m.id, c) for m, c in r.metabolites.items()):
+            sha1.update(m + ':' + repr(coefficient))
+    return sha1.hexdigest()
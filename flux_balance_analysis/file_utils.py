@@ -0,0 +1,24 @@
+"""Writing files so that readers never see them half written."""
+
+import os
+import numpy as np
+
+
+def write_npz(path, **arrays):
+    """Write arrays to an npz file, replacing it in one step.
+
+    The arrays go to a temporary file ending in .tmp.npz next to path,
+    which is then renamed to path, so a crash or a concurrent reader never
+    sees a partial file.
+
+    Args:
+        path (str): output file, ending in .npz.
+        **arrays: arrays to save, by name.
+
+    """
+    outDir = os.path.dirname(path)
+    if outDir != '' and not os.path.exists(outDir):
+        os.makedirs(outDir)
+    tmpPath = path[:-len('.npz')] + '.' + str(os.getpid()) + '.tmp.npz'
+    np.savez(tmpPath, **{k: np.asarray(v) for k, v in arrays.items()})
+    os.rename(tmpPath, path)
@@ -0,0 +1,96 @@
+"""Blocked reactions, i.e. reactions that can not carry any flux.
+
+Instead of maximizing and minimizing every reaction from scratch, LPs that
+push flux through many reactions at once are solved first: any reaction
+with flux in one of their solutions is not blocked. Only the reactions
+left undecided are then maximized and minimized one by one, on a solver
+problem that is kept between solves, split over several processes.
+"""
+
+from multiprocessing import Pool
+import numpy as np
+from knockout_engine import KnockoutEngine
+
+
+# state of a worker process, set once by the pool initializer
+_worker = {}
+
+
+def find_blocked_reactions(model, nProcesses=1, tolerance=1.e-9, solver=None,
+                           seed=0):
+    """Reactions that can carry no flux with the current bounds.
+
+    Args:
+        model (cobra.model): FBA model.
+        nProcesses (int): number of processes for the one by one stage.
+        tolerance (float): fluxes smaller than this count as zero.
+        solver (str): name of cobra solver interface.
+        seed (int): seed of the random objective weights.
+
+    Returns:
+        set(str): IDs of the blocked reactions.
+
+    """
+    engine = KnockoutEngine(model, solver=solver)
+    undecided = np.ones(len(model.reactions), dtype=bool)
+    random = np.random.RandomState(seed)
+    while undecided.any():
+        nBefore = undecided.sum()
+        for sense in ('maximize', 'minimize'):
+            weights = np.where(undecided, random.uniform(0.5, 1.5, len(undecided)), 0.)
+            engine.set_objective(weights)
+            if engine.optimize(objectiveSense=sense) is not None:
+                undecided &= np.abs(engine.fluxes()) <= tolerance
+        if nBefore - undecided.sum() < max(1, 0.01 * nBefore):
+            break
+    engine.reset_objective()
+    remaining = [int(i) for i in np.flatnonzero(undecided)]
+    if nProcesses > 1 and len(remaining) > 0:
+        chunks = [remaining[i::nProcesses * 4] for i in range(nProcesses * 4)]
+        pool = Pool(nProcesses, _init_worker, (model, tolerance, solver))
+        try:
+            blocked = [i for chunk in pool.map(_blocked_in_chunk, chunks) for i in chunk]
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        blocked = blocked_one_by_one(engine, remaining, tolerance)
+        engine.reset_objective()
+    return set([model.reactions[i].id for i in blocked])
+
+
+def blocked_one_by_one(engine, reactionIndices, tolerance=1.e-9):
+    """Maximize and minimize each reaction to see if it can carry flux.
+
+    Args:
+        engine (KnockoutEngine): solver instance for the model.
+        reactionIndices (list(int)): positions of the reactions to test.
+        tolerance (float): fluxes smaller than this count as zero.
+
+    Returns:
+        list(int): positions of the blocked reactions.
+
+    """
+    blocked = []
+    objective = np.zeros(len(engine.reactionIDs))
+    for i in reactionIndices:
+        objective[:] = 0.
+        objective[i] = 1.
+        engine.set_objective(objective)
+        if all([_is_zero(engine.optimize(objectiveSense=sense), tolerance)
+                for sense in ('maximize', 'minimize')]):
+            blocked.append(i)
+    return blocked
+
+
+def _is_zero(value, tolerance):
+    return value is not None and abs(value) <= tolerance
+
+
+def _init_worker(model, tolerance, solver):
+    _worker['engine'] = KnockoutEngine(model, solver=solver)
+    _worker['tolerance'] = tolerance
+
+
+def _blocked_in_chunk(reactionIndices):
+    return blocked_one_by_one(_worker['engine'], reactionIndices, _worker['tolerance'])
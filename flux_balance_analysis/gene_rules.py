@@ -0,0 +1,276 @@
+"""Parsing of gene-reaction rules and an index from genes to reactions.
+
+Rules are parsed into nested tuples:
+    ('gene', 'YAL012W')
+    ('and', (child, child, ...))
+    ('or', (child, child, ...))
+"""
+
+import re
+import numpy as np
+from scipy import sparse
+
+
+_TOKEN = re.compile(r'\(|\)|[^\s()]+')
+
+
+def parse_rule(rule):
+    """Parse a gene-reaction rule.
+
+    Args:
+        rule (str): the reaction rule, e.g. '(YAL012W and YBR001C) or YCR002C'.
+
+    Returns:
+        tuple: the parsed rule, None if the rule is empty.
+
+    """
+    tokens = _TOKEN.findall(rule)
+    if len(tokens) == 0:
+        return None
+    tree, position = _parse_or(tokens, 0)
+    if position != len(tokens):
+        raise UserWarning('ERROR: could not parse reaction rule: ' + rule)
+    return tree
+
+
+def _parse_or(tokens, position):
+    children = []
+    child, position = _parse_and(tokens, position)
+    children.append(child)
+    while position < len(tokens) and tokens[position].lower() == 'or':
+        child, position = _parse_and(tokens, position + 1)
+        children.append(child)
+    if len(children) == 1:
+        return children[0], position
+    return ('or', tuple(children)), position
+
+
+def _parse_and(tokens, position):
+    children = []
+    child, position = _parse_term(tokens, position)
+    children.append(child)
+    while position < len(tokens) and tokens[position].lower() == 'and':
+        child, position = _parse_term(tokens, position + 1)
+        children.append(child)
+    if len(children) == 1:
+        return children[0], position
+    return ('and', tuple(children)), position
+
+
+def _parse_term(tokens, position):
+    if position >= len(tokens):
+        raise UserWarning('ERROR: unexpected end of reaction rule')
+    token = tokens[position]
+    if token == '(':
+        tree, position = _parse_or(tokens, position + 1)
+        if position >= len(tokens) or tokens[position] != ')':
+            raise UserWarning('ERROR: unbalanced brackets in reaction rule')
+        return tree, position + 1
+    if token == ')' or token.lower() in ('and', 'or'):
+        raise UserWarning('ERROR: unexpected ' + token + ' in reaction rule')
+    return ('gene', token), position + 1
+
+
+def rule_genes(tree):
+    """All genes in a parsed rule.
+
+    Args:
+        tree (tuple): parsed rule.
+
+    Returns:
+        set(str): the genes.
+
+    """
+    if tree is None:
+        return set()
+    if tree[0] == 'gene':
+        return set([tree[1]])
+    genes = set()
+    for child in tree[1]:
+        genes.update(rule_genes(child))
+    return genes
+
+
+def rule_is_active(tree, knockedOut):
+    """Can the reaction still be catalysed with some genes deleted.
+
+    Args:
+        tree (tuple): parsed rule.
+        knockedOut (set(str)): deleted genes.
+
+    Returns:
+        bool: False if the deletions disable the reaction.
+
+    """
+    if tree is None:
+        return True
+    if tree[0] == 'gene':
+        return tree[1] not in knockedOut
+    if tree[0] == 'and':
+        return all(rule_is_active(child, knockedOut) for child in tree[1])
+    return any(rule_is_active(child, knockedOut) for child in tree[1])
+
+
+def _genes_under(tree, operator):
+    """Genes that appear inside a clause of the given operator."""
+    if tree is None or tree[0] == 'gene':
+        return set()
+    genes = set()
+    for child in tree[1]:
+        if tree[0] == operator:
+            genes.update(rule_genes(child))
+        else:
+            genes.update(_genes_under(child, operator))
+    return genes
+
+
+def _has_operator(tree, operator):
+    """Does the parsed rule contain a clause of the given operator."""
+    if tree is None or tree[0] == 'gene':
+        return False
+    return tree[0] == operator or any(_has_operator(child, operator)
+                                      for child in tree[1])
+
+
+class GeneReactionIndex(object):
+    """Lookups between the genes and the reactions of an FBA model.
+
+    Built once per model. Reactions are referred to by their position in
+    model.reactions, which is also their position in the solver problem.
+    The incidence attribute is a sparse genes x reactions matrix, with a 1
+    where the rule of the reaction mentions the gene.
+
+    Args:
+        model (cobra.model): FBA model.
+
+    """
+
+    def __init__(self, model):
+        self._index([g.id for g in model.genes], [r.id for r in model.reactions],
+                    [r.gene_reaction_rule for r in model.reactions])
+
+    @classmethod
+    def from_rules(cls, genes, reactionIDs, rules):
+        """Index without a cobra model, e.g. of an exported ModelArrays.
+
+        Args:
+            genes (list(str)): ORF IDs.
+            reactionIDs (list(str)): reaction IDs, in the order of the model.
+            rules (list(str)): gene-reaction rule of each reaction.
+
+        """
+        geneRules = cls.__new__(cls)
+        geneRules._index(genes, reactionIDs, rules)
+        return geneRules
+
+    def _index(self, genes, reactionIDs, rules):
+        self.genes = sorted(genes)
+        self.geneIndex = {g: i for i, g in enumerate(self.genes)}
+        self.reactionIDs = list(reactionIDs)
+        self.reactionIndex = {rID: i for i, rID in enumerate(self.reactionIDs)}
+        self.rules = list(rules)
+        self.ruleTrees = [parse_rule(rule) for rule in self.rules]
+        reactions = {g: [] for g in self.genes}
+        self.isoenzymes = set()
+        for i, tree in enumerate(self.ruleTrees):
+            for g in rule_genes(tree):
+                if g not in reactions:
+                    raise UserWarning('ERROR: ' + g + ' in rule of ' +
+                                      self.reactionIDs[i] + ' but not in model')
+                reactions[g].append(i)
+            self.isoenzymes.update(_genes_under(tree, 'or'))
+        self.geneReactions = {g: tuple(rs) for g, rs in reactions.items()}
+        rows = [self.geneIndex[g] for g in self.genes for _ in reactions[g]]
+        columns = [i for g in self.genes for i in reactions[g]]
+        self.incidence = sparse.csr_matrix((np.ones(len(rows)), (rows, columns)),
+                                           shape=(len(self.genes), len(self.reactionIDs)))
+
+    def reactions_of(self, gene):
+        """Reactions whose rule mentions the gene."""
+        return self.geneReactions[gene]
+
+    def rules_of(self, gene):
+        """Rule strings of the reactions whose rule mentions the gene."""
+        return [self.rules[i] for i in self.geneReactions[gene]]
+
+    def function_loss_reactions(self, genes):
+        """Reactions lost if every function of the genes is lost.
+
+        Any reaction whose rule mentions one of the genes.
+
+        Args:
+            genes (iterable(str)): ORF IDs.
+
+        Returns:
+            set(int): reaction positions.
+
+        """
+        reactions = set()
+        for g in genes:
+            reactions.update(self.geneReactions[g])
+        return reactions
+
+    def gene_loss_reactions(self, genes):
+        """Reactions disabled by deleting the genes.
+
+        Reactions whose rule evaluates to false, i.e. isoenzymes can
+        replace each other but complexes need all their subunits.
+
+        Args:
+            genes (iterable(str)): ORF IDs.
+
+        Returns:
+            set(int): reaction positions.
+
+        """
+        genes = set(genes)
+        return set(i for i in self.function_loss_reactions(genes)
+                   if not rule_is_active(self.ruleTrees[i], genes))
+
+    def function_loss_costs(self, reactionCosts):
+        """Function-loss cost of every gene from the reaction-deletion costs.
+
+        The sum of the costs of all the reactions the gene is in.
+
+        Args:
+            reactionCosts (array(float)): cost per reaction position.
+
+        Returns:
+            array(float): cost per gene, in the order of genes.
+
+        """
+        return self.incidence.dot(np.asarray(reactionCosts, dtype=float))
+
+    def function_loss_status(self, reactionStatus):
+        """Status code of the function-loss cost of every gene.
+
+        The worst status of the reactions the gene is in, see
+        result_store.STATUS_CODES.
+
+        Args:
+            reactionStatus (array(int)): status code per reaction position,
+                                         at least 0.
+
+        Returns:
+            array(int8): status code per gene, in the order of genes.
+
+        """
+        worst = self.incidence.multiply(np.asarray(reactionStatus)[np.newaxis, :]).max(axis=1)
+        return np.asarray(worst.toarray(), dtype=np.int8).ravel()
+
+    def reaction_counts(self):
+        """Number of reactions whose rule mentions each gene."""
+        return np.asarray(self.incidence.sum(axis=1), dtype=int).ravel()
+
+    def reactions_with(self, operator):
+        """Boolean per reaction, True if its rule has an 'and' or 'or' clause."""
+        return np.array([_has_operator(tree, operator) for tree in self.ruleTrees])
+
+    def single_gene_reactions(self):
+        """Boolean per reaction, True if its rule is a single gene."""
+        return np.array([tree is not None and tree[0] == 'gene'
+                         for tree in self.ruleTrees])
+
+    def is_isoenzyme(self, gene):
+        """Gene has an alternative in at least one of its reactions."""
+        return gene in self.isoenzymes
@@ -0,0 +1,305 @@
+"""Genetic interaction data of Costanzo et al. 2009.
+
+The raw SGA file has millions of rows, so it is read in chunks of a fixed
+number of rows and every chunk is classified with boolean masks. The
+filtered interactions are written to a csv file, and to a compact npz file
+with the ORF IDs as integer codes:
+
+    orfs: ORF IDs, position is the code.
+    query, array: ORF codes of each pair (int32).
+    interaction: -1 negative, 0 none, 1 positive (int8).
+
+InteractionIndex holds the measured pairs as sorted int64 keys, so they
+can be joined with the double knockout predictions and counted at many
+epsilon thresholds with array operations.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from file_utils import write_npz
+
+
+# http://drygin.ccbr.utoronto.ca/~costanzo2009/
+RAW_DATA_COLUMNS = ['Query ORF',
+                    'Query gene name',
+                    'Array ORF',
+                    'Array gene name',
+                    'epsilon',
+                    'Standard deviation',
+                    'p-value',
+                    'Query SMF',
+                    'Query SMF std',
+                    'Array SMF',
+                    'Array SMF std',
+                    'Double mutant fitness',
+                    'Double mutant fitness std']
+
+INTERACTION_CODES = {'negative': -1, 'none': 0, 'positive': 1}
+# interaction names, at position code + 1
+INTERACTION_NAMES = np.array(['negative', 'none', 'positive'], dtype=object)
+
+
+def classify_interactions(epsilon, pValue):
+    """Genetic interaction as defined in the paper.
+
+    Args:
+        epsilon (array(float)): interaction scores.
+        pValue (array(float)): p-values of the scores.
+
+    Returns:
+        array(int8): -1 negative, 0 none, 1 positive.
+
+    """
+    significant = pValue < 0.05
+    interaction = np.zeros(len(epsilon), dtype=np.int8)
+    interaction[(epsilon > 0.08) & significant] = INTERACTION_CODES['positive']
+    interaction[(epsilon < -0.08) & significant] = INTERACTION_CODES['negative']
+    return interaction
+
+
+def read_raw_interactions(inPath, chunkSize=1000000):
+    """Chunks of the raw SGA data, with explicit column types.
+
+    Args:
+        inPath (str): raw data file.
+        chunkSize (int): number of rows per chunk.
+
+    Returns:
+        iterator(DataFrame): chunks of the file.
+
+    """
+    dtypes = {c: float for c in RAW_DATA_COLUMNS}
+    for c in ('Query ORF', 'Query gene name', 'Array ORF', 'Array gene name'):
+        dtypes[c] = 'category'
+    return pd.read_table(inPath, names=RAW_DATA_COLUMNS, dtype=dtypes,
+                         chunksize=chunkSize)
+
+
+def filter_raw_interactions(inPath, outPath, binaryPath, chunkSize=1000000):
+    """Classify the raw SGA data and remove pairs with high single mutant fitness.
+
+    Rows with any missing value are dropped, and so are pairs where either
+    knockout grows better than wildtype.
+
+    Args:
+        inPath (str): raw data file.
+        outPath (str): csv file with columns Query ORF, Array ORF, interaction.
+        binaryPath (str): npz file of the same interactions.
+        chunkSize (int): number of rows read at a time.
+
+    """
+    codes = {}
+    orfs = []
+    queries = [np.zeros(0, dtype=np.int32)]
+    arrays = [np.zeros(0, dtype=np.int32)]
+    interactions = [np.zeros(0, dtype=np.int8)]
+    nBefore = 0
+    nAfter = 0
+    tmpPath = outPath + '.tmp'
+    with open(tmpPath, 'w') as f:
+        f.write('Query ORF,Array ORF,interaction\n')
+        for chunk in read_raw_interactions(inPath, chunkSize):
+            chunk = chunk.dropna(axis=0)
+            nBefore += chunk.shape[0]
+            keep = (((chunk['Query SMF'].values - 2 * chunk['Query SMF std'].values) <= 1.0) &
+                    ((chunk['Array SMF'].values - 2 * chunk['Array SMF std'].values) <= 1.0))
+            chunk = chunk[keep]
+            nAfter += chunk.shape[0]
+            interaction = classify_interactions(chunk['epsilon'].values,
+                                                chunk['p-value'].values)
+            pair = []
+            for column in ('Query ORF', 'Array ORF'):
+                categories = chunk[column].cat.categories
+                for orf in categories:
+                    if orf not in codes:
+                        codes[orf] = len(orfs)
+                        orfs.append(orf)
+                chunkCodes = np.array([codes[orf] for orf in categories], dtype=np.int32)
+                pair.append(chunkCodes[chunk[column].cat.codes.values])
+            queries.append(pair[0])
+            arrays.append(pair[1])
+            interactions.append(interaction)
+            pd.DataFrame({'Query ORF': chunk['Query ORF'].values,
+                          'Array ORF': chunk['Array ORF'].values,
+                          'interaction': INTERACTION_NAMES[interaction + 1]},
+                         columns=['Query ORF', 'Array ORF', 'interaction']
+                         ).to_csv(f, header=False, index=False)
+    os.rename(tmpPath, outPath)
+    print 'removed', nBefore - nAfter, 'out of', nBefore
+    print 'knockouts with higher growth than wildtype'
+    write_npz(binaryPath, orfs=np.array(orfs), query=np.concatenate(queries),
+              array=np.concatenate(arrays), interaction=np.concatenate(interactions))
+
+
+class InteractionIndex(object):
+    """Measured genetic interactions, keyed by pairs of ORF codes.
+
+    The key of a pair is lo * len(orfs) + hi, with lo < hi the codes of
+    its two ORFs, so (A, B) and (B, A) are the same pair. If a pair was
+    measured more than once the last measurement is kept.
+
+    Args:
+        orfs (list(str)): ORF IDs, position is the code.
+        query (array(int)): ORF code of one gene of each measured pair.
+        array (array(int)): ORF code of the other gene.
+        interaction (array(int)): -1 negative, 0 none, 1 positive.
+
+    """
+
+    def __init__(self, orfs, query, array, interaction):
+        self.orfs = np.array(orfs, dtype=object)
+        self.orfCode = {orf: i for i, orf in enumerate(self.orfs)}
+        keys = self._keys(np.asarray(query), np.asarray(array))
+        order = np.argsort(keys, kind='mergesort')
+        keys = keys[order]
+        last = np.append(keys[1:] != keys[:-1], True)
+        self.keys = keys[last]
+        self.interaction = np.asarray(interaction, dtype=np.int8)[order][last]
+
+    @classmethod
+    def load(cls, binaryPath):
+        """Index of an npz file written by filter_raw_interactions."""
+        data = np.load(binaryPath)
+        return cls(data['orfs'], data['query'], data['array'], data['interaction'])
+
+    @classmethod
+    def from_table(cls, table):
+        """Index of a DataFrame with Query ORF, Array ORF and interaction columns."""
+        codes, orfs = pd.factorize(np.concatenate([table['Query ORF'].values,
+                                                   table['Array ORF'].values]))
+        interaction = table['interaction'].map(INTERACTION_CODES).values
+        return cls(orfs, codes[:table.shape[0]], codes[table.shape[0]:], interaction)
+
+    def _keys(self, codesA, codesB):
+        codesA = codesA.astype(np.int64)
+        codesB = codesB.astype(np.int64)
+        return np.minimum(codesA, codesB) * len(self.orfs) + np.maximum(codesA, codesB)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def codes(self, orfIDs):
+        """ORF codes, -1 for ORFs not in the index."""
+        return np.array([self.orfCode.get(orf, -1) for orf in orfIDs], dtype=np.int64)
+
+    def pairs(self):
+        """ORF codes of the two genes of each pair, in the order of keys."""
+        return self.keys // len(self.orfs), self.keys % len(self.orfs)
+
+    def restrict(self, orfIDs):
+        """Index of only the pairs with both ORFs in orfIDs."""
+        keep = np.zeros(len(self.orfs), dtype=bool)
+        codes = self.codes(orfIDs)
+        keep[codes[codes >= 0]] = True
+        codesA, codesB = self.pairs()
+        inside = keep[codesA] & keep[codesB]
+        return InteractionIndex(self.orfs, codesA[inside], codesB[inside],
+                                self.interaction[inside])
+
+    def lookup(self, orfsA, orfsB, missing=INTERACTION_CODES['none']):
+        """Measured interaction of each pair (orfsA[k], orfsB[k]).
+
+        Args:
+            orfsA (list(str)): ORF IDs.
+            orfsB (list(str)): ORF IDs.
+            missing (int): value for pairs that were not measured.
+
+        Returns:
+            array(int8): interaction codes.
+
+        """
+        codesA = self.codes(orfsA)
+        codesB = self.codes(orfsB)
+        known = (codesA >= 0) & (codesB >= 0)
+        keys = self._keys(codesA, codesB)
+        positions = np.searchsorted(self.keys, keys)
+        found = known & (positions < len(self.keys))
+        found[found] = self.keys[positions[found]] == keys[found]
+        interaction = np.empty(len(keys), dtype=np.int8)
+        interaction[:] = missing
+        interaction[found] = self.interaction[positions[found]]
+        return interaction
+
+    def positions_in(self, genes):
+        """Positions of the two genes of each pair in a list of genes.
+
+        Used to take the predictions for the measured pairs out of
+        genes x genes arrays, such as the double knockouts in the result store.
+
+        Args:
+            genes (list(str)): ORF IDs, e.g. store.labels('genes').
+
+        Returns:
+            array(int): position of one gene of each pair.
+            array(int): position of the other gene.
+
+        Raises:
+            UserWarning: if a gene of a pair is not in genes; restrict the
+                         index to genes first.
+
+        """
+        position = np.empty(len(self.orfs), dtype=np.int64)
+        position[:] = -1
+        for i, gene in enumerate(genes):
+            if gene in self.orfCode:
+                position[self.orfCode[gene]] = i
+        codesA, codesB = self.pairs()
+        positionA, positionB = position[codesA], position[codesB]
+        missingOrfs = np.union1d(codesA[positionA < 0], codesB[positionB < 0])
+        if len(missingOrfs) > 0:
+            raise UserWarning('ERROR: ' + str(len(missingOrfs)) +
+                              ' genes of measured pairs not in genes, e.g. ' +
+                              self.orfs[missingOrfs[0]])
+        return positionA, positionB
+
+
+def interaction_counts(experiment, epsilon, thresholds):
+    """Measured against predicted interactions at each epsilon threshold.
+
+    A pair is predicted positive if epsilon > threshold, negative if
+    epsilon < -threshold and non-interacting if -threshold <= epsilon <
+    threshold. Pairs with a NaN epsilon are not counted.
+
+    Args:
+        experiment (array(int)): measured interaction codes.
+        epsilon (array(float)): predicted epistasis of the same pairs.
+        thresholds (array(float)): thresholds to count at.
+
+    Returns:
+        array(int): counts of shape thresholds x 3 x 3, indexed by
+                    [threshold, measured code + 1, predicted code + 1].
+
+    """
+    thresholds = np.atleast_1d(np.asarray(thresholds, dtype=float))
+    experiment = np.asarray(experiment)
+    epsilon = np.asarray(epsilon, dtype=float)
+    counts = np.zeros((len(thresholds), 3, 3), dtype=np.int64)
+    predicted = ~np.isnan(epsilon)
+    for code in (-1, 0, 1):
+        values = np.sort(epsilon[(experiment == code) & predicted])
+        belowLower = np.searchsorted(values, -thresholds, side='left')
+        belowUpper = np.searchsorted(values, thresholds, side='left')
+        atMostUpper = np.searchsorted(values, thresholds, side='right')
+        counts[:, code + 1, 0] = belowLower
+        counts[:, code + 1, 1] = belowUpper - belowLower
+        counts[:, code + 1, 2] = len(values) - atMostUpper
+    return counts
+
+
+def precision_recall(counts, interaction):
+    """Precision and recall of one type of interaction at each threshold.
+
+    Args:
+        counts (array(int)): output of interaction_counts.
+        interaction (str): 'positive' or 'negative'.
+
+    Returns:
+        array(float): precision per threshold.
+        array(float): recall per threshold.
+
+    """
+    c = INTERACTION_CODES[interaction] + 1
+    truePositives = counts[:, c, c].astype(float)
+    return (truePositives / counts[:, :, c].sum(axis=1),
+            truePositives / counts[:, c, :].sum(axis=1))
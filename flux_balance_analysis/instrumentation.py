@@ -0,0 +1,235 @@
+"""Counts and timers to find out where the time of a job goes.
+
+Disabled by default. Once enabled, with enable() or by setting the
+environment variable FBA_PROFILE before a job starts (qsub -V passes it
+on to the cluster jobs), the pipeline records:
+
+    phases      calls and time of named steps, e.g. sbml_parse, solver_setup
+    counters    e.g. knockout cache hits, knockouts skipped by the pruner
+    LP solves   number, time, solver status and simplex iterations
+
+Each job writes a json summary next to its output file (write_summary)
+and the collator adds them up into a report of the whole run
+(aggregate_summaries). While disabled every hook is one check of a module
+global, so the knockout loops run at full speed.
+"""
+
+import os
+import json
+import time
+import socket
+
+
+_recorder = None
+
+
+class Recorder(object):
+    """Phases, counters and LP solves recorded in this process."""
+
+    def __init__(self):
+        self.start = time.time()
+        # calls and seconds per phase
+        self.phases = {}
+        self.counters = {}
+        self.lpSolves = 0
+        self.lpSeconds = 0.
+        self.lpStatus = {}
+        self.lpIterations = 0
+        self.lpSolvesWithIterations = 0
+
+    def add_phase(self, name, seconds):
+        calls, total = self.phases.get(name, (0, 0.))
+        self.phases[name] = (calls + 1, total + seconds)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def record_solve(self, seconds, status, iterations=None):
+        self.lpSolves += 1
+        self.lpSeconds += seconds
+        self.lpStatus[status] = self.lpStatus.get(status, 0) + 1
+        if iterations is not None:
+            self.lpIterations += iterations
+            self.lpSolvesWithIterations += 1
+
+    def summary(self):
+        """Everything recorded so far, as a json-compatible dict."""
+        return {'host': socket.gethostname(),
+                'pid': os.getpid(),
+                'wall_seconds': time.time() - self.start,
+                'phases': {name: {'calls': calls, 'seconds': seconds}
+                           for name, (calls, seconds) in self.phases.items()},
+                'counters': dict(self.counters),
+                'lp': {'solves': self.lpSolves,
+                       'seconds': self.lpSeconds,
+                       'status': dict(self.lpStatus),
+                       'iterations': self.lpIterations,
+                       'solves_with_iterations': self.lpSolvesWithIterations}}
+
+
+class _Phase(object):
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exception):
+        self.recorder.add_phase(self.name, time.time() - self.start)
+        return False
+
+
+class _NoPhase(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        return False
+
+
+_NO_PHASE = _NoPhase()
+
+
+def enable():
+    """Start recording in this process, unless already recording."""
+    global _recorder
+    if _recorder is None:
+        _recorder = Recorder()
+    return _recorder
+
+
+def disable():
+    """Stop recording and drop what was recorded."""
+    global _recorder
+    _recorder = None
+
+
+def enabled():
+    return _recorder is not None
+
+
+def enable_from_environment():
+    """Enable if the FBA_PROFILE environment variable is set to anything but 0."""
+    if os.environ.get('FBA_PROFILE', '0') not in ('', '0'):
+        enable()
+    return enabled()
+
+
+def phase(name):
+    """Context manager timing a named step, e.g. with phase('sbml_parse'):"""
+    if _recorder is None:
+        return _NO_PHASE
+    return _Phase(_recorder, name)
+
+
+def count(name, n=1):
+    """Add n to a named counter."""
+    if _recorder is not None:
+        _recorder.count(name, n)
+
+
+def record_solve(seconds, status, iterations=None):
+    """Record one LP solve.
+
+    Args:
+        seconds (float): time of the solve.
+        status (str): solver status, e.g. 'optimal' or 'infeasible'.
+        iterations (int): simplex iterations, None if not known.
+
+    """
+    if _recorder is not None:
+        _recorder.record_solve(seconds, status, iterations)
+
+
+def summary():
+    """What this process recorded, None if not enabled."""
+    return _recorder.summary() if _recorder is not None else None
+
+
+def summary_path(outPath):
+    """Summary file of a job, next to its npz output file."""
+    return outPath[:-len('.npz')] + '.profile.json'
+
+
+def write_summary(path, **info):
+    """Write the summary of this job, if enabled.
+
+    Args:
+        path (str): json file, e.g. summary_path(outPath).
+        **info: added to the summary, e.g. job='single_knockouts'.
+
+    """
+    if _recorder is None:
+        return
+    content = _recorder.summary()
+    content.update(info)
+    tmpPath = path + '.' + str(os.getpid()) + '.tmp'
+    with open(tmpPath, 'w') as f:
+        json.dump(content, f, indent=1, sort_keys=True)
+    os.rename(tmpPath, path)
+
+
+def aggregate_summaries(paths, nSlowest=10):
+    """Report of a run from the summaries of its jobs.
+
+    Args:
+        paths (list(str)): job summary files.
+        nSlowest (int): number of slowest jobs to list.
+
+    Returns:
+        dict: totals of the phases, counters and LP solves, and the
+              slowest jobs.
+
+    """
+    phases = {}
+    counters = {}
+    lp = {'solves': 0, 'seconds': 0., 'status': {}, 'iterations': 0,
+          'solves_with_iterations': 0}
+    jobs = []
+    for path in paths:
+        with open(path, 'r') as f:
+            job = json.load(f)
+        jobs.append((job['wall_seconds'], job.get('job', os.path.basename(path))))
+        for name, p in job['phases'].items():
+            total = phases.setdefault(name, {'calls': 0, 'seconds': 0.})
+            total['calls'] += p['calls']
+            total['seconds'] += p['seconds']
+        for name, n in job['counters'].items():
+            counters[name] = counters.get(name, 0) + n
+        for key in ('solves', 'seconds', 'iterations', 'solves_with_iterations'):
+            lp[key] += job['lp'][key]
+        for status, n in job['lp']['status'].items():
+            lp['status'][status] = lp['status'].get(status, 0) + n
+    wallSeconds = [w for w, _name in jobs]
+    return {'jobs': len(jobs),
+            'wall_seconds': {'total': sum(wallSeconds),
+                             'max': max(wallSeconds) if len(jobs) > 0 else 0.,
+                             'mean': sum(wallSeconds) / len(jobs) if len(jobs) > 0 else 0.},
+            'phases': phases,
+            'counters': counters,
+            'lp': lp,
+            'slowest_jobs': [{'job': name, 'wall_seconds': w}
+                             for w, name in sorted(jobs, reverse=True)[:nSlowest]]}
+
+
+def format_report(report):
+    """Readable text of a report from aggregate_summaries."""
+    lines = [str(report['jobs']) + ' jobs, ' +
+             '%.0f s in total, %.0f s the longest' % (report['wall_seconds']['total'],
+                                                     report['wall_seconds']['max'])]
+    for name, p in sorted(report['phases'].items(), key=lambda item: -item[1]['seconds']):
+        lines.append('  %-30s %12.1f s %10d calls' % (name, p['seconds'], p['calls']))
+    lp = report['lp']
+    lines.append('  %d LP solves, %.1f s, %.2f ms each' % (
+        lp['solves'], lp['seconds'], 1000. * lp['seconds'] / max(lp['solves'], 1)))
+    lines.append('  status: ' + ', '.join(s + ' ' + str(n) for s, n in sorted(lp['status'].items())))
+    if lp['solves_with_iterations'] > 0:
+        lines.append('  %.1f simplex iterations per solve' % (
+            lp['iterations'] / float(lp['solves_with_iterations'])))
+    for name, n in sorted(report['counters'].items()):
+        lines.append('  %-30s %12d' % (name, n))
+    return '\n'.join(lines)
@@ -0,0 +1,257 @@
+"""Growth of knockouts already solved, shared between engines.
+
+Kept apart from fba_utils so engines that do not use cobra can import it.
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+from collections import OrderedDict
+import numpy as np
+import instrumentation
+
+
+def problem_hash(lowerBounds, upperBounds, objective, objectiveSense):
+    """Hash of the bounds and objective of an LP, part of the cache keys."""
+    sha1 = hashlib.sha1()
+    for values in (lowerBounds, upperBounds, objective):
+        sha1.update(np.ascontiguousarray(values, dtype=float).tobytes())
+    sha1.update(objectiveSense)
+    return sha1.hexdigest()
+
+
+class KnockoutCache(object):
+    """Growth of knockouts already solved, keyed on what was solved.
+
+    A key is (model hash, hash of the bounds and objective of the LP,
+    frozenset of deleted reaction positions), so one cache can be shared
+    by engines of different models and media. Entries are kept in memory
+    up to maxSize, least recently used first out, and optionally in an
+    sqlite file that several worker processes can share. New entries are
+    held back and written to the file commitEvery at a time, each batch in
+    one short transaction, since an open write transaction blocks the
+    writes of every other process. The file is in WAL mode, so reads never
+    wait for a write.
+
+    Args:
+        maxSize (int): number of entries kept in memory.
+        diskPath (str): optional sqlite file for the on-disk tier.
+        commitEvery (int): entries per write to the file.
+
+    """
+
+    def __init__(self, maxSize=50000, diskPath=None, commitEvery=100):
+        self.maxSize = maxSize
+        self.diskPath = diskPath
+        self.commitEvery = commitEvery
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.diskHits = 0
+        self.misses = 0
+        self._connection = None
+        self._connectionPid = None
+        # entries not written to the file yet, by on-disk key
+        self._pending = {}
+
+    def _disk(self):
+        # sqlite connections can not be shared with forked worker processes
+        if self._connectionPid != os.getpid():
+            # autocommit, transactions are started explicitly in flush
+            self._connection = sqlite3.connect(self.diskPath, timeout=60.,
+                                               isolation_level=None)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS knockouts '
+                                     '(key TEXT PRIMARY KEY, growth REAL)')
+            self._connectionPid = os.getpid()
+        return self._connection
+
+    @staticmethod
+    def _disk_key(key):
+        modelHash, problemHash, reactions = key
+        return modelHash + ':' + problemHash + ':' + ','.join(str(i) for i in sorted(reactions))
+
+    def get(self, key):
+        """Look up a knockout.
+
+        Returns:
+            bool: was it found.
+            float: growth, None if the LP had no optimal solution.
+
+        """
+        if key in self.entries:
+            growth = self.entries.pop(key)
+            self.entries[key] = growth
+            self.hits += 1
+            instrumentation.count('knockout_cache_hits')
+            return True, growth
+        if self.diskPath is not None:
+            diskKey = self._disk_key(key)
+            if diskKey in self._pending:
+                row = (self._pending[diskKey],)
+            else:
+                row = self._disk().execute('SELECT growth FROM knockouts WHERE key = ?',
+                                           (diskKey,)).fetchone()
+            if row is not None:
+                self.diskHits += 1
+                instrumentation.count('knockout_cache_disk_hits')
+                self._remember(key, row[0])
+                return True, row[0]
+        self.misses += 1
+        instrumentation.count('knockout_cache_misses')
+        return False, None
+
+    def put(self, key, growth):
+        """Store the growth of a knockout."""
+        self._remember(key, growth)
+        if self.diskPath is not None:
+            self._pending[self._disk_key(key)] = growth
+            if len(self._pending) >= self.commitEvery:
+                self.flush()
+
+    def _remember(self, key, growth):
+        self.entries[key] = growth
+        if len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+
+    def flush(self):
+        """Write the entries held back to the on-disk tier."""
+        if self.diskPath is None or len(self._pending) == 0:
+            return
+        connection = self._disk()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.executemany('INSERT OR REPLACE INTO knockouts VALUES (?, ?)',
+                                   self._pending.items())
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        self._pending = {}
+
+    def hit_rate(self):
+        """Fraction of lookups answered from memory or disk."""
+        lookups = self.hits + self.diskHits + self.misses
+        return (self.hits + self.diskHits) / float(lookups) if lookups > 0 else 0.
+
+    def __str__(self):
+        return ('knockout cache: ' + str(self.hits + self.diskHits) + ' hits (' +
+                str(self.diskHits) + ' from disk) out of ' +
+                str(self.hits + self.diskHits + self.misses) + ' lookups, ' +
+                '%.1f%%' % (100. * self.hit_rate()))
+
+
+class KnockoutJournal(object):
+    """Append-only file of the knockouts solved by one job, to resume it.
+
+    Used by an engine in place of its cache. Every knockout solved is
+    appended to the journal, and the file is synced to disk at most
+    syncInterval seconds after a knockout, so a job that is killed loses
+    at most that much work. Started again, the job reads the journal and
+    only solves the knockouts that are not in it. Lookups the journal can
+    not answer go to the cache it wraps.
+
+    Each line is the key as in the on-disk cache and the growth, empty for
+    LPs without an optimal solution. A partly written last line, from a
+    job killed during a write, is ignored.
+
+    Args:
+        path (str): journal file, e.g. journal_path(outPath).
+        cache (KnockoutCache): cache to wrap. Defaults to the cache shared
+                               by the process.
+        syncInterval (float): seconds between syncs to disk.
+
+    """
+
+    def __init__(self, path, cache=None, syncInterval=2.):
+        self.path = path
+        self.cache = cache if cache is not None else default_knockout_cache()
+        self.syncInterval = syncInterval
+        self.entries = {}
+        self.resumed = 0
+        if os.path.exists(path):
+            complete = 0
+            with open(path, 'r') as f:
+                for line in f:
+                    fields = line.split('\t')
+                    if not line.endswith('\n') or len(fields) != 2:
+                        break
+                    complete += len(line)
+                    growth = fields[1].strip()
+                    self.entries[fields[0]] = float(growth) if growth != '' else None
+            # drop a partly written last line, so new lines are not appended to it
+            if complete < os.path.getsize(path):
+                with open(path, 'r+') as f:
+                    f.truncate(complete)
+        self.nResumable = len(self.entries)
+        outDir = os.path.dirname(path)
+        if outDir != '' and not os.path.exists(outDir):
+            os.makedirs(outDir)
+        self._file = open(path, 'a')
+        self._lastSync = time.time()
+
+    def get(self, key):
+        """Look up a knockout, as KnockoutCache.get."""
+        growth = self.entries.get(KnockoutCache._disk_key(key), False)
+        if growth is not False:
+            self.resumed += 1
+            instrumentation.count('knockouts_resumed')
+            return True, growth
+        return self.cache.get(key)
+
+    def put(self, key, growth):
+        """Append the growth of a knockout to the journal."""
+        diskKey = KnockoutCache._disk_key(key)
+        if diskKey not in self.entries:
+            self.entries[diskKey] = growth
+            self._file.write(diskKey + '\t' + (repr(float(growth)) if growth is not None else '') +
+                             '\n')
+            if time.time() - self._lastSync >= self.syncInterval:
+                self.flush()
+        self.cache.put(key, growth)
+
+    def flush(self):
+        """Sync the journal to disk."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._lastSync = time.time()
+        self.cache.flush()
+
+    def close(self):
+        """Sync and close the journal."""
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def remove(self):
+        """Close and delete the journal, once the output of the job is written."""
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __str__(self):
+        return ('knockout journal: ' + str(self.resumed) + ' of ' + str(self.nResumable) +
+                ' knockouts from an earlier run reused\n' + str(self.cache))
+
+
+def journal_path(outPath):
+    """Journal file of a job, next to its npz output file."""
+    return outPath[:-len('.npz')] + '.journal'
+
+
+def journal_sync_interval():
+    """Seconds between journal syncs, from FBA_JOURNAL_SECONDS, default 2."""
+    return float(os.environ.get('FBA_JOURNAL_SECONDS', '2'))
+
+
+_defaultCache = None
+
+
+def default_knockout_cache():
+    """The in-memory knockout cache shared by all engines of this process."""
+    global _defaultCache
+    if _defaultCache is None:
+        _defaultCache = KnockoutCache()
+    return _defaultCache
@@ -0,0 +1,349 @@
+"""Persistent solver instance for running many knockouts on one model.
+
+cobra's model.optimize() builds a new solver problem from the reaction and
+metabolite objects on every call. For a knockout scan only a handful of
+bounds change between solves, so here the problem is built once and the
+bounds are changed in place. The solver then re-solves from the previous
+optimal basis, which for a bound change is a job for the dual simplex.
+
+Screens that only need to know whether a knockout is lethal can use
+grows() instead of knockout(): growth is fixed at the threshold and the LP
+is solved with a zero objective, so the solver stops at the first
+feasible point instead of going on to the optimum.
+
+An LP that ends in neither an optimal solution nor proven infeasibility,
+e.g. from numerical trouble, is solved again with the solver settings in
+RETRY_PARAMETERS, one after the other, and the status of each knockout is
+kept in the status attribute. The settings the LP had are put back after
+each retry; a retry is skipped if one of them is not known, since cobra's
+solver interfaces can set parameters but not read them. Failed knockouts
+are not cached, so a rerun tries them again.
+
+Works with any of cobra's solver interfaces (GLPK via cglpk, gurobi, cplex).
+"""
+
+import time
+import numpy as np
+import instrumentation
+from cobra.solvers import solver_dict, get_solver_name
+from fba_utils import model_hash
+from knockout_cache import default_knockout_cache, problem_hash
+
+
+# solver settings tried in turn on an LP that failed, each on top of the
+# settings the engine uses
+RETRY_PARAMETERS = [{'lp_method': 'primal'},
+                    {'lp_method': 'dual', 'tolerance_feasibility': 1.e-9},
+                    {'lp_method': 'barrier'}]
+# gurobi names of the parameters that can be read back from a gurobi LP
+_GUROBI_PARAMETERS = {'lp_method': 'Method', 'tolerance_feasibility': 'FeasibilityTol'}
+# LP outcomes worth caching and not worth solving again
+FINAL_STATUSES = ('optimal', 'infeasible', 'unbounded')
+
+
+class KnockoutEngine(object):
+    """LP for an FBA model that is built once and modified in place.
+
+    Args:
+        model (cobra.model): FBA model, with the bounds of the medium set.
+        solver (str): name of cobra solver interface. Defaults to the
+                      best one available, e.g. 'gurobi' or 'glpk'.
+        cache (KnockoutCache): knockouts already solved. Defaults to the
+                               cache shared by the process, False for none.
+        retries (list(dict)): solver parameters to retry failed LPs with.
+                              Defaults to RETRY_PARAMETERS, [] for none.
+
+    """
+
+    def __init__(self, model, solver=None, cache=None, retries=None):
+        self.model = model
+        self.solverName = solver if solver is not None else get_solver_name()
+        self.solver = solver_dict[self.solverName]
+        with instrumentation.phase('solver_setup'):
+            self.lp = self.solver.create_problem(model)
+            # solver parameters set by the engine, with their values
+            self.parameters = {}
+            if _prefer_dual_simplex(self.solver, self.lp):
+                self.parameters['lp_method'] = 'dual'
+        self.reactionIDs = [r.id for r in model.reactions]
+        self.reactionIndex = {rID: i for i, rID in enumerate(self.reactionIDs)}
+        self.lowerBounds = np.array([r.lower_bound for r in model.reactions])
+        self.upperBounds = np.array([r.upper_bound for r in model.reactions])
+        self.modelObjective = np.array([r.objective_coefficient for r in model.reactions])
+        self.objective = self.modelObjective.copy()
+        self.objectiveSense = 'maximize'
+        self.cache = cache if cache is not None else default_knockout_cache()
+        self.modelHash = model_hash(model) if self.cache else None
+        self._problemHash = None
+        self.retries = retries if retries is not None else RETRY_PARAMETERS
+        # solver status of the last knockout or solve
+        self.status = None
+        # number of LPs solved, and of LPs solved again after failing
+        self.nSolves = 0
+        self.nRetries = 0
+
+    def problem_hash(self):
+        """Hash of the current bounds and objective, part of the cache keys."""
+        if self._problemHash is None:
+            self._problemHash = problem_hash(self.lowerBounds, self.upperBounds,
+                                             self.objective, self.objectiveSense)
+        return self._problemHash
+
+    def optimize(self, objectiveSense='maximize'):
+        """Solve the LP with the current bounds.
+
+        Args:
+            objectiveSense (str): 'maximize' or 'minimize'.
+
+        Returns:
+            float: objective value, None if no optimal solution was found.
+
+        """
+        self.set_objective_sense(objectiveSense)
+        if self._solve() != 'optimal':
+            return None
+        return self.solver.get_objective_value(self.lp)
+
+    def _solve(self):
+        """Solve the LP as it is, retrying if it fails, and return the solver status."""
+        self.status = self._solve_once()
+        for parameters in self.retries:
+            if self.status in FINAL_STATUSES:
+                break
+            if self._retry(parameters):
+                self.nRetries += 1
+                instrumentation.count('lp_retries')
+        if self.status not in FINAL_STATUSES:
+            instrumentation.count('lp_failures')
+        return self.status
+
+    def _retry(self, parameters):
+        """Solve again with other parameters and put the current ones back.
+
+        Returns:
+            bool: False if skipped, because a current value is not known or
+                  a parameter can not be set.
+
+        """
+        current = {}
+        for name in parameters:
+            current[name] = self.parameters.get(name)
+            if current[name] is None:
+                current[name] = _read_parameter(self.lp, name)
+            if current[name] is None:
+                return False
+        try:
+            try:
+                for name, value in parameters.items():
+                    self.solver.set_parameter(self.lp, name, value)
+            except Exception:
+                return False
+            self.status = self._solve_once()
+        finally:
+            _set_parameters(self.solver, self.lp, current)
+        return True
+
+    def _solve_once(self):
+        self.nSolves += 1
+        if not instrumentation.enabled():
+            self.solver.solve_problem(self.lp)
+            return self.solver.get_status(self.lp)
+        start = time.time()
+        self.solver.solve_problem(self.lp)
+        status = self.solver.get_status(self.lp)
+        instrumentation.record_solve(time.time() - start, status, _iterations(self.lp))
+        return status
+
+    def knockout(self, reactionIndices):
+        """Growth with reactions blocked. The LP is restored afterwards.
+
+        Args:
+            reactionIndices (iterable(int)): positions of the reactions in
+                                             model.reactions.
+
+        Returns:
+            float: objective value, None if no optimal solution was found.
+                   The solver status is in the status attribute.
+
+        """
+        reactionIndices = list(reactionIndices)
+        self.set_objective_sense('maximize')
+        if self.cache:
+            key = (self.modelHash, self.problem_hash(), frozenset(reactionIndices))
+            found, growth = self.cache.get(key)
+            if found:
+                # only optimal and infeasible knockouts are cached
+                self.status = 'optimal' if growth is not None else 'infeasible'
+                return growth
+        for i in reactionIndices:
+            self.solver.change_variable_bounds(self.lp, i, 0., 0.)
+        try:
+            growth = self.optimize()
+        finally:
+            self.restore(reactionIndices)
+        if self.cache and self.status in ('optimal', 'infeasible'):
+            self.cache.put(key, growth)
+        return growth
+
+    def grows(self, reactionIndices, minGrowth):
+        """Can the objective reach minGrowth with reactions blocked.
+
+        The objective reaction's lower bound is raised to minGrowth and its
+        objective coefficient set to zero, so only feasibility is tested.
+        The LP is restored afterwards.
+
+        Args:
+            reactionIndices (iterable(int)): positions of the reactions in
+                                             model.reactions.
+            minGrowth (float): growth threshold.
+
+        Returns:
+            bool: True if growth of at least minGrowth is feasible.
+
+        """
+        reactionIndices = list(reactionIndices)
+        objectiveReactions = np.flatnonzero(self.objective)
+        if len(objectiveReactions) != 1 or self.objective[objectiveReactions[0]] < 0.:
+            raise UserWarning('ERROR: growth threshold needs a single maximized '
+                              'objective reaction')
+        b = objectiveReactions[0]
+        coefficient = self.objective[b]
+        lowerBound = max(self.lowerBounds[b], minGrowth / coefficient)
+        if lowerBound > self.upperBounds[b] or (b in reactionIndices and lowerBound > 0.):
+            return False
+        for i in reactionIndices:
+            self.solver.change_variable_bounds(self.lp, i, 0., 0.)
+        self.solver.change_variable_objective(self.lp, b, 0.)
+        self.solver.change_variable_bounds(self.lp, b, lowerBound, self.upperBounds[b])
+        try:
+            status = self._solve()
+        finally:
+            self.solver.change_variable_objective(self.lp, b, coefficient)
+            self.restore(reactionIndices + [b])
+        if status == 'optimal':
+            return True
+        if status == 'infeasible':
+            return False
+        # e.g. numerical trouble, fall back to solving for growth
+        growth = self.knockout(reactionIndices)
+        return growth is not None and growth >= minGrowth
+
+    def restore(self, reactionIndices):
+        """Reset bounds of reactions to their stored values."""
+        for i in reactionIndices:
+            self.solver.change_variable_bounds(self.lp, i,
+                                               self.lowerBounds[i],
+                                               self.upperBounds[i])
+
+    def set_bounds(self, reactionIndices, lowerBounds, upperBounds):
+        """Permanently change bounds, e.g. to switch medium.
+
+        Only bounds that differ from the stored ones are sent to the solver.
+
+        Args:
+            reactionIndices (array(int)): positions of the reactions.
+            lowerBounds (array(float)): new lower bounds.
+            upperBounds (array(float)): new upper bounds.
+
+        """
+        reactionIndices = np.asarray(reactionIndices, dtype=int)
+        lowerBounds = np.broadcast_to(np.asarray(lowerBounds, dtype=float),
+                                      reactionIndices.shape)
+        upperBounds = np.broadcast_to(np.asarray(upperBounds, dtype=float),
+                                      reactionIndices.shape)
+        changed = ((self.lowerBounds[reactionIndices] != lowerBounds) |
+                   (self.upperBounds[reactionIndices] != upperBounds))
+        for i, lb, ub in zip(reactionIndices[changed],
+                             lowerBounds[changed],
+                             upperBounds[changed]):
+            self.solver.change_variable_bounds(self.lp, i, lb, ub)
+        self.lowerBounds[reactionIndices] = lowerBounds
+        self.upperBounds[reactionIndices] = upperBounds
+        if changed.any():
+            self._problemHash = None
+
+    def set_objective(self, coefficients):
+        """Change the objective coefficients, e.g. for flux variability.
+
+        Only coefficients that differ from the current ones are sent to the
+        solver.
+
+        Args:
+            coefficients (array(float)): coefficient per reaction.
+
+        """
+        coefficients = np.asarray(coefficients, dtype=float)
+        changed = np.flatnonzero(coefficients != self.objective)
+        for i in changed:
+            self.solver.change_variable_objective(self.lp, i, coefficients[i])
+        self.objective = coefficients.copy()
+        if len(changed) > 0:
+            self._problemHash = None
+
+    def set_objective_sense(self, objectiveSense):
+        """Set 'maximize' or 'minimize' for the following solves."""
+        if objectiveSense != self.objectiveSense:
+            self.solver.set_parameter(self.lp, 'objective_sense', objectiveSense)
+            self.objectiveSense = objectiveSense
+            self._problemHash = None
+
+    def reset_objective(self):
+        """Go back to the objective of the model, maximized."""
+        self.set_objective(self.modelObjective)
+        self.set_objective_sense('maximize')
+
+    def fluxes(self):
+        """Flux vector of the last solution, in model.reactions order."""
+        return np.array(self.solver.format_solution(self.lp, self.model).x)
+
+
+def _prefer_dual_simplex(solver, lp):
+    """Use the dual simplex where the solver interface lets us choose.
+
+    After a bound change the previous basis stays dual feasible, so the dual
+    simplex can continue from it instead of starting over.
+
+    Returns:
+        bool: was it set.
+
+    """
+    try:
+        solver.set_parameter(lp, 'lp_method', 'dual')
+    except Exception:
+        return False
+    return True
+
+
+def _set_parameters(solver, lp, parameters):
+    """Set solver parameters, skipping those the solver interface does not have."""
+    for name, value in parameters.items():
+        try:
+            solver.set_parameter(lp, name, value)
+        except Exception:
+            pass
+
+
+def _read_parameter(lp, name):
+    """Current value of a solver parameter, None if it can not be read.
+
+    Only gurobi LPs can be asked; their values are gurobi's own, which
+    cobra's gurobi interface also takes when setting.
+    """
+    try:
+        return lp.getParamInfo(_GUROBI_PARAMETERS[name])[2]
+    except Exception:
+        return None
+
+
+def _iterations(lp):
+    """Simplex iterations of the last solve, None if the interface does not say."""
+    try:
+        # gurobi
+        return int(lp.IterCount)
+    except Exception:
+        pass
+    try:
+        # cplex
+        return lp.solution.progress.get_num_iterations()
+    except Exception:
+        return None
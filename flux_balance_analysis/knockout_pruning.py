@@ -0,0 +1,123 @@
+"""Skip knockouts that cannot change growth.
+
+If there is a wild-type optimal solution in which every deleted reaction
+carries zero flux, that solution is still feasible after the deletion, so
+the optimal growth is unchanged and no LP needs to be solved.
+"""
+
+import numpy as np
+import instrumentation
+from result_store import STATUS_CODES, status_code
+
+
+class KnockoutPruner(object):
+    """Decides from wild-type solutions whether a knockout needs an LP.
+
+    Args:
+        wtGrowth (float): wild-type optimal growth.
+        fluxes (array(float)): a wild-type optimal flux vector, or one row
+                               per alternative optimal flux vector.
+        minFlux (array(float)): optional minimum flux of each reaction
+                                over all wild-type optima (flux variability).
+        maxFlux (array(float)): optional maximum flux, as minFlux.
+        tolerance (float): fluxes smaller than this count as zero.
+
+    """
+
+    def __init__(self, wtGrowth, fluxes, minFlux=None, maxFlux=None,
+                 tolerance=1.e-9):
+        self.wtGrowth = wtGrowth
+        # one row per optimum, True where the reaction carries flux
+        self.active = np.abs(np.atleast_2d(fluxes)) > tolerance
+        if minFlux is not None and maxFlux is not None:
+            # the optima form a convex set, so a reaction can be deleted on
+            # its own without effect if zero is inside its range
+            self.canBeZero = ((np.asarray(minFlux) <= tolerance) &
+                              (np.asarray(maxFlux) >= -tolerance))
+        else:
+            self.canBeZero = ~self.active.all(axis=0)
+        self.nSkipped = 0
+        self.nSolved = 0
+
+    @classmethod
+    def from_engine(cls, engine, tolerance=1.e-9):
+        """Pruner from the current optimal solution of a KnockoutEngine."""
+        wtGrowth = engine.optimize()
+        return cls(wtGrowth, engine.fluxes(), tolerance=tolerance)
+
+    def can_skip(self, reactionIndices):
+        """Is growth after deleting the reactions equal to wild-type.
+
+        Args:
+            reactionIndices (iterable(int)): positions of deleted reactions.
+
+        Returns:
+            bool: True if no LP is needed.
+
+        """
+        reactionIndices = list(reactionIndices)
+        if len(reactionIndices) == 0:
+            return True
+        if len(reactionIndices) == 1 and self.canBeZero[reactionIndices[0]]:
+            return True
+        return bool((~self.active[:, reactionIndices].any(axis=1)).any())
+
+    def knockout(self, engine, reactionIndices):
+        """Growth after deleting reactions, solving an LP only if needed.
+
+        Args:
+            engine (KnockoutEngine): solver instance for the model.
+            reactionIndices (iterable(int)): positions of deleted reactions.
+
+        Returns:
+            float: growth value.
+
+        """
+        return self.knockout_with_status(engine, reactionIndices)[0]
+
+    def knockout_with_status(self, engine, reactionIndices):
+        """Same as knockout, with the status of the solve.
+
+        Returns:
+            float: growth value, None if no optimal solution was found.
+            int: status code, see result_store.STATUS_CODES. Optimal for
+                 knockouts that need no LP.
+
+        """
+        reactionIndices = list(reactionIndices)
+        if self.can_skip(reactionIndices):
+            self.nSkipped += 1
+            instrumentation.count('knockouts_skipped')
+            return self.wtGrowth, STATUS_CODES['optimal']
+        self.nSolved += 1
+        instrumentation.count('knockouts_solved')
+        growth = engine.knockout(reactionIndices)
+        return growth, status_code(engine.status)
+
+    def grows(self, engine, reactionIndices, minGrowth):
+        """Is growth after deleting reactions at least minGrowth.
+
+        Solves a feasibility LP only if needed, see KnockoutEngine.grows.
+
+        Args:
+            engine (KnockoutEngine): solver instance for the model.
+            reactionIndices (iterable(int)): positions of deleted reactions.
+            minGrowth (float): growth threshold.
+
+        Returns:
+            bool: True if the knockout can grow at minGrowth.
+
+        """
+        reactionIndices = list(reactionIndices)
+        if self.can_skip(reactionIndices):
+            self.nSkipped += 1
+            instrumentation.count('knockouts_skipped')
+            return self.wtGrowth >= minGrowth
+        self.nSolved += 1
+        instrumentation.count('knockouts_solved')
+        return engine.grows(reactionIndices, minGrowth)
+
+    def __str__(self):
+        total = self.nSkipped + self.nSolved
+        return ('skipped ' + str(self.nSkipped) + ' out of ' + str(total) +
+                ' knockout LPs')
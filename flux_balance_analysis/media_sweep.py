@@ -0,0 +1,115 @@
+"""Knockouts across many minimal media in one call.
+
+The model and its solver problem stay loaded; between media only the
+bounds of the exchange reactions change, and the solver starts from the
+basis of the previous medium. The wildtype growth of every medium is
+solved first, so media without growth are skipped together.
+
+For essentiality screens over all the media, lethalOnly replaces the
+knockout LPs with feasibility tests at the lethal growth threshold.
+"""
+
+import numpy as np
+from fba_utils import MediumConfiguration
+from knockout_engine import KnockoutEngine
+from gene_rules import GeneReactionIndex
+from knockout_pruning import KnockoutPruner
+
+
+def single_gene_knockouts(geneRules, costType='gene'):
+    """Reactions deleted by each single gene knockout.
+
+    Args:
+        geneRules (GeneReactionIndex): gene to reaction lookups for the model.
+        costType (str): 'gene' for reactions whose rule evaluates to false,
+                        'function' for every reaction the gene is in.
+
+    Returns:
+        dict(str: set(int)): reaction positions per ORF ID.
+
+    """
+    if costType == 'gene':
+        return {g: geneRules.gene_loss_reactions([g]) for g in geneRules.genes}
+    if costType == 'function':
+        return {g: set(geneRules.reactions_of(g)) for g in geneRules.genes}
+    raise UserWarning('ERROR: unknown cost type ' + costType)
+
+
+def wildtype_growth_in_media(mediumConfig, engine, media):
+    """Wildtype growth in each minimal media.
+
+    Args:
+        mediumConfig (MediumConfiguration): exchange reactions of the model.
+        engine (KnockoutEngine): solver instance for the model.
+        media (list(tuple(str, str))): carbon and nitrogen source names.
+
+    Returns:
+        array(float): growth per media, 0 where the LP is infeasible.
+
+    """
+    growth = np.zeros(len(media))
+    for i, (carbonSource, nitrogenSource) in enumerate(media):
+        mediumConfig.set_minimal_media(carbonSource, nitrogenSource, engine=engine)
+        wtGrowth = engine.optimize()
+        growth[i] = wtGrowth if wtGrowth is not None else 0.
+    return growth
+
+
+def knockout_media_sweep(model, media, knockouts=None, engine=None,
+                         mediumConfig=None, minGrowth=0.01, verbose=False,
+                         lethalOnly=False, lethalCost=0.999):
+    """Cost of each knockout in each minimal media.
+
+    Args:
+        model (cobra.model): FBA model, with its default bounds.
+        media (list(tuple(str, str))): carbon and nitrogen source names.
+        knockouts (dict(str: iterable(int))): reaction positions deleted by
+                                              each knockout. All single
+                                              gene-loss knockouts if not given.
+        engine (KnockoutEngine): solver instance for the model. Built from
+                                 the model if not given.
+        mediumConfig (MediumConfiguration): exchange reactions of the model.
+                                            Built from the model if not given.
+        minGrowth (float): media with lower wildtype growth are skipped.
+        verbose (bool): flag to print out messages.
+        lethalOnly (bool): only test if each knockout is lethal, the cost
+                           is then 1 for lethal knockouts and 0 otherwise.
+        lethalCost (float): with lethalOnly, costs above this are lethal.
+
+    Returns:
+        list(str): knockout names, in the order of the rows.
+        array(float): wildtype growth per media.
+        array(float): knockouts x media cost, NaN in media without growth.
+
+    """
+    if engine is None:
+        engine = KnockoutEngine(model)
+    if mediumConfig is None:
+        mediumConfig = MediumConfiguration(model)
+    if knockouts is None:
+        knockouts = single_gene_knockouts(GeneReactionIndex(model), 'gene')
+    names = sorted(knockouts.keys())
+    wtGrowth = wildtype_growth_in_media(mediumConfig, engine, media)
+    grew = wtGrowth >= minGrowth
+    if verbose:
+        print (~grew).sum(), '/', len(media), 'media without wildtype growth skipped'
+    costs = np.empty((len(names), len(media)))
+    costs[...] = np.nan
+    nSkipped = 0
+    nSolved = 0
+    for j in np.flatnonzero(grew):
+        mediumConfig.set_minimal_media(media[j][0], media[j][1], engine=engine)
+        pruner = KnockoutPruner.from_engine(engine)
+        for i, name in enumerate(names):
+            if lethalOnly:
+                costs[i, j] = not pruner.grows(engine, knockouts[name],
+                                               (1. - lethalCost) * pruner.wtGrowth)
+                continue
+            growth = pruner.knockout(engine, knockouts[name])
+            costs[i, j] = (pruner.wtGrowth - (growth if growth is not None else 0.)) / pruner.wtGrowth
+        nSkipped += pruner.nSkipped
+        nSolved += pruner.nSolved
+    mediumConfig.apply(mediumConfig.defaultLowerBounds, engine=engine)
+    if verbose:
+        print 'skipped', nSkipped, 'out of', nSkipped + nSolved, 'knockout LPs'
+    return names, wtGrowth, costs
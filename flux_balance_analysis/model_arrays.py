@@ -0,0 +1,518 @@
+"""FBA model exported to arrays, and a knockout engine that needs no cobra.
+
+cobra builds its solver problem from Python reaction and metabolite
+objects. ModelArrays holds the same problem as arrays: the stoichiometric
+matrix in sparse CSR form, the bound and objective vectors and the
+gene-reaction rules. It is exported from a cobra model once and can be
+saved to an npz file, so a knockout scan can run without cobra.
+
+ArrayKnockoutEngine solves the LPs with GLPK or scipy's linprog. The
+bounds are kept as arrays and a knockout is passed as changes to them, so
+the inner loop of a scan touches no Python object per reaction. It has the
+methods of KnockoutEngine that the pruner, the double knockout planner,
+the media sweep and the flux variability code use, so they take either
+engine. HiGHS is used where scipy has it (scipy >= 1.6, which needs
+Python 3). Otherwise GLPK, through swiglpk, is used: the LP is built once
+from the sparse arrays and a knockout only changes the bounds of the
+columns that differ from the last solve, so the simplex starts from the
+last optimal basis. The simplex of older scipy versions, such as the 0.18
+in requirements.txt, works on a dense tableau and takes seconds per LP on
+a genome-scale model, so it is refused for models larger than
+MAX_DENSE_SIZE. LPs that fail, e.g. at the iteration limit or from
+numerical trouble, are solved again with the other settings in retries.
+"""
+
+import time
+import hashlib
+import numpy as np
+import scipy
+from scipy import sparse
+from scipy.optimize import linprog
+import instrumentation
+from gene_rules import GeneReactionIndex
+from knockout_cache import default_knockout_cache, problem_hash
+from file_utils import write_npz
+try:
+    import swiglpk as glpk
+except ImportError:
+    glpk = None
+
+
+# linprog status codes, the others are failures
+_STATUS = {0: 'optimal', 2: 'infeasible', 3: 'unbounded'}
+FINAL_STATUSES = ('optimal', 'infeasible', 'unbounded')
+# largest model, metabolites x reactions, for the dense simplex of old scipy
+MAX_DENSE_SIZE = 250000
+if glpk is not None:
+    _GLPK_STATUS = {glpk.GLP_OPT: 'optimal', glpk.GLP_NOFEAS: 'infeasible',
+                    glpk.GLP_UNBND: 'unbounded'}
+
+
+class ModelArrays(object):
+    """The LP and gene-reaction rules of an FBA model, as arrays.
+
+    Args:
+        reactionIDs (list(str)): reaction IDs, in the order of the model.
+        metaboliteIDs (list(str)): metabolite IDs, the rows of stoichiometry.
+        stoichiometry (sparse matrix): metabolites x reactions.
+        lowerBounds (array(float)): lower bound per reaction.
+        upperBounds (array(float)): upper bound per reaction.
+        objective (array(float)): objective coefficient per reaction.
+        genes (list(str)): ORF IDs.
+        rules (list(str)): gene-reaction rule of each reaction.
+
+    """
+
+    def __init__(self, reactionIDs, metaboliteIDs, stoichiometry, lowerBounds,
+                 upperBounds, objective, genes, rules):
+        self.reactionIDs = list(reactionIDs)
+        self.metaboliteIDs = list(metaboliteIDs)
+        self.stoichiometry = sparse.csr_matrix(stoichiometry, dtype=float)
+        self.lowerBounds = np.array(lowerBounds, dtype=float)
+        self.upperBounds = np.array(upperBounds, dtype=float)
+        self.objective = np.array(objective, dtype=float)
+        self.genes = list(genes)
+        self.rules = list(rules)
+        if self.stoichiometry.shape != (len(self.metaboliteIDs), len(self.reactionIDs)):
+            raise UserWarning('ERROR: stoichiometry should be metabolites x reactions')
+
+    @classmethod
+    def from_model(cls, model):
+        """Export a cobra model, with its current bounds and objective."""
+        metaboliteIndex = {m.id: i for i, m in enumerate(model.metabolites)}
+        rows = []
+        columns = []
+        coefficients = []
+        for j, r in enumerate(model.reactions):
+            for m, coefficient in r.metabolites.items():
+                rows.append(metaboliteIndex[m.id])
+                columns.append(j)
+                coefficients.append(coefficient)
+        stoichiometry = sparse.csr_matrix((coefficients, (rows, columns)),
+                                          shape=(len(model.metabolites),
+                                                 len(model.reactions)))
+        return cls([r.id for r in model.reactions],
+                   [m.id for m in model.metabolites],
+                   stoichiometry,
+                   [r.lower_bound for r in model.reactions],
+                   [r.upper_bound for r in model.reactions],
+                   [r.objective_coefficient for r in model.reactions],
+                   [g.id for g in model.genes],
+                   [r.gene_reaction_rule for r in model.reactions])
+
+    def save(self, path):
+        """Write to an npz file."""
+        write_npz(path,
+                  reactionIDs=np.array(self.reactionIDs, dtype=str),
+                  metaboliteIDs=np.array(self.metaboliteIDs, dtype=str),
+                  data=self.stoichiometry.data,
+                  indices=self.stoichiometry.indices,
+                  indptr=self.stoichiometry.indptr,
+                  lowerBounds=self.lowerBounds,
+                  upperBounds=self.upperBounds,
+                  objective=self.objective,
+                  genes=np.array(self.genes, dtype=str),
+                  rules=np.array(self.rules, dtype=str))
+
+    @classmethod
+    def load(cls, path):
+        """Read an npz file written by save."""
+        data = np.load(path)
+        reactionIDs = [str(r) for r in data['reactionIDs']]
+        metaboliteIDs = [str(m) for m in data['metaboliteIDs']]
+        stoichiometry = sparse.csr_matrix((data['data'], data['indices'], data['indptr']),
+                                          shape=(len(metaboliteIDs), len(reactionIDs)))
+        return cls(reactionIDs, metaboliteIDs, stoichiometry,
+                   data['lowerBounds'], data['upperBounds'], data['objective'],
+                   [str(g) for g in data['genes']], [str(r) for r in data['rules']])
+
+    def gene_index(self):
+        """GeneReactionIndex of the exported rules."""
+        return GeneReactionIndex.from_rules(self.genes, self.reactionIDs, self.rules)
+
+    def model_hash(self):
+        """Hash of the reactions and stoichiometry, as fba_utils.model_hash."""
+        sha1 = hashlib.sha1()
+        for ID in self.reactionIDs + self.metaboliteIDs:
+            sha1.update(ID)
+        stoichiometry = self.stoichiometry.tocsc()
+        stoichiometry.sort_indices()
+        for values in (stoichiometry.indptr, stoichiometry.indices, stoichiometry.data):
+            sha1.update(np.ascontiguousarray(values).tobytes())
+        return sha1.hexdigest()
+
+
+class ArrayKnockoutEngine(object):
+    """Knockout LPs of a ModelArrays, solved with GLPK or scipy's linprog.
+
+    Args:
+        arrays (ModelArrays): the model, with the bounds of the medium set.
+        method (str): 'glpk' or a linprog method. Defaults to 'highs' if
+                      available, then 'glpk', see linprog_method.
+        cache (KnockoutCache): knockouts already solved. Defaults to the
+                               cache shared by the process, False for none.
+        retries (list(dict)): method and options to retry failed LPs with.
+                              Defaults to the other HiGHS solvers, for GLPK
+                              presolve and then the primal simplex, or for
+                              the simplex tighter tolerances and Bland's
+                              rule. [] for none.
+
+    """
+
+    def __init__(self, arrays, method=None, cache=None, retries=None):
+        self.arrays = arrays
+        self.method = linprog_method(arrays, method)
+        self.reactionIDs = arrays.reactionIDs
+        self.reactionIndex = {rID: i for i, rID in enumerate(self.reactionIDs)}
+        self.lowerBounds = arrays.lowerBounds.copy()
+        self.upperBounds = arrays.upperBounds.copy()
+        self.modelObjective = arrays.objective.copy()
+        self.objective = self.modelObjective.copy()
+        self.objectiveSense = 'maximize'
+        if self.method == 'glpk':
+            self._glpk = GlpkProblem(arrays.stoichiometry)
+        elif self.method.startswith('highs'):
+            self._equality = arrays.stoichiometry
+        else:
+            self._equality = arrays.stoichiometry.toarray()
+        self._zeros = np.zeros(arrays.stoichiometry.shape[0])
+        self.x = None
+        self.status = None
+        self.cache = cache if cache is not None else default_knockout_cache()
+        self.modelHash = arrays.model_hash() if self.cache else None
+        self._problemHash = None
+        self.retries = retries if retries is not None else _default_retries(self.method)
+        # number of LPs solved, and of LPs solved again after failing
+        self.nSolves = 0
+        self.nRetries = 0
+
+    def problem_hash(self):
+        """Hash of the current bounds and objective, part of the cache keys."""
+        if self._problemHash is None:
+            self._problemHash = problem_hash(self.lowerBounds, self.upperBounds,
+                                             self.objective, self.objectiveSense)
+        return self._problemHash
+
+    def solve(self, lowerBounds, upperBounds, objective):
+        """Solve with the given bounds and objective, the stored ones are not used.
+
+        Returns:
+            float: objective value, None if no optimal solution was found.
+
+        """
+        sign = -1. if self.objectiveSense == 'maximize' else 1.
+        c = sign * objective
+        x, value = self._solve_lp(c, lowerBounds, upperBounds, {'method': self.method})
+        for attempt in self.retries:
+            if self.status in FINAL_STATUSES:
+                break
+            self.nRetries += 1
+            instrumentation.count('lp_retries')
+            x, value = self._solve_lp(c, lowerBounds, upperBounds, attempt)
+        if self.status not in FINAL_STATUSES:
+            instrumentation.count('lp_failures')
+        if self.status != 'optimal':
+            return None
+        # None for GLPK, which keeps the solution until fluxes asks for it
+        self.x = x
+        return sign * value
+
+    def _solve_lp(self, c, lowerBounds, upperBounds, attempt):
+        self.nSolves += 1
+        start = time.time()
+        if attempt['method'] == 'glpk':
+            value, self.status, nIterations = self._glpk.solve(
+                c, lowerBounds, upperBounds, **attempt.get('options', {}))
+            x = None
+        else:
+            result = linprog(c, A_eq=self._equality, b_eq=self._zeros,
+                             bounds=self._bounds(lowerBounds, upperBounds), **attempt)
+            x, value, nIterations = result.x, result.fun, int(result.nit)
+            self.status = _STATUS.get(result.status, 'failed')
+        instrumentation.record_solve(time.time() - start, self.status, nIterations)
+        return x, value
+
+    def _bounds(self, lowerBounds, upperBounds):
+        if self.method.startswith('highs'):
+            return np.column_stack((lowerBounds, upperBounds))
+        # older linprog takes None for unbounded
+        return [(lb if np.isfinite(lb) else None, ub if np.isfinite(ub) else None)
+                for lb, ub in zip(lowerBounds, upperBounds)]
+
+    def bounds_with(self, reactionIndices, lowerBounds, upperBounds):
+        """Copies of the stored bounds, changed at some reactions.
+
+        Args:
+            reactionIndices (list(int)): positions of the reactions.
+            lowerBounds (array(float)): their lower bounds.
+            upperBounds (array(float)): their upper bounds.
+
+        Returns:
+            array(float): lower bound per reaction.
+            array(float): upper bound per reaction.
+
+        """
+        lb = self.lowerBounds.copy()
+        ub = self.upperBounds.copy()
+        lb[reactionIndices] = lowerBounds
+        ub[reactionIndices] = upperBounds
+        return lb, ub
+
+    def optimize(self, objectiveSense='maximize'):
+        """Solve the LP with the current bounds.
+
+        Args:
+            objectiveSense (str): 'maximize' or 'minimize'.
+
+        Returns:
+            float: objective value, None if no optimal solution was found.
+
+        """
+        self.set_objective_sense(objectiveSense)
+        return self.solve(self.lowerBounds, self.upperBounds, self.objective)
+
+    def knockout(self, reactionIndices):
+        """Growth with reactions blocked.
+
+        Args:
+            reactionIndices (iterable(int)): positions of the reactions.
+
+        Returns:
+            float: objective value, None if no optimal solution was found.
+                   The solver status is in the status attribute.
+
+        """
+        reactionIndices = list(reactionIndices)
+        self.set_objective_sense('maximize')
+        if self.cache:
+            key = (self.modelHash, self.problem_hash(), frozenset(reactionIndices))
+            found, growth = self.cache.get(key)
+            if found:
+                # only optimal and infeasible knockouts are cached
+                self.status = 'optimal' if growth is not None else 'infeasible'
+                return growth
+        lb, ub = self.bounds_with(reactionIndices, 0., 0.)
+        growth = self.solve(lb, ub, self.objective)
+        if self.cache and self.status in ('optimal', 'infeasible'):
+            self.cache.put(key, growth)
+        return growth
+
+    def grows(self, reactionIndices, minGrowth):
+        """Can the objective reach minGrowth with reactions blocked.
+
+        Same feasibility test as KnockoutEngine.grows.
+
+        Args:
+            reactionIndices (iterable(int)): positions of the reactions.
+            minGrowth (float): growth threshold.
+
+        Returns:
+            bool: True if growth of at least minGrowth is feasible.
+
+        """
+        reactionIndices = list(reactionIndices)
+        objectiveReactions = np.flatnonzero(self.objective)
+        if len(objectiveReactions) != 1 or self.objective[objectiveReactions[0]] < 0.:
+            raise UserWarning('ERROR: growth threshold needs a single maximized '
+                              'objective reaction')
+        b = objectiveReactions[0]
+        lb, ub = self.bounds_with(reactionIndices, 0., 0.)
+        lb[b] = max(lb[b], minGrowth / self.objective[b])
+        if lb[b] > ub[b]:
+            return False
+        self.solve(lb, ub, np.zeros(len(self.objective)))
+        if self.status == 'optimal':
+            return True
+        if self.status == 'infeasible':
+            return False
+        growth = self.knockout(reactionIndices)
+        return growth is not None and growth >= minGrowth
+
+    def set_bounds(self, reactionIndices, lowerBounds, upperBounds):
+        """Permanently change bounds, e.g. to switch medium."""
+        reactionIndices = np.asarray(reactionIndices, dtype=int)
+        self.lowerBounds[reactionIndices] = lowerBounds
+        self.upperBounds[reactionIndices] = upperBounds
+        self._problemHash = None
+
+    def set_objective(self, coefficients):
+        """Change the objective coefficients."""
+        self.objective = np.array(coefficients, dtype=float)
+        self._problemHash = None
+
+    def set_objective_sense(self, objectiveSense):
+        """Set 'maximize' or 'minimize' for the following solves."""
+        if objectiveSense != self.objectiveSense:
+            self.objectiveSense = objectiveSense
+            self._problemHash = None
+
+    def reset_objective(self):
+        """Go back to the objective of the model, maximized."""
+        self.set_objective(self.modelObjective)
+        self.set_objective_sense('maximize')
+
+    def fluxes(self):
+        """Flux vector of the last optimal solution."""
+        if self.x is None:
+            self.x = self._glpk.primal_values()
+        return self.x.copy()
+
+
+class GlpkProblem(object):
+    """Steady-state LP of a stoichiometric matrix, built once in GLPK.
+
+    Each solve sends only the column bounds and objective coefficients that
+    differ from the last solve, and the dual simplex starts from the last
+    optimal basis, which stays dual feasible when bounds change.
+
+    Args:
+        stoichiometry (sparse matrix): metabolites x reactions.
+
+    """
+
+    def __init__(self, stoichiometry):
+        if glpk is None:
+            raise UserWarning('ERROR: GLPK needs the swiglpk package')
+        nRows, nColumns = stoichiometry.shape
+        glpk.glp_term_out(glpk.GLP_OFF)
+        self.lp = glpk.glp_create_prob()
+        glpk.glp_set_obj_dir(self.lp, glpk.GLP_MIN)
+        glpk.glp_add_rows(self.lp, nRows)
+        glpk.glp_add_cols(self.lp, nColumns)
+        for i in range(nRows):
+            glpk.glp_set_row_bnds(self.lp, i + 1, glpk.GLP_FX, 0., 0.)
+        entries = sparse.coo_matrix(stoichiometry)
+        rows = glpk.intArray(entries.nnz + 1)
+        columns = glpk.intArray(entries.nnz + 1)
+        values = glpk.doubleArray(entries.nnz + 1)
+        # GLPK counts rows, columns and array positions from 1
+        for k in range(entries.nnz):
+            rows[k + 1] = int(entries.row[k]) + 1
+            columns[k + 1] = int(entries.col[k]) + 1
+            values[k + 1] = float(entries.data[k])
+        glpk.glp_load_matrix(self.lp, entries.nnz, rows, columns, values)
+        glpk.glp_scale_prob(self.lp, glpk.GLP_SF_AUTO)
+        glpk.glp_adv_basis(self.lp, 0)
+        # new GLPK columns are fixed at zero, with a zero objective
+        self.lowerBounds = np.zeros(nColumns)
+        self.upperBounds = np.zeros(nColumns)
+        self.objective = np.zeros(nColumns)
+
+    def __del__(self):
+        if glpk is not None and getattr(self, 'lp', None) is not None:
+            glpk.glp_delete_prob(self.lp)
+
+    def solve(self, objective, lowerBounds, upperBounds, presolve=False, primal=False):
+        """Minimize the objective with the given bounds.
+
+        Args:
+            objective (array(float)): coefficient per reaction.
+            lowerBounds (array(float)): lower bound per reaction.
+            upperBounds (array(float)): upper bound per reaction.
+            presolve (bool): use the GLPK presolver.
+            primal (bool): use the primal simplex from a new basis.
+
+        Returns:
+            float: objective value, None if not optimal. The solution is
+                   read with primal_values.
+            str: 'optimal', 'infeasible', 'unbounded' or 'failed'.
+            int: simplex iterations.
+
+        """
+        if (lowerBounds > upperBounds).any():
+            return None, 'infeasible', 0
+        changed = np.flatnonzero((lowerBounds != self.lowerBounds) |
+                                 (upperBounds != self.upperBounds))
+        for j in changed:
+            self._set_column_bounds(j, lowerBounds[j], upperBounds[j])
+        self.lowerBounds[changed] = lowerBounds[changed]
+        self.upperBounds[changed] = upperBounds[changed]
+        changed = np.flatnonzero(objective != self.objective)
+        for j in changed:
+            glpk.glp_set_obj_coef(self.lp, int(j) + 1, float(objective[j]))
+        self.objective[changed] = objective[changed]
+        parameters = glpk.glp_smcp()
+        glpk.glp_init_smcp(parameters)
+        parameters.msg_lev = glpk.GLP_MSG_OFF
+        parameters.presolve = glpk.GLP_ON if presolve else glpk.GLP_OFF
+        if primal:
+            parameters.meth = glpk.GLP_PRIMAL
+            glpk.glp_adv_basis(self.lp, 0)
+        else:
+            parameters.meth = glpk.GLP_DUALP
+        iterations = glpk.glp_get_it_cnt(self.lp)
+        returnCode = glpk.glp_simplex(self.lp, parameters)
+        iterations = glpk.glp_get_it_cnt(self.lp) - iterations
+        if returnCode == glpk.GLP_ENOPFS:
+            # found infeasible by the presolver
+            status = 'infeasible'
+        elif returnCode != 0:
+            status = 'failed'
+        else:
+            status = _GLPK_STATUS.get(glpk.glp_get_status(self.lp), 'failed')
+        if status != 'optimal':
+            return None, status, iterations
+        return glpk.glp_get_obj_val(self.lp), status, iterations
+
+    def primal_values(self):
+        """Flux per reaction in the last solution."""
+        return np.array([glpk.glp_get_col_prim(self.lp, j + 1)
+                         for j in range(len(self.objective))])
+
+    def _set_column_bounds(self, j, lb, ub):
+        if np.isfinite(lb) and np.isfinite(ub):
+            kind = glpk.GLP_FX if lb == ub else glpk.GLP_DB
+        elif np.isfinite(lb):
+            kind = glpk.GLP_LO
+        elif np.isfinite(ub):
+            kind = glpk.GLP_UP
+        else:
+            kind = glpk.GLP_FR
+        glpk.glp_set_col_bnds(self.lp, int(j) + 1, kind,
+                              float(lb) if np.isfinite(lb) else 0.,
+                              float(ub) if np.isfinite(ub) else 0.)
+
+
+def linprog_method(arrays, method=None):
+    """The LP method for a model, refusing the dense simplex on large models.
+
+    Args:
+        arrays (ModelArrays): the model.
+        method (str): 'glpk' or a linprog method. Defaults to 'highs' if
+                      available, then 'glpk' if swiglpk is installed,
+                      otherwise 'simplex'.
+
+    Returns:
+        str: the method.
+
+    """
+    if method is None:
+        version = tuple(int(v) for v in scipy.__version__.split('.')[:2])
+        if version >= (1, 6):
+            method = 'highs'
+        elif glpk is not None:
+            method = 'glpk'
+        else:
+            method = 'simplex'
+    if method == 'glpk':
+        if glpk is None:
+            raise UserWarning('ERROR: the glpk method needs the swiglpk package')
+        return method
+    size = arrays.stoichiometry.shape[0] * arrays.stoichiometry.shape[1]
+    if not method.startswith('highs') and size > MAX_DENSE_SIZE:
+        raise UserWarning('ERROR: linprog ' + method + ' works on a dense matrix, too slow '
+                          'for a model of ' + str(arrays.stoichiometry.shape[0]) +
+                          ' metabolites x ' + str(arrays.stoichiometry.shape[1]) +
+                          ' reactions; install swiglpk for GLPK, use scipy >= 1.6 '
+                          'for HiGHS, or use a cobra solver')
+    return method
+
+
+def _default_retries(method):
+    if method == 'glpk':
+        return [{'method': 'glpk', 'options': {'presolve': True}},
+                {'method': 'glpk', 'options': {'primal': True}}]
+    if method.startswith('highs'):
+        return [{'method': m} for m in ('highs-ds', 'highs-ipm') if m != method]
+    return [{'method': method, 'options': {'tol': 1.e-9}},
+            {'method': method, 'options': {'bland': True}}]
@@ -0,0 +1,113 @@
+"""Cache of parsed FBA models.
+
+Parsing the yeast 7.6 SBML file takes seconds, and every job used to do it.
+The parsed model and the IDs of its exchange reactions are pickled once,
+under a key made from the hash of the xml file and the cobra version, and
+loaded from there by later calls. Editing the xml file changes the key, so
+a stale cache is never used.
+"""
+
+import os
+import re
+import hashlib
+import cPickle as pickle
+import cobra
+import instrumentation
+
+
+def model_cache_path(modelPath, cacheDir=None):
+    """Cache file for the current content of an SBML file.
+
+    Args:
+        modelPath (str): path to FBA model xml file.
+        cacheDir (str): directory of cached models. Defaults to a 'cache'
+                        directory next to the xml file.
+
+    Returns:
+        str: path of the pickle file.
+
+    """
+    if cacheDir is None:
+        cacheDir = os.path.join(os.path.dirname(modelPath), 'cache')
+    sha1 = hashlib.sha1()
+    with open(modelPath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    sha1.update(cobra.__version__)
+    modelName = os.path.basename(modelPath)[:-4]
+    return os.path.join(cacheDir, modelName + '_' + sha1.hexdigest() + '.pkl')
+
+
+def load_model_and_exchanges(modelPath, cacheDir=None):
+    """Read an FBA model, from the cache if the xml file has not changed.
+
+    Args:
+        modelPath (str): path to FBA model xml file.
+        cacheDir (str): directory of cached models.
+
+    Returns:
+        cobra.model: FBA model.
+        list(cobra.reaction): exchange reactions.
+
+    """
+    cachePath = model_cache_path(modelPath, cacheDir)
+    cached = _read_cache(cachePath)
+    if cached is not None:
+        model, exchangeIDs = cached
+    else:
+        # imported here since fba_utils loads models through this module
+        from fba_utils import get_exchange_reactions
+        with instrumentation.phase('sbml_parse'):
+            model = cobra.io.read_sbml_model(modelPath)
+        exchangeIDs = [r.id for r in get_exchange_reactions(model)]
+        with instrumentation.phase('model_cache_write'):
+            _write_cache(cachePath, (model, exchangeIDs))
+    return model, [model.reactions.get_by_id(rID) for rID in exchangeIDs]
+
+
+def load_model(modelPath, cacheDir=None):
+    """Read an FBA model, from the cache if the xml file has not changed.
+
+    Drop-in replacement for cobra.io.read_sbml_model.
+    """
+    return load_model_and_exchanges(modelPath, cacheDir)[0]
+
+
+def _read_cache(cachePath):
+    # a cache that is missing, or was replaced or removed by another job
+    # between the check and the read, is a cache miss
+    if not os.path.exists(cachePath):
+        return None
+    try:
+        with instrumentation.phase('model_cache_read'):
+            with open(cachePath, 'rb') as f:
+                return pickle.load(f)
+    except Exception:
+        # e.g. IOError, or a truncated or corrupt pickle
+        return None
+
+
+def _write_cache(cachePath, content):
+    cacheDir = os.path.dirname(cachePath)
+    if not os.path.exists(cacheDir):
+        try:
+            os.makedirs(cacheDir)
+        except OSError:
+            if not os.path.isdir(cacheDir):
+                raise
+    # caches of older versions of the xml file, but not of other models whose
+    # names start with this one, e.g. yeast_7.6_curated for yeast_7.6
+    prefix = os.path.basename(cachePath).rsplit('_', 1)[0]
+    oldCache = re.compile(re.escape(prefix) + '_[0-9a-f]{40}\\.pkl$')
+    for fileName in os.listdir(cacheDir):
+        # another job may have just written the current cache
+        if oldCache.match(fileName) and fileName != os.path.basename(cachePath):
+            try:
+                os.remove(os.path.join(cacheDir, fileName))
+            except OSError:
+                pass
+    tmpPath = cachePath + '.' + str(os.getpid()) + '.tmp'
+    with open(tmpPath, 'wb') as f:
+        pickle.dump(content, f, pickle.HIGHEST_PROTOCOL)
+    # rename is atomic, so jobs starting at the same time never read half a file
+    os.rename(tmpPath, cachePath)
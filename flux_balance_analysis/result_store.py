@@ -0,0 +1,346 @@
+"""Knockout results stored as memory-mapped numpy arrays.
+
+A store is a directory containing:
+    axes.json     the labels along each axis, e.g. sorted ORF IDs and media
+    <name>.npy    one array per result, e.g. the genes x media gene-loss costs
+    <name>.json   which axis each dimension of that array runs along
+
+Arrays start out filled with NaN, meaning not calculated yet. Reading an
+array memory-maps it, so e.g. the whole cost matrix is available without
+parsing or copying anything. Next to each cost or growth array is an int8
+array of the status of the LPs behind it (STATUS_CODES), -1 where not
+calculated yet, so failed solves can be found instead of being read as
+growth.
+
+Processes on one machine can write their own slices of the same array at
+the same time. Cluster jobs instead write their results to a small fragment
+file (columns of labels and values, see write_fragment), which is merged
+into the store afterwards, since memory-mapped writes to a shared network
+file system are not safe.
+"""
+
+import os
+import json
+import numpy as np
+from file_utils import write_npz
+
+
+# dimensions of each array: (fragment column, axis) per dimension
+SINGLE_KNOCKOUT_ARRAYS = {
+    'wildtype_growth': [('media', 'media')],
+    'gene_loss_cost': [('genes', 'genes'), ('media', 'media')],
+    'function_loss_cost': [('genes', 'genes'), ('media', 'media')],
+    'gene_loss_status': [('genes', 'genes'), ('media', 'media')],
+    'function_loss_status': [('genes', 'genes'), ('media', 'media')]}
+DOUBLE_KNOCKOUT_ARRAYS = {
+    'double_gene_loss_growth': [('double_media', 'double_media'),
+                                ('gene_a', 'genes'), ('gene_b', 'genes')],
+    'double_function_loss_growth': [('double_media', 'double_media'),
+                                    ('gene_a', 'genes'), ('gene_b', 'genes')],
+    'double_gene_loss_status': [('double_media', 'double_media'),
+                                ('gene_a', 'genes'), ('gene_b', 'genes')],
+    'double_function_loss_status': [('double_media', 'double_media'),
+                                    ('gene_a', 'genes'), ('gene_b', 'genes')]}
+DOUBLE_KNOCKOUT_MEDIA = ['sd_minus_his']
+# solver status of a result, worst last, since a result that needed
+# several LPs gets the worst status of them
+STATUS_CODES = {'not calculated': -1, 'optimal': 0, 'infeasible': 1,
+                'unbounded': 2, 'failed': 3}
+STATUS_ARRAYS = ['gene_loss_status', 'function_loss_status',
+                 'double_gene_loss_status', 'double_function_loss_status']
+
+
+class ResultStore(object):
+    """Directory of memory-mapped result arrays with labelled axes.
+
+    Args:
+        path (str): directory of an existing store.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'axes.json'), 'r') as f:
+            self.axes = {str(name): [str(l) for l in labels]
+                         for name, labels in json.load(f).items()}
+        self._positions = {}
+
+    @classmethod
+    def create(cls, path, axes):
+        """Create a store, or open it if it exists with the same axes.
+
+        Args:
+            path (str): directory of the store.
+            axes (dict(str: list(str))): labels along each axis.
+
+        Returns:
+            ResultStore: the store.
+
+        """
+        if not os.path.exists(path):
+            try:
+                os.makedirs(path)
+            except OSError:
+                if not os.path.isdir(path):
+                    raise
+        axes = {name: list(labels) for name, labels in axes.items()}
+        _write_once(os.path.join(path, 'axes.json'), json.dumps(axes))
+        store = cls(path)
+        if store.axes != axes:
+            raise UserWarning('ERROR: store at ' + path + ' has different axes')
+        return store
+
+    def labels(self, axis):
+        """Labels along an axis."""
+        return self.axes[axis]
+
+    def position(self, axis):
+        """dict(str: int): position of each label along an axis."""
+        if axis not in self._positions:
+            self._positions[axis] = {l: i for i, l in enumerate(self.axes[axis])}
+        return self._positions[axis]
+
+    def has_array(self, name):
+        return os.path.exists(os.path.join(self.path, name + '.npy'))
+
+    def dimensions(self, name):
+        """(fragment column, axis) for each dimension of an array."""
+        with open(os.path.join(self.path, name + '.json'), 'r') as f:
+            return [(str(c), str(a)) for c, a in json.load(f)]
+
+    def create_array(self, name, dimensions, dtype='float64', fill=np.nan):
+        """Add an array, unless one with that name exists already.
+
+        Safe to call from several processes at once.
+
+        Args:
+            name (str): name of the array.
+            dimensions (list(tuple(str, str))): (fragment column, axis) for
+                                                each dimension.
+            dtype (str): numpy data type.
+            fill: initial value of every element.
+
+        """
+        if self.has_array(name):
+            return
+        _write_once(os.path.join(self.path, name + '.json'), json.dumps(dimensions))
+        shape = tuple(len(self.axes[axis]) for _column, axis in dimensions)
+        tmpPath = os.path.join(self.path, name + '.' + str(os.getpid()) + '.tmp.npy')
+        array = np.lib.format.open_memmap(tmpPath, mode='w+', dtype=dtype, shape=shape)
+        array[...] = fill
+        array.flush()
+        del array
+        _link_once(tmpPath, os.path.join(self.path, name + '.npy'))
+
+    def array(self, name, mode='r'):
+        """Memory-mapped array.
+
+        Args:
+            name (str): name of the array.
+            mode (str): 'r' to read, 'r+' to write into it.
+
+        Returns:
+            numpy.memmap: the array.
+
+        """
+        return np.load(os.path.join(self.path, name + '.npy'), mmap_mode=mode)
+
+    def write(self, name, values, **labels):
+        """Write values at the given labels.
+
+        Args:
+            name (str): name of the array.
+            values (array): values to write.
+            **labels: labels per fragment column of the array, either one
+                      per value or a single label shared by all values.
+
+        """
+        values = np.asarray(values)
+        index = []
+        for column, axis in self.dimensions(name):
+            position = self.position(axis)
+            columnLabels = np.atleast_1d(labels[column])
+            positions = np.array([position[str(l)] for l in columnLabels], dtype=int)
+            index.append(np.broadcast_to(positions, values.shape))
+        array = self.array(name, mode='r+')
+        array[tuple(index)] = values
+        if name in DOUBLE_KNOCKOUT_ARRAYS:
+            # gene pairs are unordered
+            array[(index[0], index[2], index[1])] = values
+        array.flush()
+
+    def write_columns(self, columns):
+        """Write results given as fragment columns.
+
+        Args:
+            columns (dict): label columns and value columns, as made by
+                            single_knockout_columns or double_knockout_columns.
+
+        Returns:
+            list(str): names of the arrays that were written to.
+
+        """
+        written = []
+        for name in columns:
+            if self.has_array(name):
+                labels = {column: columns[column]
+                          for column, _axis in self.dimensions(name)}
+                self.write(name, np.asarray(columns[name], dtype=self.array(name).dtype),
+                           **labels)
+                written.append(name)
+        return written
+
+    def merge_fragment(self, path):
+        """Write the results in a fragment file into the store.
+
+        Returns:
+            list(str): names of the arrays that were written to.
+
+        """
+        fragment = np.load(path)
+        return self.write_columns({name: fragment[name] for name in fragment.files})
+
+
+def write_fragment(path, **columns):
+    """Write results to a fragment file, to be merged into a store.
+
+    Args:
+        path (str): output file, ending in .npz.
+        **columns: label columns and value columns, e.g. genes=[...],
+                   media=['glucose AND ammonium'], gene_loss_cost=[...].
+
+    """
+    write_npz(path, **columns)
+
+
+def media_name(carbonSource, nitrogenSource):
+    """Label of a minimal media in the store."""
+    return carbonSource + ' AND ' + nitrogenSource
+
+
+def knockout_store(modelDir, genes=None):
+    """The store of the single and double knockout results of a model.
+
+    Args:
+        modelDir (str): output directory of the model, e.g. '../models/yeast_7.6'.
+        genes (list(str)): sorted ORF IDs of the model. Only needed to
+                           create the store the first time.
+
+    Returns:
+        ResultStore: the store, with all knockout arrays created.
+
+    """
+    path = os.path.join(modelDir, 'results')
+    if genes is None:
+        store = ResultStore(path)
+    else:
+        with open('../data/processed/carbon_sources.txt', 'r') as f:
+            carbonSourceNames = [l.strip() for l in f.readlines()]
+        with open('../data/processed/nitrogen_sources.txt', 'r') as f:
+            nitrogenSourceNames = [l.strip() for l in f.readlines()]
+        store = ResultStore.create(path, {
+            'genes': list(genes),
+            'media': [media_name(c, n) for c in carbonSourceNames
+                      for n in nitrogenSourceNames],
+            'double_media': DOUBLE_KNOCKOUT_MEDIA})
+    create_knockout_arrays(store)
+    return store
+
+
+def create_knockout_arrays(store):
+    """Add the single and double knockout arrays a store does not have yet."""
+    for arrays in (SINGLE_KNOCKOUT_ARRAYS, DOUBLE_KNOCKOUT_ARRAYS):
+        for name, dimensions in arrays.items():
+            if name in STATUS_ARRAYS:
+                store.create_array(name, dimensions, dtype='int8',
+                                   fill=STATUS_CODES['not calculated'])
+            else:
+                store.create_array(name, dimensions)
+
+
+def status_code(status):
+    """Code in STATUS_CODES of a solver status, 'failed' if not known."""
+    return STATUS_CODES.get(status, STATUS_CODES['failed'])
+
+
+def single_knockout_columns(carbonSource, nitrogenSource, wtGrowth, glc, flc,
+                            glcStatus=None, flcStatus=None):
+    """Fragment columns of the single knockouts in one medium.
+
+    Args:
+        carbonSource (str): name of metabolite.
+        nitrogenSource (str): name of metabolite.
+        wtGrowth (float): wildtype growth.
+        glc (dict(str: float)): gene-loss cost per gene.
+        flc (dict(str: float)): function-loss cost per gene.
+        glcStatus (dict(str: int)): optional status code of each gene-loss cost.
+        flcStatus (dict(str: int)): optional status code of each function-loss cost.
+
+    Returns:
+        dict: columns for write_fragment or ResultStore.write.
+
+    """
+    genes = sorted(glc.keys())
+    columns = {'media': [media_name(carbonSource, nitrogenSource)],
+               'genes': genes,
+               # an infeasible wildtype does not grow
+               'wildtype_growth': [wtGrowth if wtGrowth is not None else 0.],
+               'gene_loss_cost': [glc[g] for g in genes],
+               'function_loss_cost': [flc[g] for g in genes]}
+    if glcStatus is not None and flcStatus is not None:
+        columns['gene_loss_status'] = np.array([glcStatus[g] for g in genes], dtype=np.int8)
+        columns['function_loss_status'] = np.array([flcStatus[g] for g in genes], dtype=np.int8)
+    return columns
+
+
+def double_knockout_columns(glcGrowthVals, flcGrowthVals, media=DOUBLE_KNOCKOUT_MEDIA[0],
+                            glcStatus=None, flcStatus=None):
+    """Fragment columns of double knockouts.
+
+    Args:
+        glcGrowthVals (dict((str, str): float)): gene-loss growth per pair.
+        flcGrowthVals (dict((str, str): float)): function-loss growth per pair.
+        media (str): name of the media.
+        glcStatus (dict((str, str): int)): optional status code of each
+                                           gene-loss growth.
+        flcStatus (dict((str, str): int)): optional status code of each
+                                           function-loss growth.
+
+    Returns:
+        dict: columns for write_fragment or ResultStore.write.
+
+    """
+    pairs = sorted(glcGrowthVals.keys())
+    if set(pairs) != set(flcGrowthVals.keys()):
+        raise UserWarning('ERROR: gene-loss and function-loss pairs differ')
+    columns = {'double_media': [media],
+               'gene_a': [a for a, b in pairs],
+               'gene_b': [b for a, b in pairs],
+               'double_gene_loss_growth': [glcGrowthVals[p] for p in pairs],
+               'double_function_loss_growth': [flcGrowthVals[p] for p in pairs]}
+    if glcStatus is not None and flcStatus is not None:
+        columns['double_gene_loss_status'] = np.array([glcStatus[p] for p in pairs],
+                                                      dtype=np.int8)
+        columns['double_function_loss_status'] = np.array([flcStatus[p] for p in pairs],
+                                                          dtype=np.int8)
+    return columns
+
+
+def _write_once(path, content):
+    """Write a file unless it exists, without racing other processes."""
+    if os.path.exists(path):
+        return
+    tmpPath = path + '.' + str(os.getpid()) + '.tmp'
+    with open(tmpPath, 'w') as f:
+        f.write(content)
+    _link_once(tmpPath, path)
+
+
+def _link_once(tmpPath, path):
+    try:
+        os.link(tmpPath, path)
+    except OSError:
+        if not os.path.exists(path):
+            raise
+    finally:
+        os.remove(tmpPath)
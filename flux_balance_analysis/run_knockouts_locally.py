@@ -0,0 +1,187 @@
+"""
+Calculates the single and double knockouts on one machine, using a pool of
+worker processes instead of the cluster batch system.
+
+Each worker reads the model and builds a solver problem once, then takes
+tasks from a shared queue: one medium for the single knockouts, or one gene
+against a block of the genes after it for the double knockouts. Tasks are
+handed out one at a time as workers become free, so the short rows at the
+end of the double-knockout triangle fill in around the long ones.
+
+Results are written straight into the model's result store (see
+result_store.py) by the parent process, and media or rows of gene pairs
+that are already in the store are skipped. The workers share an on-disk
+cache of solved knockouts (see KnockoutCache in knockout_cache.py), so a rerun
+after an interruption does not solve the same LPs again.
+
+With the solver 'linprog' the LPs are solved by scipy instead of a cobra
+solver interface (see model_arrays.py). The double knockout workers then
+load the model exported to arrays by the parent and never build cobra
+objects. This needs scipy >= 1.6 for a model the size of yeast 7.6; with
+older scipy the run stops before starting the workers.
+
+Usage:
+    python run_knockouts_locally.py single|double [number of processes] [solver]
+"""
+
+import os
+import sys
+from multiprocessing import Pool, cpu_count
+import numpy as np
+from fba_utils import *
+from knockout_cache import KnockoutCache
+from knockout_engine import KnockoutEngine
+from model_arrays import ModelArrays, ArrayKnockoutEngine, linprog_method
+from gene_rules import GeneReactionIndex
+from model_cache import load_model, load_model_and_exchanges
+from double_knockout_planner import DoubleKnockoutPlanner
+from single_knockouts import single_knockout_loss_costs
+from double_knockouts import double_knockouts_of_gene
+from result_store import (knockout_store, media_name, single_knockout_columns,
+                          double_knockout_columns)
+
+
+# state of a worker process, set once by the pool initializer
+_worker = {}
+
+
+def _knockout_cache_path(modelPath):
+    return os.path.join('../models/' + modelPath.split('/')[-1][:-4], 'knockout_cache.sqlite')
+
+
+def _arrays_path(modelPath):
+    return os.path.join('../models/' + modelPath.split('/')[-1][:-4], 'sd_minus_his_arrays.npz')
+
+
+def _engine(model, solver, modelPath):
+    cache = KnockoutCache(diskPath=_knockout_cache_path(modelPath))
+    if solver == 'linprog':
+        return ArrayKnockoutEngine(ModelArrays.from_model(model), cache=cache)
+    return KnockoutEngine(model, solver=solver, cache=cache)
+
+
+def _init_single_knockout_worker(modelPath, solver):
+    model, exchangeReactions = load_model_and_exchanges(modelPath)
+    _worker['model'] = model
+    _worker['media'] = MediumConfiguration(model, exchangeReactions)
+    _worker['engine'] = _engine(model, solver, modelPath)
+    _worker['geneRules'] = GeneReactionIndex(model)
+
+
+def _single_knockout_task(media):
+    carbonSource, nitrogenSource = media
+    _worker['media'].set_minimal_media(carbonSource, nitrogenSource,
+                                       engine=_worker['engine'])
+    wtGrowth = _worker['engine'].optimize()
+    grew, glc, flc, glcStatus, flcStatus = single_knockout_loss_costs(
+        _worker['model'], engine=_worker['engine'], geneRules=_worker['geneRules'],
+        withStatus=True)
+    _worker['engine'].cache.flush()
+    return single_knockout_columns(carbonSource, nitrogenSource, wtGrowth, glc, flc,
+                                   glcStatus, flcStatus)
+
+
+def _init_double_knockout_worker(modelPath, solver):
+    if solver == 'linprog':
+        arrays = ModelArrays.load(_arrays_path(modelPath))
+        _worker['model'] = None
+        _worker['engine'] = ArrayKnockoutEngine(
+            arrays, cache=KnockoutCache(diskPath=_knockout_cache_path(modelPath)))
+        _worker['geneRules'] = arrays.gene_index()
+    else:
+        model = load_sd_minus_his(modelPath)
+        _worker['model'] = model
+        _worker['engine'] = _engine(model, solver, modelPath)
+        _worker['geneRules'] = GeneReactionIndex(model)
+    _worker['planner'] = DoubleKnockoutPlanner(_worker['geneRules'], _worker['engine'])
+
+
+def _double_knockout_task(task):
+    index, start, stop = task
+    genes = _worker['geneRules'].genes
+    glc, flc, glcStatus, flcStatus = double_knockouts_of_gene(
+        _worker['model'], genes[index], genes[start:stop], planner=_worker['planner'],
+        withStatus=True)
+    _worker['engine'].cache.flush()
+    return double_knockout_columns(glc, flc, glcStatus=glcStatus, flcStatus=flcStatus)
+
+
+def run_single_knockouts(modelPath, nProcesses, solver=None):
+    """Costs of all single knockouts in every carbon/nitrogen minimal media.
+
+    Args:
+        modelPath (str): path to FBA model xml file.
+        nProcesses (int): number of worker processes.
+        solver (str): name of cobra solver interface, or 'linprog'.
+
+    """
+    with open('../data/processed/carbon_sources.txt', 'r') as f:
+        carbonSourceNames = [l.strip() for l in f.readlines()]
+    with open('../data/processed/nitrogen_sources.txt', 'r') as f:
+        nitrogenSourceNames = [l.strip() for l in f.readlines()]
+    model = load_model(modelPath)
+    if solver == 'linprog':
+        # fail here rather than in every worker
+        linprog_method(ModelArrays.from_model(model))
+    store = knockout_store('../models/' + modelPath.split('/')[-1][:-4],
+                           GeneReactionIndex(model).genes)
+    done = ~np.isnan(store.array('wildtype_growth'))
+    mediaPosition = store.position('media')
+    media = [(c, n) for c in carbonSourceNames for n in nitrogenSourceNames
+             if not done[mediaPosition[media_name(c, n)]]]
+    pool = Pool(nProcesses, _init_single_knockout_worker, (modelPath, solver))
+    try:
+        for columns in pool.imap_unordered(_single_knockout_task, media):
+            store.write_columns(columns)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def run_double_knockouts(modelPath, nProcesses, blockSize=64, solver=None):
+    """Growth of all double knockouts in SD minus histidine media.
+
+    Args:
+        modelPath (str): path to FBA model xml file.
+        nProcesses (int): number of worker processes.
+        blockSize (int): number of gene pairs in one task.
+        solver (str): name of cobra solver interface, or 'linprog'.
+
+    """
+    model = load_sd_minus_his(modelPath)
+    genes = GeneReactionIndex(model).genes
+    store = knockout_store('../models/' + modelPath.split('/')[-1][:-4], genes)
+    missing = np.isnan(store.array('double_function_loss_growth')[0])
+    # tasks of the longest rows first, so they are not left running at the end
+    tasks = [(i, start, min(start + blockSize, len(genes)))
+             for i in range(len(genes) - 1)
+             for start in range(i + 1, len(genes), blockSize)
+             if missing[i, start:start + blockSize].any()]
+    if solver == 'linprog':
+        arrays = ModelArrays.from_model(model)
+        linprog_method(arrays)
+        arrays.save(_arrays_path(modelPath))
+    pool = Pool(nProcesses, _init_double_knockout_worker, (modelPath, solver))
+    try:
+        for columns in pool.imap_unordered(_double_knockout_task, tasks):
+            store.write_columns(columns)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def main():
+    if len(sys.argv) not in (2, 3, 4) or sys.argv[1] not in ('single', 'double'):
+        raise UserWarning('Usage: python run_knockouts_locally.py '
+                          'single|double [number of processes] [solver]')
+    nProcesses = int(sys.argv[2]) if len(sys.argv) >= 3 else cpu_count()
+    solver = sys.argv[3] if len(sys.argv) == 4 else None
+    modelPath = '../data/external/yeast_7.6/yeast_7.6.xml'
+    if sys.argv[1] == 'single':
+        run_single_knockouts(modelPath, nProcesses, solver=solver)
+    else:
+        run_double_knockouts(modelPath, nProcesses, solver=solver)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,35 @@
 import os
 from os import path
-import cobra
+from fba_utils import load_sd_minus_his
+from gene_rules import GeneReactionIndex
+from knockout_engine import KnockoutEngine
+from double_knockout_shards import (partition_pairs, measure_gene_lp_times,
+                                    write_manifest, read_manifest, shard_path,
+                                    MANIFEST_NAME)
 
 
-def send_jobs(modelPath):
+def send_jobs(modelPath, nShards=500):
+    """Split the double knockouts into shards of equal cost and submit them.
+
+    The shard manifest is written once, with the cost of each pair estimated
+    from the time of the single function-loss knockouts of its two genes.
+    Later calls reuse it and only resubmit shards that have no output yet.
+    """
     modelName = modelPath.split('/')[-1][:-4]
     outDir = '../models/' + modelName + '/cluster_output'
     if not path.exists(outDir):
         os.makedirs(outDir)
-    model = cobra.io.read_sbml_model(modelPath)
-    orfs = [g.id for g in model.genes]
-    cmd = 'qsub -V -b y python double_knockouts.py '
-    for i in range(len(model.genes) - 1):
-        if not path.exists(path.join(outDir, 'growth_double_gene_knockouts_' 
-                                             +str(i) + '.pkl')):
+    if not path.exists(path.join(outDir, MANIFEST_NAME)):
+        model = load_sd_minus_his(modelPath)
+        geneRules = GeneReactionIndex(model)
+        # no cache, the repeated solves are what is timed
+        geneCosts = measure_gene_lp_times(KnockoutEngine(model, cache=False), geneRules)
+        write_manifest(outDir, geneRules.genes,
+                       partition_pairs(len(geneRules.genes), nShards, geneCosts))
+    genes, shards = read_manifest(outDir)
+    cmd = 'qsub -V -b y python double_knockouts.py shard '
+    for i in range(len(shards)):
+        if not path.exists(shard_path(outDir, i)):
             os.system(cmd + ' ' + str(i) + ' ' + modelPath)
 
 
@@ -1,5 +1,6 @@
 import sys
 import os
+from single_knockouts import single_knockouts_path
 
 """
 Sends jobs to the computer cluster that calculate the cost for every gene
@@ -18,8 +19,7 @@ def main():
     outDir = '../models/' + modelPath.split('/')[-1][:-4] + '/cluster_output'
     for carbon in carbonSourceNames:
         for nitrogen in nitrogenSourceNames:
-            outPath = os.path.join(outDir, ('gene_loss_cost_' +
-                            carbon + '_AND_' + nitrogen + '.pkl').replace(' ', '_'))
+            outPath = single_knockouts_path(outDir, carbon, nitrogen)
             args = modelPath + ' \\"' + carbon + '\\" \\"' + nitrogen + '\\""'
             if not os.path.exists(outPath):
                 os.system(cmd + args)
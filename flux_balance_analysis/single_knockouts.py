@@ -2,76 +2,177 @@
 
 import sys
 import os
-import cPickle as pickle
 import numpy as np
 import cobra
-from cobra.flux_analysis import single_gene_deletion, single_reaction_deletion
+import instrumentation
 from fba_utils import *
+from knockout_engine import KnockoutEngine
+from gene_rules import GeneReactionIndex
+from knockout_pruning import KnockoutPruner
+from knockout_cache import KnockoutJournal, journal_path, journal_sync_interval
+from result_store import write_fragment, single_knockout_columns, media_name, STATUS_CODES
 
 
-def single_knockout_modified_loss_cost(model):
+def single_knockout_modified_loss_cost(model, engine=None, geneRules=None,
+                                       verbose=False, lethalOnly=False,
+                                       lethalCost=0.999):
     """A modified gene-loss cost that assumes isoenzymes are non-redundant.
 
     Args:
         model (cobra.model): FBA model.
+        engine (KnockoutEngine): solver instance for the model. Built from
+                                 the model if not given.
+        geneRules (GeneReactionIndex): gene to reaction lookups for the
+                                       model. Built from the model if not given.
+        verbose (bool): flag to print out messages.
+        lethalOnly (bool): only test if each knockout is lethal, see
+                           single_knockout_loss_costs.
+        lethalCost (float): with lethalOnly, costs above this are lethal.
 
     Returns:
-        float: growth value after double knockout.
+        dict(str: float): modified gene-loss cost per gene.
 
     """
-    wtGrowth = model.optimize(solver='gurobi').f
+    if engine is None:
+        engine = KnockoutEngine(model)
+    if geneRules is None:
+        geneRules = GeneReactionIndex(model)
+    pruner = KnockoutPruner.from_engine(engine)
+    wtGrowth = pruner.wtGrowth
     lossCosts = {}
-    for orfID in [g.id for g in model.genes]:
-        toKO = [r for r in model.reactions if orfID in r.gene_reaction_rule]
-        oldBounds = [(r.lower_bound, r.upper_bound) for r in toKO]
-        for r in toKO:
-            r.lower_bound = 0.
-            r.upper_bound = 0.
-        growth = model.optimize(solver='gurobi').f
-        # restore model to original state
-        for r, bounds in zip(toKO, oldBounds):
-            r.lower_bound = bounds[0]
-            r.upper_bound = bounds[1]
-        lossCosts[orfID] = (wtGrowth - growth) / wtGrowth
+    for orfID in geneRules.genes:
+        if lethalOnly:
+            lossCosts[orfID] = float(not pruner.grows(engine, geneRules.reactions_of(orfID),
+                                                      (1. - lethalCost) * wtGrowth))
+            continue
+        growth = pruner.knockout(engine, geneRules.reactions_of(orfID))
+        # no optimal solution, e.g. infeasible, is no growth
+        lossCosts[orfID] = (wtGrowth - (growth if growth is not None else 0.)) / wtGrowth
+    if verbose:
+        print pruner
     return lossCosts
 
 
-def single_knockout_loss_costs(model, verbose=False):
+def single_knockout_loss_costs(model, verbose=False, engine=None, geneRules=None,
+                               lethalOnly=False, lethalCost=0.999, withStatus=False):
     """
 
     Args:
         model (cobra.model): FBA model.
         verbose (bool): flag to print out messages.
+        engine (KnockoutEngine): solver instance for the model. Built from
+                                 the model if not given.
+        geneRules (GeneReactionIndex): gene to reaction lookups for the
+                                       model. Built from the model if not given.
+        lethalOnly (bool): for essentiality screens. Each knockout is only
+                           tested for growth at the lethal threshold, with a
+                           feasibility LP, and the costs are 1 for lethal
+                           knockouts and 0 for the rest. The function-loss
+                           cost adds up the costs of the gene's reactions,
+                           so the reactions of genes in more than one
+                           reaction are still solved for growth.
+        lethalCost (float): with lethalOnly, costs above this are lethal.
+        withStatus (bool): also return the status code of each cost, see
+                           result_store.STATUS_CODES. Not with lethalOnly.
 
     Returns:
         bool: did wildtype grow in these conditions.
         dict(str: list(float)): gene-loss cost per gene.
         dict(str: list(float)): function-loss cost per gene.
+        dict(str: int): with withStatus, status code of each gene-loss cost.
+        dict(str: int): with withStatus, status code of each function-loss cost.
 
     """
-    reactionsWithGenesMapped = [r for r in model.reactions if r.gene_reaction_rule != '']
-    wtGrowth = model.optimize(solver='gurobi').f
-    if wtGrowth < 0.01:
+    if lethalOnly and withStatus:
+        raise UserWarning('ERROR: lethalOnly screens do not record the status of each LP')
+    if engine is None:
+        engine = KnockoutEngine(model)
+    if geneRules is None:
+        geneRules = GeneReactionIndex(model)
+    pruner = KnockoutPruner.from_engine(engine)
+    wtGrowth = pruner.wtGrowth
+    if wtGrowth is None or wtGrowth < 0.01:
         if verbose:
             print 'wildtype failed to grow'
-        return False, {}, {}
+        return (False, {}, {}, {}, {}) if withStatus else (False, {}, {})
+    if lethalOnly:
+        return (True,) + _lethal_knockouts(engine, geneRules, pruner, lethalCost, verbose)
     if verbose:
         print 'running gene deletions'
-    geneDelGrowth, geneDelStatus = single_gene_deletion(model, solver='gurobi')
+    geneDelGrowth, geneDelStatus = _growth_and_status(
+        [pruner.knockout_with_status(engine, geneRules.gene_loss_reactions([gene]))
+         for gene in geneRules.genes])
     if verbose:
         print 'finished gene deletions, running reaction deletions'
-    reactionDelGrowth, reactionDelStatus = single_reaction_deletion(model,
-                                        reaction_list=reactionsWithGenesMapped,
-                                        solver='gurobi')
-    genes = geneDelGrowth.keys()
-    geneLossCost = {gene: (wtGrowth - growth) / wtGrowth for gene, growth in geneDelGrowth.items()}
-    ruleLossCost = {model.reactions.get_by_id(reaction).gene_reaction_rule: (wtGrowth - growth) / wtGrowth
-                    for reaction, growth in reactionDelGrowth.items()}
-    funcLossCost = {g: 0. for g in genes}
-    for rule, cost in ruleLossCost.items():
-        for gene in genes_in_rule(rule):
-            funcLossCost[gene] += cost
-    return True, geneLossCost, funcLossCost
+    # reactions without a gene are not deleted, so they add no cost
+    reactionDelGrowth, reactionDelStatus = _growth_and_status(
+        [pruner.knockout_with_status(engine, [i]) if rule != ''
+         else (wtGrowth, STATUS_CODES['optimal'])
+         for i, rule in enumerate(geneRules.rules)])
+    if verbose:
+        print pruner
+        print ((geneDelStatus == STATUS_CODES['failed']).sum() +
+               (reactionDelStatus == STATUS_CODES['failed']).sum()), 'failed LPs'
+    geneLossCost = (wtGrowth - geneDelGrowth) / wtGrowth
+    funcLossCost = geneRules.function_loss_costs((wtGrowth - reactionDelGrowth) / wtGrowth)
+    costs = (True, dict(zip(geneRules.genes, geneLossCost)),
+             dict(zip(geneRules.genes, funcLossCost)))
+    if not withStatus:
+        return costs
+    return costs + (dict(zip(geneRules.genes, geneDelStatus)),
+                    dict(zip(geneRules.genes,
+                             geneRules.function_loss_status(reactionDelStatus))))
+
+
+def _lethal_knockouts(engine, geneRules, pruner, lethalCost, verbose):
+    """Gene-loss and function-loss costs of 1 for lethal knockouts, else 0."""
+    wtGrowth = pruner.wtGrowth
+    minGrowth = (1. - lethalCost) * wtGrowth
+    geneLethal = np.array([not pruner.grows(engine, geneRules.gene_loss_reactions([gene]), minGrowth)
+                           for gene in geneRules.genes], dtype=float)
+    # the function-loss cost is the sum of the reaction costs, so a gene in
+    # several reactions can be lethal without any one of them being lethal
+    exact = geneRules.incidence.T.dot((geneRules.reaction_counts() > 1).astype(float)) > 0.
+    reactionCost = np.zeros(len(geneRules.rules))
+    for i, rule in enumerate(geneRules.rules):
+        if rule == '':
+            continue
+        if exact[i]:
+            growth = pruner.knockout(engine, [i])
+            reactionCost[i] = (wtGrowth - (growth if growth is not None else 0.)) / wtGrowth
+        else:
+            reactionCost[i] = float(not pruner.grows(engine, [i], minGrowth))
+    if verbose:
+        print pruner
+    funcLethal = (geneRules.function_loss_costs(reactionCost) > lethalCost).astype(float)
+    return dict(zip(geneRules.genes, geneLethal)), dict(zip(geneRules.genes, funcLethal))
+
+
+def _growth_array(growth):
+    """Growth values as an array, 0 where the LP had no optimal solution."""
+    return np.array([g if g is not None else 0. for g in growth], dtype=float)
+
+
+def _growth_and_status(results):
+    """Arrays of the (growth, status code) of each knockout, see _growth_array."""
+    return (_growth_array([growth for growth, _status in results]),
+            np.array([status for _growth, status in results], dtype=np.int8))
+
+
+def single_knockouts_path(outDir, carbonSource, nitrogenSource):
+    """Fragment file of the single knockouts in one medium.
+
+    Args:
+        outDir (str): cluster output directory.
+        carbonSource (str): name of metabolite.
+        nitrogenSource (str): name of metabolite.
+
+    Returns:
+        str: path of the npz file.
+
+    """
+    return os.path.join(outDir, ('single_knockouts_' + carbonSource + '_AND_' +
+                                 nitrogenSource + '.npz').replace(' ', '_'))
 
 
 def main():
@@ -81,18 +182,27 @@ def main():
     carbonSource = sys.argv[2]
     nitrogenSource = sys.argv[3]
     modelName = modelPath.split('/')[-1][:-4]
-    model = minimal_media_model(modelPath, carbonSource, nitrogenSource)
-    grew, glc, flc = single_knockout_loss_costs(model, verbose=False)
-    if grew:
-        outDir = '../models/' + modelName + '/cluster_output'
-        if not os.path.exists(outDir):
-            os.makedirs(outDir)
-        suffix = (carbonSource + '_AND_'
-                  + nitrogenSource + '.pkl').replace(' ', '_')
-        with open(os.path.join(outDir, 'gene_loss_cost_' + suffix), 'w') as f:
-            pickle.dump(glc, f)
-        with open(os.path.join(outDir, 'function_loss_cost_' + suffix), 'w') as f:
-            pickle.dump(flc, f)
+    instrumentation.enable_from_environment()
+    with instrumentation.phase('load_model'):
+        model = minimal_media_model(modelPath, carbonSource, nitrogenSource)
+    outDir = '../models/' + modelName + '/cluster_output'
+    outPath = single_knockouts_path(outDir, carbonSource, nitrogenSource)
+    # a rerun of a killed job resumes from the knockouts in the journal
+    journal = KnockoutJournal(journal_path(outPath), syncInterval=journal_sync_interval())
+    engine = KnockoutEngine(model, cache=journal)
+    with instrumentation.phase('single_knockouts'):
+        wtGrowth = engine.optimize()
+        grew, glc, flc, glcStatus, flcStatus = single_knockout_loss_costs(
+            model, verbose=False, engine=engine, withStatus=True)
+    print journal
+    # written also without growth, to record that the medium is done
+    with instrumentation.phase('write_output'):
+        write_fragment(outPath, **single_knockout_columns(carbonSource, nitrogenSource,
+                                                          wtGrowth, glc, flc,
+                                                          glcStatus, flcStatus))
+    journal.remove()
+    instrumentation.write_summary(instrumentation.summary_path(outPath),
+                                  job='single_knockouts ' + media_name(carbonSource, nitrogenSource))
 
 
 if __name__ == '__main__':
@@ -3,32 +3,304 @@ Sanity checks on data and code.
 """
 
 import os
+import gzip
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
 import numpy as np
 import cobra
-from enzyme import enzyme
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from model_cache import load_model, _read_cache, _write_cache
+from enzyme import EnzymeTable
+from gene_rules import GeneReactionIndex, parse_rule, rule_is_active
+from double_knockout_shards import partition_pairs
+from result_store import (knockout_store, ResultStore, create_knockout_arrays, write_fragment,
+                          double_knockout_columns, STATUS_CODES)
+from collate_cluster_output import merge_cluster_output
+from data_pipeline import fetch, run_pipeline
+from genetic_interactions import InteractionIndex, interaction_counts
+from knockout_cache import KnockoutCache, KnockoutJournal
+from model_arrays import ModelArrays, ArrayKnockoutEngine, linprog_method
+from double_knockout_planner import DoubleKnockoutPlanner
+from single_knockouts import single_knockout_loss_costs
+from benchmark import compare_to_baseline, run_benchmark, synthetic_model, media_of_benchmark
+from fba_utils import get_exchange_reactions, minimal_media, MediumConfiguration
+from knockout_engine import KnockoutEngine
+from knockout_pruning import KnockoutPruner
+from media_sweep import knockout_media_sweep, single_gene_knockouts
+from flux_variability import find_blocked_reactions
+import instrumentation
 from warnings import filterwarnings
 
+class TestGeneRules:
+
+    def test_parse_rule(self):
+        assert parse_rule('') is None
+        assert parse_rule('YAL012W') == ('gene', 'YAL012W')
+        assert parse_rule('(YA and YB) or YC') == ('or', (('and', (('gene', 'YA'), ('gene', 'YB'))),
+                                                          ('gene', 'YC')))
+
+    def test_rule_evaluation(self):
+        rule = parse_rule('(YA and YB) or YC')
+        assert rule_is_active(rule, set(['YA']))
+        assert rule_is_active(rule, set(['YC']))
+        assert not rule_is_active(rule, set(['YA', 'YC']))
+
+    def test_gene_id_substring_of_other_gene_id(self):
+        rule = parse_rule('YA-A or YA-B')
+        assert rule_is_active(rule, set(['YA']))
+
+
+def test_double_knockout_shards_cover_each_pair_once():
+    nGenes = 30
+    shards = partition_pairs(nGenes, 7)
+    pairs = [(i, j) for blocks in shards for i, start, stop in blocks
+             for j in range(start, stop)]
+    assert pairs == [(i, j) for i in range(nGenes) for j in range(i + 1, nGenes)]
+    sizes = [len([j for i, start, stop in b for j in range(start, stop)]) for b in shards]
+    assert max(sizes) - min(sizes) <= 1
+
+
+def test_data_pipeline_runs_offline_and_only_redoes_stale_work():
+    tmpDir = tempfile.mkdtemp()
+    try:
+        mirrorPath = os.path.join(tmpDir, 'data.txt.gz')
+        f = gzip.open(mirrorPath, 'wb')
+        f.write('a\nb\n')
+        f.close()
+        manifest = {'downloads': [{'name': 'data', 'url': 'file://' + mirrorPath,
+                                   'sha256': None, 'archive': 'gzip',
+                                   'output': 'external/data.txt'}],
+                    'steps': [{'name': 'count', 'function': 'count',
+                               'inputs': ['external/data.txt'],
+                               'outputs': ['processed/count.txt']}]}
+        manifestPath = os.path.join(tmpDir, 'manifest.json')
+        with open(manifestPath, 'w') as f:
+            json.dump(manifest, f)
+        calls = []
+
+        def count(inPath, outPath):
+            calls.append(inPath)
+            with open(inPath, 'r') as fIn, open(outPath, 'w') as fOut:
+                fOut.write(str(len(fIn.readlines())))
+
+        statePath = os.path.join(tmpDir, 'state.json')
+        run_pipeline(manifestPath, statePath, {'count': count})
+        with open(os.path.join(tmpDir, 'processed/count.txt'), 'r') as f:
+            assert f.read() == '2'
+        run_pipeline(manifestPath, statePath, {'count': count})
+        assert len(calls) == 1
+        # a partial download left by an interrupted run is completed
+        partialPath = os.path.join(tmpDir, 'copy.gz')
+        with open(partialPath + '.part', 'wb') as f:
+            f.write('junk')
+        fetch('file://' + mirrorPath, partialPath)
+        with open(partialPath, 'rb') as f, open(mirrorPath, 'rb') as g:
+            assert f.read() == g.read()
+    finally:
+        shutil.rmtree(tmpDir)
+
+
+class _RangeRequestHandler(BaseHTTPRequestHandler):
+    """Serves one file and honours byte ranges, like a download mirror."""
+    content = ''
+    offsets = []
+
+    def do_GET(self):
+        offset = 0
+        byteRange = self.headers.get('Range')
+        if byteRange:
+            offset = int(byteRange.split('=')[1].rstrip('-'))
+        self.offsets.append(offset)
+        if offset >= len(self.content):
+            self.send_response(416)
+            self.end_headers()
+            return
+        self.send_response(206 if offset else 200)
+        self.send_header('Content-Length', str(len(self.content) - offset))
+        self.end_headers()
+        self.wfile.write(self.content[offset:])
+
+    def log_message(self, *args):
+        pass
+
+
+def test_interrupted_http_download_is_resumed():
+    tmpDir = tempfile.mkdtemp()
+    _RangeRequestHandler.content = ''.join(chr(i % 256) for i in range(10000))
+    _RangeRequestHandler.offsets = []
+    server = HTTPServer(('127.0.0.1', 0), _RangeRequestHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        url = 'http://127.0.0.1:%d/data.gz' % server.server_address[1]
+        path = os.path.join(tmpDir, 'data.gz')
+        with open(path + '.part', 'wb') as f:
+            f.write(_RangeRequestHandler.content[:4000])
+        fetch(url, path)
+        # only the missing bytes were requested, and they were appended
+        assert _RangeRequestHandler.offsets == [4000]
+        with open(path, 'rb') as f:
+            assert f.read() == _RangeRequestHandler.content
+        assert not os.path.exists(path + '.part')
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(tmpDir)
+
+
+def test_downloads_are_checked_against_the_manifest_or_the_first_download():
+    tmpDir = tempfile.mkdtemp()
+    _RangeRequestHandler.content = 'version 1\n' * 1000
+    _RangeRequestHandler.offsets = []
+    server = HTTPServer(('127.0.0.1', 0), _RangeRequestHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        url = 'http://127.0.0.1:%d/data.txt' % server.server_address[1]
+        outPath = os.path.join(tmpDir, 'data.txt')
+        manifest = {'downloads': [{'name': 'data', 'url': url, 'sha256': None,
+                                   'archive': None, 'output': 'data.txt'}],
+                    'steps': []}
+        manifestPath = os.path.join(tmpDir, 'manifest.json')
+        with open(manifestPath, 'w') as f:
+            json.dump(manifest, f)
+        statePath = os.path.join(tmpDir, 'state.json')
+        run_pipeline(manifestPath, statePath, {})
+        # the file changed upstream: resuming would mix the two versions
+        with open(outPath, 'rb') as f:
+            part = f.read(3000)
+        os.remove(outPath)
+        with open(outPath + '.part', 'wb') as f:
+            f.write(part)
+        _RangeRequestHandler.content = 'version 2\n' * 1000
+        try:
+            run_pipeline(manifestPath, statePath, {})
+            assert False, 'a download that differs from the first one is refused'
+        except UserWarning:
+            pass
+        assert not os.path.exists(outPath) and not os.path.exists(outPath + '.part')
+        # with the hash in the manifest a bad partial file is fetched again
+        manifest['downloads'][0]['sha256'] = hashlib.sha256(
+            _RangeRequestHandler.content).hexdigest()
+        with open(manifestPath, 'w') as f:
+            json.dump(manifest, f)
+        with open(outPath + '.part', 'wb') as f:
+            f.write(part)
+        _RangeRequestHandler.offsets = []
+        run_pipeline(manifestPath, statePath, {})
+        assert _RangeRequestHandler.offsets == [3000, 0]
+        with open(outPath, 'rb') as f:
+            assert f.read() == _RangeRequestHandler.content
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(tmpDir)
+
+
+def test_model_cache_replaces_only_older_caches_of_the_same_model():
+    cacheDir = tempfile.mkdtemp()
+    try:
+        old = os.path.join(cacheDir, 'yeast_7.6_' + 'a' * 40 + '.pkl')
+        other = os.path.join(cacheDir, 'yeast_7.6_curated_' + 'b' * 40 + '.pkl')
+        for path in (old, other):
+            with open(path, 'w') as f:
+                f.write('cached')
+        new = os.path.join(cacheDir, 'yeast_7.6_' + 'c' * 40 + '.pkl')
+        _write_cache(new, ('model', []))
+        assert sorted(os.listdir(cacheDir)) == sorted([os.path.basename(new),
+                                                       os.path.basename(other)])
+        assert _read_cache(new) == ('model', [])
+        # a cache removed or cut short by another job is a miss, not an error
+        assert _read_cache(old) is None
+        with open(new, 'wb') as f:
+            f.write('\x80\x02')
+        assert _read_cache(new) is None
+    finally:
+        shutil.rmtree(cacheDir)
+
+
+def test_interaction_index_lookup_and_counts():
+    index = InteractionIndex(['YA', 'YB', 'YC'], [0, 1, 2, 0], [1, 2, 1, 2], [1, 0, -1, -1])
+    assert len(index) == 3
+    # (YC, YB) was measured after (YB, YC), so it is the one kept
+    assert list(index.lookup(['YB', 'YC', 'YA', 'YD'], ['YA', 'YB', 'YC', 'YA'])) == [1, -1, -1, 0]
+    counts = interaction_counts([1, -1, -1], [0.5, -0.5, 0.], [0.1, 1.])
+    assert counts[0, 2, 2] == 1 and counts[0, 0, 0] == 1 and counts[0, 0, 1] == 1
+    assert counts[1, :, 1].sum() == 3
+    counts = interaction_counts([1, 1, -1], [0.5, np.nan, np.nan], [0.1])
+    assert counts.sum() == 1 and counts[0, 2, 2] == 1
+    geneA, geneB = index.positions_in(['YC', 'YB', 'YA', 'YD'])
+    assert list(geneA) == [2, 2, 1] and list(geneB) == [1, 0, 0]
+    try:
+        index.positions_in(['YA', 'YB'])
+        assert False, 'a measured pair with a gene not in the list is refused'
+    except UserWarning:
+        pass
+    geneA, geneB = index.restrict(['YA', 'YB']).positions_in(['YA', 'YB'])
+    assert list(geneA) == [0] and list(geneB) == [1]
+
+
+def test_knockout_cache_evicts_oldest_and_keeps_disk_entries():
+    tmpDir = tempfile.mkdtemp()
+    try:
+        diskPath = os.path.join(tmpDir, 'cache.sqlite')
+        cache = KnockoutCache(maxSize=2, diskPath=diskPath)
+        keys = [('model', 'media', frozenset([i])) for i in range(3)]
+        cache.put(keys[0], 0.5)
+        cache.put(keys[1], None)
+        assert cache.get(keys[0]) == (True, 0.5)
+        cache.put(keys[2], 0.)
+        assert keys[1] not in cache.entries and keys[0] in cache.entries
+        assert cache.get(('model', 'other media', frozenset([0]))) == (False, None)
+        cache.flush()
+        # a new cache, e.g. of a rerun, reads the entries back from disk
+        rerun = KnockoutCache(diskPath=diskPath)
+        assert rerun.get(keys[1]) == (True, None)
+        assert rerun.diskHits == 1 and rerun.misses == 0
+    finally:
+        shutil.rmtree(tmpDir)
+
+
+def test_merge_skips_fragments_still_being_written():
+    tmpDir = tempfile.mkdtemp()
+    try:
+        store = ResultStore.create(os.path.join(tmpDir, 'results'),
+                                   {'genes': ['YA', 'YB'], 'media': ['glucose AND ammonium'],
+                                    'double_media': ['sd_minus_his']})
+        create_knockout_arrays(store)
+        clusterDir = os.path.join(tmpDir, 'cluster_output')
+        write_fragment(os.path.join(clusterDir, 'double_knockouts_0.npz'),
+                       **double_knockout_columns({('YA', 'YB'): 0.5}, {('YA', 'YB'): 0.25}))
+        # a half-written fragment of a running job
+        with open(os.path.join(clusterDir, 'double_knockouts_1.1234.tmp.npz'), 'w') as f:
+            f.write('PK')
+        assert merge_cluster_output(store, clusterDir) == 1
+        assert store.array('double_gene_loss_growth')[0, 1, 0] == 0.5
+    finally:
+        shutil.rmtree(tmpDir)
+
+
 class TestFBAModel:
 
     def setup_class(self):
         modelPath='../data/external/yeast_7.6/yeast_7.6.xml'
         filterwarnings('ignore', 'charge of s_[0-9][0-9][0-9][0-9] is not a number ()')
         filterwarnings('ignore', 'uppercase AND/OR found in rule ')
-        self.model = cobra.io.read_sbml_model(modelPath)
+        self.model = load_model(modelPath)
         modelDir = '../models/yeast_7.6'
-        self.genes = {g.id: enzyme(g.id) for g in self.model.genes}
-        for g in self.model.genes:
-            self.genes[g.id].reactionRules = [r.gene_reaction_rule for r in g.reactions]
-        with open(os.path.join(modelDir, 'gene_loss_costs.tsv'), 'r') as f:
-            lines = f.readlines()
-            minimalMedia = [tuple(m.split(' AND ')) for m in lines[0].strip().split('\t')[1:]]
-            for line in lines[1:]:
-                self.genes[line.split('\t')[0]].geneLossCosts = np.array([float(i.strip())
-                                                         for i in line.split('\t')[1:]])
-        with open(os.path.join(modelDir, 'function_loss_costs.tsv'), 'r') as f:
-            for line in f.readlines()[1:]:
-                self.genes[line.split('\t')[0]].functionLossCosts = np.array([float(i.strip())
-                                                             for i in line.split('\t')[1:]])
+        self.geneRules = GeneReactionIndex(self.model)
+        self.enzymes = EnzymeTable.from_index(self.geneRules)
+        store = knockout_store(modelDir)
+        grew = store.array('wildtype_growth') >= 0.01
+        rows = [store.position('genes')[g] for g in self.enzymes.genes]
+        self.enzymes.set_costs(store.array('gene_loss_cost')[rows][:, grew],
+                               store.array('function_loss_cost')[rows][:, grew])
+        self.genes = self.enzymes.enzymes()
 
     def test_gene_to_reaction_rules_sensible(self):
         rules = [r.gene_reaction_rule for r in self.model.reactions]
@@ -53,6 +325,22 @@ class TestFBAModel:
         assert len([g for g in self.genes.values() if g.is_isoenzyme()
                                         and g.is_simple_single_function()]) == 0
 
+    def test_enzyme_classes_match_reaction_rules(self):
+        for g in self.genes.values():
+            assert g.is_isoenzyme() == any(['or' in rule for rule in g.reactionRules])
+            assert g.is_multifunctional() == (len(g.reactionRules) > 1)
+            assert g.is_simple_single_function() == (g.reactionRules == [g.name])
+
+    def test_enzyme_table_matches_enzymes(self):
+        identical = self.enzymes.old_and_new_costs_identical()
+        disagree = self.enzymes.num_environments_disagree()
+        hybrid = self.enzymes.hybrid_cost_2()
+        for i, orfID in enumerate(self.enzymes.genes):
+            g = self.genes[orfID]
+            assert identical[i] == g.old_and_new_costs_identical()
+            assert disagree[i] == g.num_environments_disagree()
+            assert np.array_equal(hybrid[i], g.hybrid_cost_2())
+
 
 
 
@@ -97,3 +385,251 @@ class TestFBAModel:
         assert countOldEqual == nIsoSimplePairs
         assert countNewEqual == nIsoSimplePairs
         assert countOldZero == nIsoSimplePairs
+
+
+def _isoenzyme_arrays(minGrowth=0.):
+    """Two isoenzymes YA, YB of one reaction, YC alone in a parallel one."""
+    return ModelArrays(['uptake', 'r1', 'r2', 'biomass'], ['A', 'B'],
+                       np.array([[1., -1., -1., 0.], [0., 1., 1., -1.]]),
+                       [0., 0., 0., minGrowth], [10., 3., 5., 1000.], [0., 0., 0., 1.],
+                       ['YA', 'YB', 'YC'], ['', 'YA or YB', 'YC', ''])
+
+
+def test_array_engine_knockouts_of_saved_model():
+    arrays = _isoenzyme_arrays()
+    tmpDir = tempfile.mkdtemp()
+    try:
+        arrays.save(os.path.join(tmpDir, 'arrays.npz'))
+        arrays = ModelArrays.load(os.path.join(tmpDir, 'arrays.npz'))
+    finally:
+        shutil.rmtree(tmpDir)
+    geneRules = arrays.gene_index()
+    engine = ArrayKnockoutEngine(arrays, cache=False)
+    assert abs(engine.optimize() - 8.) < 1e-6
+    assert abs(engine.knockout(geneRules.gene_loss_reactions(['YA'])) - 8.) < 1e-6
+    assert abs(engine.knockout(geneRules.gene_loss_reactions(['YA', 'YB'])) - 5.) < 1e-6
+    assert abs(engine.knockout(geneRules.function_loss_reactions(['YA', 'YC']))) < 1e-6
+    assert engine.grows([1], 5.) and not engine.grows([1], 5.1)
+
+
+def test_glpk_engine_changes_only_bounds_between_knockouts():
+    arrays = _isoenzyme_arrays(minGrowth=1.)
+    geneRules = arrays.gene_index()
+    engine = ArrayKnockoutEngine(arrays, method='glpk', cache=False)
+    assert abs(engine.optimize() - 8.) < 1e-6
+    assert np.allclose(engine.fluxes(), [8., 3., 5., 8.])
+    assert abs(engine.knockout(geneRules.gene_loss_reactions(['YA'])) - 8.) < 1e-6
+    assert abs(engine.knockout(geneRules.gene_loss_reactions(['YA', 'YB'])) - 5.) < 1e-6
+    assert engine.knockout(geneRules.function_loss_reactions(['YA', 'YC'])) is None
+    assert engine.status == 'infeasible'
+    assert engine.grows([1], 5.) and not engine.grows([1], 5.1)
+    # the knocked out bounds are restored for the next solve
+    assert abs(engine.optimize() - 8.) < 1e-6
+
+
+def test_dense_simplex_is_refused_on_large_models():
+    n = 600
+    arrays = ModelArrays(['r' + str(i) for i in range(n)], ['m' + str(i) for i in range(n)],
+                         np.eye(n), np.zeros(n), np.ones(n), np.ones(n), [], [''] * n)
+    assert linprog_method(arrays, 'highs') == 'highs'
+    try:
+        linprog_method(arrays, 'simplex')
+        assert False
+    except UserWarning:
+        pass
+
+
+def test_lethal_screen_adds_up_the_reaction_costs_of_a_gene():
+    # YA is in two parallel reactions that each carry half the flux, so
+    # neither is lethal on its own but its function-loss cost is 1
+    arrays = ModelArrays(['uptake', 'r1', 'r2', 'biomass'], ['A', 'B'],
+                         np.array([[1., -1., -1., 0.], [0., 1., 1., -1.]]),
+                         [0., 0., 0., 0.], [10., 5., 5., 1000.], [0., 0., 0., 1.],
+                         ['YA', 'YB'], ['', 'YA', 'YA or YB', ''])
+    engine = ArrayKnockoutEngine(arrays, cache=False)
+    geneRules = arrays.gene_index()
+    _grew, glc, flc = single_knockout_loss_costs(None, engine=engine, geneRules=geneRules)
+    _grew, glcLethal, flcLethal = single_knockout_loss_costs(None, engine=engine,
+                                                             geneRules=geneRules,
+                                                             lethalOnly=True)
+    assert flc['YA'] > 0.999 and flcLethal == {'YA': 1., 'YB': 0.}
+    assert glc['YA'] < 0.999 and glcLethal == {'YA': 0., 'YB': 0.}
+
+
+def test_knockout_status_is_kept_with_growth():
+    # with a minimum growth, so losing both reactions is infeasible
+    arrays = _isoenzyme_arrays(minGrowth=1.)
+    geneRules = arrays.gene_index()
+    planner = DoubleKnockoutPlanner(geneRules, ArrayKnockoutEngine(arrays, cache=KnockoutCache()))
+    geneGrowth, functionGrowth, geneStatus, functionStatus = planner.solve_both_with_status(
+        [('YA', 'YB'), ('YA', 'YC')])
+    assert list(geneStatus) == [STATUS_CODES['optimal']] * 2
+    assert list(functionStatus) == [STATUS_CODES['optimal'], STATUS_CODES['infeasible']]
+    assert abs(functionGrowth[0] - 5.) < 1e-6 and functionGrowth[1] == 0.
+    # the same reaction set is not solved again and keeps its status
+    assert list(planner.solve_with_status([('YC', 'YA')], 'function')[1]) == [STATUS_CODES['infeasible']]
+    assert list(geneRules.function_loss_status([0, 1, 3, 0])) == [1, 1, 3]
+
+
+def test_minimal_media_matches_setting_bounds_reaction_by_reaction():
+
+    def baseline_exchange_reactions(model):
+        S = model.to_array_based_model().S
+        return [model.reactions[i] for i in np.flatnonzero(((S != 0.).sum(axis=0) == 1).A1)]
+
+    def baseline_minimal_media(model, carbonSource, nitrogenSource):
+        for r in baseline_exchange_reactions(model):
+            if r.name in (carbonSource + ' exchange', nitrogenSource + ' exchange'):
+                r.lower_bound = -20. if carbonSource == nitrogenSource else -10.
+            else:
+                r.lower_bound = 0.
+
+    def baseline_minimal_media_model(model, carbonSource, nitrogenSource):
+        byName = {r.name: r for r in baseline_exchange_reactions(model)}
+        byName['D-glucose exchange'].lower_bound = 0.
+        byName['ammonium exchange'].lower_bound = 0.
+        byName[carbonSource + ' exchange'].lower_bound = -10.
+        byName[nitrogenSource + ' exchange'].lower_bound = -10.
+
+    def lower_bounds(model):
+        return [r.lower_bound for r in model.reactions]
+
+    expected = synthetic_model(20)
+    model = synthetic_model(20)
+    assert ([r.id for r in get_exchange_reactions(model)] ==
+            [r.id for r in baseline_exchange_reactions(model)])
+    # each medium is set starting from the previous one
+    for carbonSource, nitrogenSource in media_of_benchmark():
+        baseline_minimal_media(expected, carbonSource, nitrogenSource)
+        minimal_media(model, carbonSource, nitrogenSource)
+        assert lower_bounds(model) == lower_bounds(expected)
+    model = synthetic_model(20)
+    engine = KnockoutEngine(model, cache=False)
+    mediumConfig = MediumConfiguration(model)
+    for carbonSource, nitrogenSource in media_of_benchmark():
+        expected = synthetic_model(20)
+        baseline_minimal_media_model(expected, carbonSource, nitrogenSource)
+        mediumConfig.set_minimal_media(carbonSource, nitrogenSource, engine=engine)
+        assert lower_bounds(model) == lower_bounds(expected)
+        assert list(engine.lowerBounds) == lower_bounds(expected)
+        assert abs(engine.optimize() - expected.optimize().f) < 1e-6
+
+
+def test_media_sweep_matches_knockouts_solved_medium_by_medium():
+    model = synthetic_model(20)
+    # no nitrogen source in the last medium, so no growth
+    media = media_of_benchmark()[:3] + [('carbon source 1', 'carbon source 2')]
+    knockouts = single_gene_knockouts(GeneReactionIndex(model), 'gene')
+    names, wtGrowth, costs = knockout_media_sweep(model, media, knockouts=knockouts)
+    assert names == sorted(knockouts)
+    assert wtGrowth[-1] < 0.01 and np.isnan(costs[:, -1]).all()
+    engine = KnockoutEngine(model, cache=False)
+    mediumConfig = MediumConfiguration(model)
+    for j, (carbonSource, nitrogenSource) in enumerate(media[:-1]):
+        mediumConfig.set_minimal_media(carbonSource, nitrogenSource, engine=engine)
+        pruner = KnockoutPruner.from_engine(engine)
+        assert abs(pruner.wtGrowth - wtGrowth[j]) < 1e-6
+        for i, name in enumerate(names):
+            growth = pruner.knockout(engine, knockouts[name])
+            growth = growth if growth is not None else 0.
+            assert abs(costs[i, j] - (pruner.wtGrowth - growth) / pruner.wtGrowth) < 1e-6
+    _names, _wtGrowth, lethal = knockout_media_sweep(model, media, knockouts=knockouts,
+                                                     lethalOnly=True)
+    assert np.isnan(lethal[:, -1]).all()
+    assert np.array_equal(lethal[:, :-1], (costs[:, :-1] > 0.999).astype(float))
+
+
+def test_blocked_reactions_match_maximizing_and_minimizing_each_reaction():
+
+    def model_with_dead_end():
+        model = synthetic_model(20)
+        # consumes a metabolite that nothing makes
+        deadEnd = cobra.Reaction('dead_end')
+        deadEnd.add_metabolites({cobra.Metabolite('orphan', compartment='c'): -1.,
+                                 model.metabolites[0]: 1.})
+        deadEnd.lower_bound = 0.
+        deadEnd.upper_bound = 1000.
+        model.add_reaction(deadEnd)
+        for r in get_exchange_reactions(model):
+            r.lower_bound = -10.
+        return model
+
+    model = model_with_dead_end()
+    expected = set()
+    for reaction in model.reactions:
+        model.objective = reaction.id
+        values = [model.optimize(objective_sense=sense).f for sense in ('maximize', 'minimize')]
+        if all(v is not None and abs(v) <= 1e-9 for v in values):
+            expected.add(reaction.id)
+    assert 'dead_end' in expected
+    model = model_with_dead_end()
+    assert find_blocked_reactions(model) == expected
+    assert find_blocked_reactions(model, nProcesses=2) == expected
+
+
+def test_benchmark_runs_on_a_small_synthetic_model():
+    results = run_benchmark(nGenes=20)
+    assert results['model']['genes'] >= 20
+    phases = results['phases']
+    for name in ('model_load_sbml', 'single_knockout_loss_costs',
+                 'double_function_knockouts', 'collation', 'blocked_reaction_scan'):
+        assert name in phases
+    assert phases['single_knockout_loss_costs']['lps'] > 0
+    assert all(p['peak_rss_increase_mb'] >= 0. for p in phases.values())
+
+
+def test_benchmark_flags_only_phases_slower_than_tolerance():
+    model = {'genes': 10}
+    baseline = {'model': model, 'phases': {'a': {'seconds': 1.}, 'b': {'seconds': 1.},
+                                           'c': {'seconds': 0.01}}}
+    results = {'model': model, 'phases': {'a': {'seconds': 1.1}, 'b': {'seconds': 1.5},
+                                          'c': {'seconds': 0.03}, 'd': {'seconds': 9.}}}
+    regressions = compare_to_baseline(results, baseline, tolerance=0.2)
+    assert len(regressions) == 1 and regressions[0].startswith('b:')
+
+
+def test_instrumentation_summaries_add_up_and_nothing_is_recorded_when_disabled():
+    tmpDir = tempfile.mkdtemp()
+    try:
+        paths = []
+        for job in range(2):
+            instrumentation.enable()
+            with instrumentation.phase('solve'):
+                instrumentation.record_solve(0.5, 'optimal', 10)
+                instrumentation.record_solve(0.5, 'infeasible')
+            instrumentation.count('knockouts_skipped', 3)
+            paths.append(os.path.join(tmpDir, str(job) + '.profile.json'))
+            instrumentation.write_summary(paths[-1], job=str(job))
+            instrumentation.disable()
+        instrumentation.count('knockouts_skipped')
+        instrumentation.write_summary(os.path.join(tmpDir, 'disabled.profile.json'))
+        assert not os.path.exists(os.path.join(tmpDir, 'disabled.profile.json'))
+        report = instrumentation.aggregate_summaries(paths)
+        assert report['jobs'] == 2 and report['phases']['solve']['calls'] == 2
+        assert report['lp']['solves'] == 4 and report['lp']['status'] == {'optimal': 2, 'infeasible': 2}
+        assert report['lp']['iterations'] == 20 and report['counters']['knockouts_skipped'] == 6
+    finally:
+        instrumentation.disable()
+        shutil.rmtree(tmpDir)
+
+
+def test_knockout_journal_resumes_a_killed_job():
+    tmpDir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpDir, 'job.journal')
+        journal = KnockoutJournal(path, cache=KnockoutCache())
+        journal.put(('model', 'media', frozenset([3, 1])), 0.25)
+        journal.put(('model', 'media', frozenset([2])), None)
+        journal.close()
+        # a job killed while writing a line
+        with open(path, 'a') as f:
+            f.write('model:media:4\t0.')
+        resumed = KnockoutJournal(path, cache=KnockoutCache())
+        assert resumed.get(('model', 'media', frozenset([1, 3]))) == (True, 0.25)
+        assert resumed.get(('model', 'media', frozenset([2]))) == (True, None)
+        assert resumed.get(('model', 'media', frozenset([4]))) == (False, None)
+        assert resumed.resumed == 2
+        resumed.remove()
+        assert not os.path.exists(path)
+    finally:
+        shutil.rmtree(tmpDir)